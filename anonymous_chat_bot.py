@@ -5,8 +5,10 @@ import time
 import random
 import re
 import hashlib
+import heapq
+from collections import OrderedDict, deque
 from datetime import datetime, timedelta
-from typing import Dict, List, Set, Optional, Union
+from typing import Deque, Dict, FrozenSet, List, Set, Optional, Tuple, Union
 
 from telegram import (
     Update, 
@@ -27,6 +29,7 @@ from telegram.ext import (
 from telegram.error import TelegramError
 
 import database
+from database import UNLOCK_POINTS_REQUIRED  # unlock points needed to auto-unlock a locked account
 
 # Configure logging
 logging.basicConfig(
@@ -42,10 +45,20 @@ logging.getLogger("telegram.ext").setLevel(logging.WARNING)
 # Configuration
 TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 ADMIN_ID = 1395596220  # Fixed admin ID
-RETRY_MATCHING_INTERVAL = 10  # seconds between matching retries
-MAX_RETRY_ATTEMPTS = 12  # Maximum retry attempts (2 minutes)
+MATCH_WAIT_TIMEOUT = 120  # seconds a queued user waits for a partner (2 minutes)
+# Batch matching: pair the whole queue every N ms instead of per arrival (0 = off)
+BATCH_MATCHING_INTERVAL_MS = int(os.getenv('BATCH_MATCHING_INTERVAL_MS', '0'))
+# Preference matching: seconds before a waiter accepts any language, then any gender
+PREFERENCE_WIDEN_LANGUAGE_AFTER = float(os.getenv('PREFERENCE_WIDEN_LANGUAGE_AFTER', '20'))
+PREFERENCE_WIDEN_GENDER_AFTER = float(os.getenv('PREFERENCE_WIDEN_GENDER_AFTER', '60'))
+# Interest matching: waiters sampled and scored per match attempt before falling back to random
+INTEREST_SEARCH_BUDGET = int(os.getenv('INTEREST_SEARCH_BUDGET', '32'))
+# Recent-partner avoidance: last N partners remembered per user, for at most this many users
+RECENT_PARTNER_MEMORY = int(os.getenv('RECENT_PARTNER_MEMORY', '3'))
+RECENT_PARTNER_MAX_USERS = int(os.getenv('RECENT_PARTNER_MAX_USERS', '100000'))
+# Startup recovery: chats still open in chat_sessions but older than this are closed
+SESSION_RECOVERY_MAX_AGE_HOURS = float(os.getenv('SESSION_RECOVERY_MAX_AGE_HOURS', '12'))
 
-UNLOCK_POINTS_REQUIRED = 5.0   # unlock points needed to auto-unlock a locked account
 REFERRAL_POINTS = 1.0          # points awarded per successful referral
 UNLOCK_REFERRAL_POINTS = 0.5   # points awarded per referral while locked
 
@@ -195,9 +208,9 @@ def get_text(key: str, lang: str = 'en') -> str:
         lang = 'en'
     return TRANSLATIONS.get(lang, TRANSLATIONS['en']).get(key, TRANSLATIONS['en'].get(key, key))
 
-def get_user_lang(db, user_id: int) -> str:
-    """Get user's preferred language from database"""
-    user = database.get_user(db, user_id)
+async def get_user_lang(user_id: int) -> str:
+    """Get user's preferred language"""
+    user = await database.get_user_snapshot(user_id)
     if user and user.language:
         return user.language
     return 'en'
@@ -535,12 +548,22 @@ class Keyboards:
             [InlineKeyboardButton("✏️ Edit Profile", callback_data='edit_profile')],
             [InlineKeyboardButton("💭 Set Interests", callback_data='set_interests')],
             [InlineKeyboardButton("😊 Set Mood", callback_data='set_mood')],
+            [InlineKeyboardButton("🎯 Match Preference", callback_data='set_match_preference')],
             [InlineKeyboardButton("💾 Saved Chats", callback_data='view_saved_chats')],
             [InlineKeyboardButton("🔗 My Referral Link", callback_data='referral_menu')],
             [InlineKeyboardButton("🌐 Language", callback_data='change_language')],
             [InlineKeyboardButton("🔙 Back to Menu", callback_data='main_menu')]
         ])
 
+    @staticmethod
+    def match_preference_selection():
+        return InlineKeyboardMarkup([
+            [InlineKeyboardButton("🎲 Anyone", callback_data='match_pref_any')],
+            [InlineKeyboardButton("👨 Male", callback_data='match_pref_male'),
+             InlineKeyboardButton("👩 Female", callback_data='match_pref_female')],
+            [InlineKeyboardButton("🔙 Back", callback_data='view_profile')]
+        ])
+
     @staticmethod
     def language_selection():
         return InlineKeyboardMarkup([
@@ -575,202 +598,694 @@ class Keyboards:
             [InlineKeyboardButton("🔙 Main Menu", callback_data='main_menu')]
         ])
 
+class WaitingPool:
+    """Users waiting for a partner — O(1) add, remove, membership and random pick.
+
+    Members live in a dense list with a user_id -> index map, so removal swaps
+    the last member into the freed slot instead of shifting the list.
+    """
+
+    def __init__(self):
+        self._members: List[int] = []
+        self._index: Dict[int, int] = {}
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._index
+
+    def __len__(self) -> int:
+        return len(self._members)
+
+    def __iter__(self):
+        return iter(list(self._members))
+
+    def add(self, user_id: int) -> bool:
+        """Add user to the pool, returns False if already waiting"""
+        if user_id in self._index:
+            return False
+        self._index[user_id] = len(self._members)
+        self._members.append(user_id)
+        return True
+
+    def discard(self, user_id: int) -> bool:
+        """Remove user from the pool, returns False if not waiting"""
+        index = self._index.pop(user_id, None)
+        if index is None:
+            return False
+        last = self._members.pop()
+        if index < len(self._members):
+            self._members[index] = last
+            self._index[last] = index
+        return True
+
+    def random_member(self, exclude: Optional[int] = None) -> Optional[int]:
+        """Pick a random waiting user other than `exclude`"""
+        size = len(self._members)
+        excluded_index = self._index.get(exclude) if exclude is not None else None
+        if excluded_index is None:
+            return self._members[random.randrange(size)] if size else None
+        if size < 2:
+            return None
+        # Draw from every slot but the last; a hit on the excluded slot maps to the last one
+        index = random.randrange(size - 1)
+        if index == excluded_index:
+            index = size - 1
+        return self._members[index]
+
+
+# (gender, language or None, wanted gender or None) — None means "any"
+BucketKey = Tuple[str, Optional[str], Optional[str]]
+
+
+class PreferenceQueues:
+    """Waiting users split into buckets by what they are and what they accept.
+
+    A bucket key is (gender, language, wanted gender). Users without a
+    preference, or who have waited past the widening thresholds, sit in
+    buckets whose language / wanted gender is None. Two keys are compatible
+    when each side accepts the other, so a match attempt only looks at the
+    handful of non-empty bucket keys, never at individual waiters.
+    """
+
+    def __init__(self):
+        self.buckets: Dict[BucketKey, WaitingPool] = {}
+        self.keys: Dict[int, BucketKey] = {}
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self.keys
+
+    @staticmethod
+    def compatible(key_a: BucketKey, key_b: BucketKey) -> bool:
+        gender_a, language_a, wanted_a = key_a
+        gender_b, language_b, wanted_b = key_b
+        return ((wanted_a is None or wanted_a == gender_b)
+                and (wanted_b is None or wanted_b == gender_a)
+                and (language_a is None or language_b is None or language_a == language_b))
+
+    def add(self, user_id: int, key: BucketKey):
+        self.discard(user_id)
+        self.keys[user_id] = key
+        self.buckets.setdefault(key, WaitingPool()).add(user_id)
+
+    def discard(self, user_id: int):
+        key = self.keys.pop(user_id, None)
+        if key is None:
+            return
+        bucket = self.buckets[key]
+        bucket.discard(user_id)
+        if not bucket:
+            del self.buckets[key]
+
+    def widen(self, user_id: int, language: bool = False, gender: bool = False):
+        """Move a waiter to a wider bucket (any language and/or any gender)"""
+        key = self.keys.get(user_id)
+        if key is None:
+            return
+        gender_key, language_key, wanted_key = key
+        self.add(user_id, (gender_key, None if language else language_key, None if gender else wanted_key))
+
+    def accepts(self, user_a_id: int, user_b_id: int) -> bool:
+        """Whether two waiters' buckets are compatible"""
+        key_a = self.keys.get(user_a_id)
+        key_b = self.keys.get(user_b_id)
+        return key_a is not None and key_b is not None and self.compatible(key_a, key_b)
+
+    def pick(self, user_id: int) -> Optional[int]:
+        """Pick a random waiter compatible with `user_id`, uniform across buckets"""
+        key = self.keys.get(user_id)
+        if key is None:
+            return None
+        candidates = []
+        total = 0
+        for bucket_key, bucket in self.buckets.items():
+            if self.compatible(key, bucket_key):
+                size = len(bucket) - (1 if user_id in bucket else 0)
+                if size:
+                    candidates.append((bucket, size))
+                    total += size
+        if not total:
+            return None
+        offset = random.randrange(total)
+        for bucket, size in candidates:
+            if offset < size:
+                return bucket.random_member(exclude=user_id)
+            offset -= size
+        return None
+
+    def scan(self, user_id: int, accept) -> Optional[int]:
+        """First compatible waiter for which accept(candidate) holds, by linear scan"""
+        key = self.keys.get(user_id)
+        if key is None:
+            return None
+        for bucket_key, bucket in self.buckets.items():
+            if not self.compatible(key, bucket_key):
+                continue
+            for candidate in bucket:
+                if candidate != user_id and accept(candidate):
+                    return candidate
+        return None
+
+
+class InterestIndex:
+    """Inverted index from interest name to the waiters who listed it.
+
+    A match attempt samples at most `budget` waiters from the pools of the
+    user's own interests and scores them by overlap, so the cost is bounded
+    no matter how many people are waiting or how popular an interest is.
+    """
+
+    def __init__(self):
+        self.pools: Dict[str, WaitingPool] = {}
+        self.interests: Dict[int, FrozenSet[str]] = {}
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self.interests
+
+    def add(self, user_id: int, interests):
+        self.discard(user_id)
+        interests = frozenset(interests)
+        if not interests:
+            return
+        self.interests[user_id] = interests
+        for name in interests:
+            self.pools.setdefault(name, WaitingPool()).add(user_id)
+
+    def discard(self, user_id: int):
+        for name in self.interests.pop(user_id, ()):
+            pool = self.pools[name]
+            pool.discard(user_id)
+            if not pool:
+                del self.pools[name]
+
+    def best_match(self, user_id: int, accept, budget: int = INTEREST_SEARCH_BUDGET) -> Optional[int]:
+        """Highest-overlap waiter among a bounded sample, or None if none share an interest"""
+        interests = self.interests.get(user_id)
+        if not interests or budget <= 0:
+            return None
+        pools = [self.pools[name] for name in interests]
+        random.shuffle(pools)
+        per_pool = max(1, budget // len(pools))
+        best, best_score, seen = None, 0, set()
+        for pool in pools:
+            for _ in range(min(per_pool, len(pool) - 1)):
+                if len(seen) >= budget:
+                    return best
+                candidate = pool.random_member(exclude=user_id)
+                if candidate is None or candidate in seen:
+                    continue
+                seen.add(candidate)
+                if not accept(candidate):
+                    continue
+                score = len(interests & self.interests[candidate])
+                if score > best_score:
+                    best, best_score = candidate, score
+                    if score == len(interests):
+                        return best
+        return best
+
+
+class RecentPartners:
+    """The last few partners of each user, so a skip does not rematch the same pair.
+
+    Each user keeps a ring of up to `size` partner ids (a small tuple rather
+    than a deque to keep memory per user low). Tracked users are capped at
+    `max_users`, evicting whoever was matched least recently.
+    """
+
+    def __init__(self, size: int = RECENT_PARTNER_MEMORY, max_users: int = RECENT_PARTNER_MAX_USERS):
+        self.size = size
+        self.max_users = max_users
+        self.partners: 'OrderedDict[int, Tuple[int, ...]]' = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.partners)
+
+    def _push(self, user_id: int, partner_id: int):
+        ring = self.partners.get(user_id, ())
+        self.partners[user_id] = (ring + (partner_id,))[-self.size:]
+        self.partners.move_to_end(user_id)
+        if len(self.partners) > self.max_users:
+            self.partners.popitem(last=False)
+
+    def remember(self, user_a_id: int, user_b_id: int):
+        if self.size <= 0 or self.max_users <= 0:
+            return
+        self._push(user_a_id, user_b_id)
+        self._push(user_b_id, user_a_id)
+
+    def is_recent(self, user_a_id: int, user_b_id: int) -> bool:
+        return user_b_id in self.partners.get(user_a_id, ()) or user_a_id in self.partners.get(user_b_id, ())
+
+
+class ChatSessionRecord:
+    """In-memory record of one live chat, shared by both participants"""
+
+    __slots__ = ('user_a_id', 'user_b_id', 'session_id', 'started_at', 'ended_by')
+
+    def __init__(self, user_a_id: int, user_b_id: int, session_id: Optional[int] = None,
+                 started_at: Optional[datetime] = None):
+        self.user_a_id = user_a_id
+        self.user_b_id = user_b_id
+        self.session_id = session_id  # chat_sessions.id once persisted
+        self.started_at = started_at or datetime.utcnow()
+        self.ended_by: Optional[int] = None
+
+    def partner_of(self, user_id: int) -> int:
+        return self.user_b_id if user_id == self.user_a_id else self.user_a_id
+
+
+class SessionRegistry:
+    """Live chats keyed by both participants.
+
+    Both user ids point at the same ChatSessionRecord, so the two directions
+    can never disagree and lookups / teardown are O(1) dict operations.
+    """
+
+    def __init__(self):
+        self._by_user: Dict[int, ChatSessionRecord] = {}
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._by_user
+
+    def __len__(self) -> int:
+        """Number of live chats (pairs, not users)"""
+        return len(self._by_user) // 2
+
+    def get(self, user_id: int) -> Optional[ChatSessionRecord]:
+        return self._by_user.get(user_id)
+
+    def partner_of(self, user_id: int) -> Optional[int]:
+        record = self._by_user.get(user_id)
+        return record.partner_of(user_id) if record else None
+
+    def open(self, user_a_id: int, user_b_id: int, session_id: Optional[int] = None,
+             started_at: Optional[datetime] = None) -> ChatSessionRecord:
+        """Register a new chat, replacing any chat either user was still in"""
+        self.close(user_a_id)
+        self.close(user_b_id)
+        record = ChatSessionRecord(user_a_id, user_b_id, session_id, started_at)
+        self._by_user[user_a_id] = record
+        self._by_user[user_b_id] = record
+        return record
+
+    def close(self, user_id: int) -> Optional[ChatSessionRecord]:
+        """Remove the chat `user_id` is in, for both participants"""
+        record = self._by_user.pop(user_id, None)
+        if record:
+            self._by_user.pop(record.partner_of(user_id), None)
+        return record
+
+
 class MatchmakingService:
     def __init__(self):
-        self.waiting_users: Set[int] = set()
-        self.active_sessions: Dict[int, int] = {}  # user_id -> partner_id
-        self.retry_tasks: Dict[int, asyncio.Task] = {}
+        self.waiting_pool = WaitingPool()
+        self.sessions = SessionRegistry()
         self.lock = asyncio.Lock()
+        # Search timeouts: one heap of (deadline, user_id) drained by a single task.
+        # An entry is live only while it matches waiter_deadlines[user_id].
+        self.deadlines: List[Tuple[float, int]] = []
+        self.waiter_deadlines: Dict[int, float] = {}
+        self.waiter_contexts: Dict[int, ContextTypes.DEFAULT_TYPE] = {}
+        self.deadline_task: Optional[asyncio.Task] = None
+        # Preference matching: bucketed view of the pool plus FIFO widening
+        # queues of (joined_at, user_id); stale entries fail the joined_at check.
+        self.preferences = PreferenceQueues()
+        self.joined_at: Dict[int, float] = {}
+        self.widen_language: Deque[Tuple[float, int]] = deque()
+        self.widen_gender: Deque[Tuple[float, int]] = deque()
+        self.widen_task: Optional[asyncio.Task] = None
+        self.clock = time.monotonic
+        # Interest matching: waiters indexed by the interests on their profile
+        self.interest_index = InterestIndex()
+        self.recent_partners = RecentPartners()
         
+    # The lock only guards in-memory state; database work runs in worker
+    # threads after it is released so matching never waits on Postgres.
+
+    @staticmethod
+    def _prepare_waiter(user_id: int) -> Optional[Tuple[BucketKey, List[str]]]:
+        """Touch the user's activity and return their preference bucket and interests"""
+        with database.get_db() as db:
+            profile = database.get_waiter_profile(db, user_id)
+            if profile is None:
+                return None
+            user, interests = profile
+            database.update_user_activity(db, user_id)
+            if user.preferred_gender:
+                return (user.gender, user.language or 'en', user.preferred_gender), interests
+            return (user.gender, None, None), interests
+
+    @staticmethod
+    def _insert_session_row(user_a_id: int, user_b_id: int) -> int:
+        with database.get_db() as db:
+            return database.create_chat_session(db, user_a_id, user_b_id)
+
+    @staticmethod
+    def _close_session_row(session_id: int, ended_by: int):
+        with database.get_db() as db:
+            database.end_chat_session(db, session_id, ended_by)
+
+    @staticmethod
+    def _insert_session_rows(pairs: List[Tuple[int, int]]) -> Dict[Tuple[int, int], int]:
+        with database.get_db() as db:
+            return database.create_chat_sessions(db, pairs)
+
+    async def _close_if_ended(self, record: ChatSessionRecord):
+        if record.session_id is not None and self.sessions.get(record.user_a_id) is not record:
+            # The chat ended while its row was being written
+            await asyncio.to_thread(self._close_session_row, record.session_id, record.ended_by or record.user_a_id)
+
+    async def persist_session(self, record: ChatSessionRecord):
+        """Write the chat_sessions row for a pair already live in memory"""
+        try:
+            record.session_id = await asyncio.to_thread(
+                self._insert_session_row, record.user_a_id, record.user_b_id
+            )
+        except Exception as e:
+            logger.error(f"Failed to persist chat session {record.user_a_id} <-> {record.user_b_id}: {e}")
+            return
+        await self._close_if_ended(record)
+
+    def recover_sessions(self, db) -> int:
+        """Rebuild the live-chat registry from chat_sessions at startup"""
+        rows = database.recover_chat_sessions(db, timedelta(hours=SESSION_RECOVERY_MAX_AGE_HOURS))
+        for session_id, user_a_id, user_b_id, started_at in rows:
+            self.sessions.open(user_a_id, user_b_id, session_id=session_id, started_at=started_at)
+            self.recent_partners.remember(user_a_id, user_b_id)
+        return len(rows)
+
     async def add_to_queue(self, user_id: int) -> bool:
         """Add user to waiting queue"""
+        if not database.moderation_flags.can_match(user_id):
+            return False
+
+        waiter = await asyncio.to_thread(self._prepare_waiter, user_id)
+        if waiter is None:
+            return False
+        bucket_key, interests = waiter
+
         async with self.lock:
-            with database.get_db() as db:
-                user = database.get_user(db, user_id)
-                if not user or user.is_banned or user.is_silent_banned:
-                    return False
-                
-                if user_id in self.active_sessions or user_id in self.waiting_users:
-                    return False
-                
-                self.waiting_users.add(user_id)
-                database.update_user_activity(db, user_id)
-                return True
+            if user_id in self.sessions or user_id in self.waiting_pool:
+                return False
+            self.waiting_pool.add(user_id)
+            self.preferences.add(user_id, bucket_key)
+            self.interest_index.add(user_id, interests)
+            if bucket_key[2] is not None:
+                joined_at = self.clock()
+                self.joined_at[user_id] = joined_at
+                self.widen_language.append((joined_at, user_id))
+                self.widen_gender.append((joined_at, user_id))
+                if not BATCH_MATCHING_INTERVAL_MS and (self.widen_task is None or self.widen_task.done()):
+                    self.widen_task = asyncio.create_task(self.widen_waiters())
+        return True
+
+    def widen_due_waiters(self) -> List[int]:
+        """Widen the buckets of waiters who passed a preference threshold; returns who was widened"""
+        now = self.clock()
+        widened = []
+        stages = (
+            (self.widen_language, PREFERENCE_WIDEN_LANGUAGE_AFTER, True, False),
+            (self.widen_gender, PREFERENCE_WIDEN_GENDER_AFTER, False, True),
+        )
+        for queue, threshold, language, gender in stages:
+            while queue and queue[0][0] + threshold <= now:
+                joined_at, user_id = queue.popleft()
+                if self.joined_at.get(user_id) == joined_at:
+                    self.preferences.widen(user_id, language=language, gender=gender)
+                    widened.append(user_id)
+        return widened
+
+    async def widen_waiters(self):
+        """Widen waiters as they pass a threshold and try to match each one right away.
+
+        Without this a widened waiter would only be found by the next arrival.
+        Widening queues are in join order, so sleeping until the earliest head
+        is due is always correct.
+        """
+        stages = ((self.widen_language, PREFERENCE_WIDEN_LANGUAGE_AFTER),
+                  (self.widen_gender, PREFERENCE_WIDEN_GENDER_AFTER))
+        while True:
+            due = [queue[0][0] + threshold for queue, threshold in stages if queue]
+            if not due:
+                return
+            delay = min(due) - self.clock()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            matches = []
+            async with self.lock:
+                for user_a_id in self.widen_due_waiters():
+                    # Only waiters with a handler context can be notified
+                    context = self.waiter_contexts.get(user_a_id)
+                    if user_a_id not in self.waiting_pool or context is None:
+                        continue
+                    user_b_id = self.pick_partner(user_a_id)
+                    if user_b_id is None:
+                        continue
+                    self.discard_waiter(user_a_id)
+                    self.discard_waiter(user_b_id)
+                    self.recent_partners.remember(user_a_id, user_b_id)
+                    matches.append((self.sessions.open(user_a_id, user_b_id), context))
+            if matches:
+                await self.start_matches(matches)
+                logger.info(f"Widening paired {len(matches)} chats")
+
+    def pick_partner(self, user_id: int) -> Optional[int]:
+        """Best interest overlap among compatible waiters, else a random compatible waiter.
+
+        Recent partners are never picked; if the random picks keep landing on
+        them, the compatible buckets are scanned for anyone else.
+        """
+        partner_id = self.interest_index.best_match(
+            user_id,
+            lambda candidate: (self.preferences.accepts(user_id, candidate)
+                               and not self.recent_partners.is_recent(user_id, candidate))
+        )
+        if partner_id is not None:
+            return partner_id
+        for _ in range(self.recent_partners.size + 1):
+            partner_id = self.preferences.pick(user_id)
+            if partner_id is None or not self.recent_partners.is_recent(user_id, partner_id):
+                return partner_id
+        return self.preferences.scan(user_id, lambda candidate: not self.recent_partners.is_recent(user_id, candidate))
+
+    async def update_interests(self, user_id: int, interests: List[str]):
+        """Re-index a waiter after they edit their interests"""
+        async with self.lock:
+            if user_id in self.waiting_pool:
+                self.interest_index.add(user_id, interests)
     
     async def find_partner(self, user_id: int, context: ContextTypes.DEFAULT_TYPE) -> Optional[int]:
         """Find a chat partner with retry logic"""
         async with self.lock:
-            with database.get_db() as db:
-                user = database.get_user(db, user_id)
-                if not user:
-                    return None
-                
-                # Look for available partners (excluding self)
-                available_partners = [uid for uid in self.waiting_users if uid != user_id]
-                
-                if not available_partners:
-                    return None
-                
-                # Simple random selection (no preference matching as requested)
-                partner_id = random.choice(available_partners)
-                
-                # Remove both from queue
-                self.waiting_users.discard(user_id)
-                self.waiting_users.discard(partner_id)
-                
-                # Create active session
-                self.active_sessions[user_id] = partner_id
-                self.active_sessions[partner_id] = user_id
-                
-                # Create database session
-                database.create_chat_session(db, user_id, partner_id)
-                
-                return partner_id
+            # Someone else may have matched us since we joined the queue
+            if user_id not in self.waiting_pool:
+                return None
+
+            if BATCH_MATCHING_INTERVAL_MS:
+                # The next batch tick pairs us and sends the notifications
+                self.wait_for_partner(user_id, context)
+                return None
+
+            # Shared interests first, then a random pick among compatible waiters
+            self.widen_due_waiters()
+            partner_id = self.pick_partner(user_id)
+            if partner_id is None:
+                # Nobody to pair with yet; the next arrival will pick us up
+                self.wait_for_partner(user_id, context)
+                return None
+            
+            # Remove both from queue
+            self.discard_waiter(user_id)
+            self.discard_waiter(partner_id)
+            
+            # Create active session
+            record = self.sessions.open(user_id, partner_id)
+            self.recent_partners.remember(user_id, partner_id)
+
+        # Create database session
+        await self.persist_session(record)
+        return partner_id
     
-    def end_session(self, user_id: int, partner_id: int):
-        """End a chat session between two users"""
-        # Remove from active sessions
-        self.active_sessions.pop(user_id, None)
-        self.active_sessions.pop(partner_id, None)
+    async def end_session(self, user_id: int, partner_id: int):
+        """End a chat session between two users, closing its row so recovery cannot reopen it"""
+        await self.end_chat(user_id)
     
     async def notify_match(self, context: ContextTypes.DEFAULT_TYPE, user_id: int, partner_id: int):
         """Notify both users about successful match and auto-delete search panels"""
-        with database.get_db() as db:
-            user = database.get_user(db, user_id)
-            partner = database.get_user(db, partner_id)
+        user = await database.get_user_snapshot(user_id)
+        partner = await database.get_user_snapshot(partner_id)
+        if user and partner:
+            user_msg = Messages.PARTNER_FOUND.format(partner.nickname)
+            partner_msg = Messages.PARTNER_FOUND.format(user.nickname)
             
-            if user and partner:
-                user_msg = Messages.PARTNER_FOUND.format(partner.nickname)
-                partner_msg = Messages.PARTNER_FOUND.format(user.nickname)
-                
-                # Delete search messages for both users if they exist
-                for uid in [user_id, partner_id]:
-                    search_msg_key = f'search_message_{uid}'
-                    if search_msg_key in context.user_data:
-                        try:
-                            msg_info = context.user_data[search_msg_key]
-                            await context.bot.delete_message(
-                                chat_id=msg_info['chat_id'], 
-                                message_id=msg_info['message_id']
-                            )
-                        except Exception as e:
-                            logger.debug(f"Failed to delete search message for user {uid}: {e}")
-                        finally:
-                            context.user_data.pop(search_msg_key, None)
-                
-                await context.bot.send_message(user_id, user_msg, reply_markup=Keyboards.chat_controls())
-                await context.bot.send_message(partner_id, partner_msg, reply_markup=Keyboards.chat_controls())
+            # Delete search messages for both users if they exist
+            for uid in [user_id, partner_id]:
+                search_msg_key = f'search_message_{uid}'
+                if search_msg_key in context.user_data:
+                    try:
+                        msg_info = context.user_data[search_msg_key]
+                        await context.bot.delete_message(
+                            chat_id=msg_info['chat_id'], 
+                            message_id=msg_info['message_id']
+                        )
+                    except Exception as e:
+                        logger.debug(f"Failed to delete search message for user {uid}: {e}")
+                    finally:
+                        context.user_data.pop(search_msg_key, None)
+            
+            await context.bot.send_message(user_id, user_msg, reply_markup=Keyboards.chat_controls())
+            await context.bot.send_message(partner_id, partner_msg, reply_markup=Keyboards.chat_controls())
     
     async def end_chat(self, user_id: int) -> Optional[int]:
         """End chat session"""
         async with self.lock:
-            partner_id = self.active_sessions.pop(user_id, None)
-            if partner_id:
-                self.active_sessions.pop(partner_id, None)
-                
-                # Update database
-                with database.get_db() as db:
-                    session = database.get_active_chat_session(db, user_id)
-                    if session:
-                        database.end_chat_session(db, session.id, user_id)
-                
-                return partner_id
+            record = self.sessions.close(user_id)
+        if not record:
             return None
+
+        # Update database; a row still being written is closed by persist_session
+        record.ended_by = user_id
+        if record.session_id is not None:
+            await asyncio.to_thread(self._close_session_row, record.session_id, user_id)
+        return record.partner_of(user_id)
     
     async def remove_from_queue(self, user_id: int):
         """Remove user from waiting queue"""
         async with self.lock:
-            self.waiting_users.discard(user_id)
-            # Cancel retry task if exists
-            if user_id in self.retry_tasks:
-                self.retry_tasks[user_id].cancel()
-                del self.retry_tasks[user_id]
+            self.discard_waiter(user_id)
     
     def get_partner(self, user_id: int) -> Optional[int]:
-        """Get current chat partner and repair one-sided mappings if needed"""
-        partner_id = self.active_sessions.get(user_id)
-        if partner_id:
-            return partner_id
+        """Get current chat partner"""
+        return self.sessions.partner_of(user_id)
 
-        for candidate_id, candidate_partner in list(self.active_sessions.items()):
-            if candidate_partner == user_id:
-                self.active_sessions[user_id] = candidate_id
-                return candidate_id
-
-        return None
+    async def get_session_id(self, db, user_id: int) -> Optional[int]:
+        """Get the chat_sessions id of the user's live chat"""
+        record = self.sessions.get(user_id)
+        if record and record.session_id is not None:
+            return record.session_id
+        return await database.aio.get_active_session_id(db, user_id)
 
     async def connect_saved_partners(self, user_a_id: int, user_b_id: int) -> bool:
         """Create active session for saved partners safely"""
         async with self.lock:
-            if user_a_id in self.active_sessions or user_b_id in self.active_sessions:
+            if user_a_id in self.sessions or user_b_id in self.sessions:
                 return False
-            if user_a_id in self.waiting_users or user_b_id in self.waiting_users:
+            if user_a_id in self.waiting_pool or user_b_id in self.waiting_pool:
                 return False
 
-            for uid in [user_a_id, user_b_id]:
-                if uid in self.retry_tasks:
-                    self.retry_tasks[uid].cancel()
-                    del self.retry_tasks[uid]
-
-            self.active_sessions[user_a_id] = user_b_id
-            self.active_sessions[user_b_id] = user_a_id
+            record = self.sessions.open(user_a_id, user_b_id)
 
-            with database.get_db() as db:
-                database.create_chat_session(db, user_a_id, user_b_id)
-            return True
+        await self.persist_session(record)
+        return True
     
-    async def start_matching_with_retry(self, user_id: int, context: ContextTypes.DEFAULT_TYPE):
-        """Start matching process with retry logic"""
-        attempts = 0
-        while attempts < MAX_RETRY_ATTEMPTS and user_id in self.waiting_users:
-            await asyncio.sleep(RETRY_MATCHING_INTERVAL)
-            
-            partner_id = await self.find_partner(user_id, context)
-            if partner_id:
-                await self.notify_match(context, user_id, partner_id)
-                break
-            
-            attempts += 1
-        
-        if user_id in self.waiting_users and attempts >= MAX_RETRY_ATTEMPTS:
-            self.waiting_users.discard(user_id)
-            await context.bot.send_message(
-                user_id,
-                Messages.NO_PARTNER_FOUND,
-                reply_markup=Keyboards.main_menu()
-            )
+    async def run_batch_tick(self):
+        """Pair everyone currently waiting in one pass (batch matching mode)"""
+        async with self.lock:
+            self.widen_due_waiters()
+            # Only waiters with a handler context can be notified
+            waiting = [uid for uid in self.waiting_pool if uid in self.waiter_contexts]
+            random.shuffle(waiting)
+            matches = []
+            for user_a_id in waiting:
+                if user_a_id not in self.waiting_pool:
+                    continue  # already paired this tick
+                user_b_id = self.pick_partner(user_a_id)
+                if user_b_id is None:
+                    continue
+                context = self.waiter_contexts[user_a_id]
+                self.discard_waiter(user_a_id)
+                self.discard_waiter(user_b_id)
+                self.recent_partners.remember(user_a_id, user_b_id)
+                matches.append((self.sessions.open(user_a_id, user_b_id), context))
+
+        if not matches:
+            return
+        await self.start_matches(matches)
+        logger.info(f"Batch tick paired {len(matches)} chats")
+
+    async def start_matches(self, matches: List[Tuple[ChatSessionRecord, ContextTypes.DEFAULT_TYPE]]):
+        """Write the rows for pairs already live in memory and notify both sides"""
+        pairs = [(record.user_a_id, record.user_b_id) for record, _ in matches]
+        try:
+            session_ids = await asyncio.to_thread(self._insert_session_rows, pairs)
+        except Exception as e:
+            logger.error(f"Failed to persist {len(pairs)} chat sessions: {e}")
+            session_ids = {}
+        for record, _ in matches:
+            record.session_id = session_ids.get((record.user_a_id, record.user_b_id))
+            await self._close_if_ended(record)
+
+        results = await asyncio.gather(
+            *(self.notify_match(context, record.user_a_id, record.user_b_id) for record, context in matches),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error(f"Failed to notify match: {result}")
+
+    def discard_waiter(self, user_id: int):
+        """Take user out of the queue and cancel their search timeout"""
+        self.waiting_pool.discard(user_id)
+        self.preferences.discard(user_id)
+        self.interest_index.discard(user_id)
+        self.joined_at.pop(user_id, None)
+        self.waiter_deadlines.pop(user_id, None)
+        self.waiter_contexts.pop(user_id, None)
+
+    def wait_for_partner(self, user_id: int, context: ContextTypes.DEFAULT_TYPE):
+        """Start the search timeout for a queued user (kept if already running)"""
+        if user_id in self.waiter_deadlines:
+            return
+        deadline = time.monotonic() + MATCH_WAIT_TIMEOUT
+        self.waiter_deadlines[user_id] = deadline
+        self.waiter_contexts[user_id] = context
+        heapq.heappush(self.deadlines, (deadline, user_id))
+        if self.deadline_task is None or self.deadline_task.done():
+            self.deadline_task = asyncio.create_task(self.expire_waiters())
+
+    async def expire_waiters(self):
+        """Drop users whose search timed out and tell them no partner was found.
+
+        Every deadline is now + MATCH_WAIT_TIMEOUT, so new entries never jump
+        ahead of the heap head and sleeping until the head is always correct.
+        """
+        while self.deadlines:
+            deadline, user_id = self.deadlines[0]
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            heapq.heappop(self.deadlines)
+            if self.waiter_deadlines.get(user_id) != deadline:
+                continue  # matched, stopped or re-queued since
+
+            async with self.lock:
+                expired = user_id in self.waiting_pool
+                context = self.waiter_contexts.get(user_id)
+                self.discard_waiter(user_id)
+
+            if expired and context:
+                try:
+                    await context.bot.send_message(
+                        user_id,
+                        Messages.NO_PARTNER_FOUND,
+                        reply_markup=Keyboards.main_menu()
+                    )
+                except TelegramError as e:
+                    logger.debug(f"Failed to send search timeout to user {user_id}: {e}")
 
 # Global service instance
 matchmaking = MatchmakingService()
 
-# Nicknames for users
-NICKNAMES = [
-    'Phoenix', 'Shadow', 'Storm', 'Raven', 'Wolf', 'Tiger', 'Lion', 'Eagle', 'Bear', 'Fox',
-    'Cosmic', 'Nova', 'Star', 'Moon', 'Sun', 'Ocean', 'River', 'Mountain', 'Forest', 'Sky',
-    'Crimson', 'Azure', 'Golden', 'Silver', 'Emerald', 'Ruby', 'Sapphire', 'Diamond', 'Pearl', 'Jade',
-    'Thunder', 'Lightning', 'Blaze', 'Frost', 'Wind', 'Rain', 'Snow', 'Cloud', 'Mist', 'Dawn',
-    'Mystic', 'Sage', 'Dream', 'Vision', 'Spirit', 'Soul', 'Heart', 'Mind', 'Zen', 'Peace'
-]
-
-def get_unique_nickname() -> str:
-    """Get a unique nickname"""
-    with database.get_db() as db:
-        used_nicknames = {user.nickname for user in db.query(database.User).all()}
-        available = [n for n in NICKNAMES if n not in used_nicknames]
-        return random.choice(available if available else NICKNAMES)
-
 def is_admin(user_id: int) -> bool:
     """Check if user is admin"""
     return user_id == ADMIN_ID
 
 def is_user_silent_banned(user_id: int) -> bool:
     """Return True if user is silently banned — used to silently block all actions"""
-    try:
-        with database.get_db() as db:
-            user = database.get_user(db, user_id)
-            return user is not None and user.is_silent_banned
-    except Exception:
-        return False
+    return user_id in database.moderation_flags.silent_banned
 
 def contains_inappropriate_content(text: str) -> bool:
     """Simple content filter that gives warnings instead of blocking"""
@@ -787,10 +1302,10 @@ def contains_inappropriate_content(text: str) -> bool:
     return False
 
 
-def build_saved_chat_menu(user_id: int):
+async def build_saved_chat_menu(user_id: int):
     """Build saved chat text and panel with partner availability"""
-    with database.get_db() as db:
-        saved_chats = database.get_saved_chats_for_owner(db, user_id)
+    async with database.get_async_db() as db:
+        saved_chats = await database.aio.get_saved_chats_for_owner(db, user_id)
 
         if not saved_chats:
             return Messages.SAVED_EMPTY, Keyboards.main_menu()
@@ -799,12 +1314,12 @@ def build_saved_chat_menu(user_id: int):
         buttons = []
 
         for index, saved_chat in enumerate(saved_chats, start=1):
-            partner = database.get_user(db, saved_chat.partner_id)
+            partner = await database.get_user_snapshot(saved_chat.partner_id)
             partner_name = partner.nickname if partner else f"User {saved_chat.partner_id}"
 
             # Partner availability status
             in_chat = matchmaking.get_partner(saved_chat.partner_id)
-            in_queue = saved_chat.partner_id in matchmaking.waiting_users
+            in_queue = saved_chat.partner_id in matchmaking.waiting_pool
             if in_chat:
                 status = "🔴 Busy in chat"
             elif in_queue:
@@ -871,8 +1386,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     # ── Deep link processing ──────────────────────────────────────────────────
     payload = context.args[0] if context.args else None
 
-    with database.get_db() as db:
-        user = database.get_user(db, user_id)
+    async with database.get_async_db() as db:
+        user = await database.aio.get_user(db, user_id)
 
         # Process deep link BEFORE checking banned/locked status so new users
         # still get credited even if they come through an unlock link
@@ -880,14 +1395,16 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             # New user joining via referral or unlock link
             if payload.startswith('ref_'):
                 ref_code = payload[4:]
-                referrer = database.get_user_by_referral_code(db, ref_code)
-                if referrer and referrer.user_id != user_id:
-                    if referrer.is_locked:
-                        pts, unlocked = database.add_unlock_points(db, referrer.user_id, UNLOCK_REFERRAL_POINTS)
+                referrer = await database.aio.get_user_by_referral_code(db, ref_code)
+                referrer_id = referrer.user_id if referrer else None
+                referrer_locked = referrer.is_locked if referrer else False
+                if referrer_id and referrer_id != user_id:
+                    if referrer_locked:
+                        pts, unlocked = await database.aio.add_unlock_points(db, referrer_id, UNLOCK_REFERRAL_POINTS)
                         if unlocked:
                             try:
                                 await context.bot.send_message(
-                                    referrer.user_id,
+                                    referrer_id,
                                     "🎉 **Account Unlocked!**\n\nYou collected enough referrals — your account is now unlocked! Welcome back.",
                                     parse_mode='Markdown'
                                 )
@@ -896,24 +1413,24 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
                         else:
                             try:
                                 await context.bot.send_message(
-                                    referrer.user_id,
+                                    referrer_id,
                                     f"🔓 Someone joined via your unlock link! +{UNLOCK_REFERRAL_POINTS} pts → **{pts:.1f}/{UNLOCK_POINTS_REQUIRED:.0f}** needed to unlock.",
                                     parse_mode='Markdown'
                                 )
                             except Exception:
                                 pass
                     else:
-                        new_pts = database.add_points(db, referrer.user_id, REFERRAL_POINTS)
+                        new_pts = await database.aio.add_points(db, referrer_id, REFERRAL_POINTS)
                         try:
                             await context.bot.send_message(
-                                referrer.user_id,
+                                referrer_id,
                                 f"🎉 Someone joined via your referral link! +{REFERRAL_POINTS:.0f} point → **{new_pts:.1f} pts** total.",
                                 parse_mode='Markdown'
                             )
                         except Exception:
                             pass
                     # Store who referred this new user
-                    context.user_data['pending_referred_by'] = referrer.user_id
+                    context.user_data['pending_referred_by'] = referrer_id
 
         if user:
             if user.is_silent_banned:
@@ -925,7 +1442,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
                 )
                 return
             if user.is_locked:
-                ref_code = database.ensure_referral_code(db, user_id)
+                ref_code = await database.aio.ensure_referral_code(db, user_id)
                 unlock_link = f"https://t.me/{bot_username}?start=ref_{ref_code}"
                 pts = user.unlock_points or 0.0
                 await update.message.reply_text(
@@ -940,12 +1457,12 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
                 )
                 return
 
-            database.update_user_activity(db, user_id)
+            await database.aio.update_user_activity(db, user_id)
             partner = matchmaking.get_partner(user_id)
 
             if partner:
                 await update.message.reply_text(Messages.ALREADY_IN_CHAT, reply_markup=Keyboards.chat_controls())
-            elif user_id in matchmaking.waiting_users:
+            elif user_id in matchmaking.waiting_pool:
                 await update.message.reply_text(Messages.ALREADY_WAITING)
             else:
                 await update.message.reply_text(
@@ -968,8 +1485,8 @@ async def handle_find_partner(update: Update, context: ContextTypes.DEFAULT_TYPE
     """Handle partner finding"""
     user_id = update.effective_user.id
 
-    with database.get_db() as db:
-        user = database.get_user(db, user_id)
+    async with database.get_async_db() as db:
+        user = await database.aio.get_user(db, user_id)
         if not user:
             await update.message.reply_text("❌ Please register first using /start")
             return
@@ -981,7 +1498,7 @@ async def handle_find_partner(update: Update, context: ContextTypes.DEFAULT_TYPE
             return
         if user.is_locked:
             bot_info = await context.bot.get_me()
-            ref_code = database.ensure_referral_code(db, user_id)
+            ref_code = await database.aio.ensure_referral_code(db, user_id)
             unlock_link = f"https://t.me/{bot_info.username}?start=ref_{ref_code}"
             pts = user.unlock_points or 0.0
             await update.message.reply_text(
@@ -996,7 +1513,7 @@ async def handle_find_partner(update: Update, context: ContextTypes.DEFAULT_TYPE
         await update.message.reply_text(Messages.ALREADY_IN_CHAT, reply_markup=Keyboards.chat_controls())
         return
     
-    if user_id in matchmaking.waiting_users:
+    if user_id in matchmaking.waiting_pool:
         await update.message.reply_text(Messages.ALREADY_WAITING)
         return
     
@@ -1063,7 +1580,7 @@ async def saved_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     if is_user_silent_banned(update.effective_user.id):
         return
     user_id = update.effective_user.id
-    text, keyboard = build_saved_chat_menu(user_id)
+    text, keyboard = await build_saved_chat_menu(user_id)
     await update.message.reply_text(text, reply_markup=keyboard)
 
 async def handle_report_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -1075,11 +1592,10 @@ async def handle_report_user(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text(Messages.REPORT_ONLY_IN_CHAT)
         return
     
-    with database.get_db() as db:
-        session = database.get_active_chat_session(db, user_id)
-        database.create_user_report(
+    async with database.get_async_db() as db:
+        await database.aio.create_user_report(
             db, user_id, partner_id, 
-            session.id if session else None,
+            await matchmaking.get_session_id(db, user_id),
             "Reported via bot command"
         )
     
@@ -1100,15 +1616,17 @@ async def show_profile(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     """Show user profile"""
     user_id = update.effective_user.id
     
-    with database.get_db() as db:
-        user = database.get_user(db, user_id)
+    async with database.get_async_db() as db:
+        user = await database.aio.get_user(db, user_id)
         if not user:
             await update.message.reply_text("❌ Please register first using /start")
             return
 
-        interests = ", ".join([interest.name for interest in user.interests]) if user.interests else "None set"
+        interest_names = await database.aio.get_interest_names(db, user)
+        interests = ", ".join(interest_names) if interest_names else "None set"
         created_date = user.created_at.strftime("%B %d, %Y") if user.created_at else "Unknown"
         mood_display = f"{user.mood} {Moods.OPTIONS.get(user.mood, '')}" if user.mood else "Not set"
+        points = await database.aio.get_points(db, user_id)
 
         profile_text = Messages.PROFILE_INFO.format(
             nickname=user.nickname,
@@ -1119,7 +1637,7 @@ async def show_profile(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
             location=user.location or "Not set",
             interests=interests,
             total_chats=user.total_chats or 0,
-            points=f"{user.points or 0.0:.1f}",
+            points=f"{points:.1f}",
             since=created_date,
         )
         
@@ -1179,7 +1697,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await show_profile_callback(query, context)
 
     elif data == 'view_saved_chats':
-        text, keyboard = build_saved_chat_menu(user_id)
+        text, keyboard = await build_saved_chat_menu(user_id)
         await query.edit_message_text(text, reply_markup=keyboard)
     
     elif data == 'help_menu':
@@ -1197,8 +1715,8 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await query.edit_message_text(Messages.PRIVACY_INFO, reply_markup=privacy_keyboard, parse_mode='Markdown')
     
     elif data == 'main_menu':
-        with database.get_db() as db:
-            user = database.get_user(db, user_id)
+        async with database.get_async_db() as db:
+            user = await database.aio.get_user(db, user_id)
             if user:
                 await query.edit_message_text(
                     f"👋 Welcome back, **{user.nickname}**!\n\nWhat would you like to do?",
@@ -1255,7 +1773,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await handle_save_chat_response_callback(query, context, accepted=False)
 
     elif data == 'saved_refresh':
-        text, keyboard = build_saved_chat_menu(user_id)
+        text, keyboard = await build_saved_chat_menu(user_id)
         await query.edit_message_text(text, reply_markup=keyboard, parse_mode='Markdown')
 
     elif data.startswith('saved_view_'):
@@ -1276,8 +1794,8 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     elif data.startswith('reconnect_cancel_'):
         try:
             partner_id = int(data.replace('reconnect_cancel_', ''))
-            with database.get_db() as db:
-                partner = database.get_user(db, partner_id)
+            async with database.get_async_db() as db:
+                partner = await database.aio.get_user(db, partner_id)
                 partner_name = partner.nickname if partner else "your partner"
             await query.edit_message_text(f"❌ Reconnect request to **{partner_name}** cancelled.", parse_mode='Markdown')
         except Exception:
@@ -1373,17 +1891,41 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     elif data.startswith('mood_'):
         emoji = data.replace('mood_', '')
         mood_name = Moods.OPTIONS.get(emoji, 'Unknown')
-        with database.get_db() as db:
-            user = database.get_user(db, user_id)
+        async with database.get_async_db() as db:
+            user = await database.aio.get_user(db, user_id)
             if user:
                 user.mood = emoji
-                db.commit()
+                await db.commit()
                 await query.edit_message_text(
                     f"✅ **Mood Updated!**\n\nYour mood is now: {mood_name} {emoji}",
                     reply_markup=Keyboards.profile_menu(),
                     parse_mode='Markdown'
                 )
     
+    # Match Preference
+    elif data == 'set_match_preference':
+        await query.edit_message_text(
+            "🎯 **Match Preference**\n\nWho would you like to be matched with?\n"
+            "With a preference set we first look for partners who speak your language, "
+            "then widen the search if nobody is found.",
+            reply_markup=Keyboards.match_preference_selection(),
+            parse_mode='Markdown'
+        )
+
+    elif data.startswith('match_pref_'):
+        preference = data.replace('match_pref_', '')
+        async with database.get_async_db() as db:
+            success = await database.aio.update_user_profile(db, user_id, 'preferred_gender', preference)
+        if success:
+            label = "Anyone" if preference == 'any' else preference.title()
+            await query.edit_message_text(
+                f"✅ **Match preference set:** {label}",
+                reply_markup=Keyboards.profile_menu(),
+                parse_mode='Markdown'
+            )
+        else:
+            await query.edit_message_text("❌ Failed to update preference. Please try again.", reply_markup=Keyboards.profile_menu())
+
     # Language Selection
     elif data == 'change_language':
         await query.edit_message_text(
@@ -1394,9 +1936,9 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     
     elif data.startswith('lang_'):
         lang_code = data.replace('lang_', '')
-        with database.get_db() as db:
-            database.update_user_profile(db, user_id, 'language', lang_code)
-            db.commit()
+        async with database.get_async_db() as db:
+            await database.aio.update_user_profile(db, user_id, 'language', lang_code)
+            await db.commit()
             await query.edit_message_text(
                 get_text('LANG_CHANGED', lang_code),
                 reply_markup=Keyboards.profile_menu(),
@@ -1428,9 +1970,9 @@ async def handle_gender_selection(query, context: ContextTypes.DEFAULT_TYPE) ->
     telegram_user = query.from_user
     gender = query.data.replace('gender_', '')
     
-    with database.get_db() as db:
+    async with database.get_async_db() as db:
         # Check if user already exists
-        existing_user = database.get_user(db, user_id)
+        existing_user = await database.aio.get_user(db, user_id)
         if existing_user:
             await query.edit_message_text(
                 f"👋 Welcome back, **{existing_user.nickname}**!",
@@ -1439,29 +1981,30 @@ async def handle_gender_selection(query, context: ContextTypes.DEFAULT_TYPE) ->
             )
             return
         
-        # Create new user
-        nickname = get_unique_nickname()
-        user = database.create_user(
+        # Create new user; the nickname is allocated in the same transaction
+        user = await database.aio.create_user(
             db, user_id,
             telegram_user.username or "",
             telegram_user.first_name or "",
             telegram_user.last_name or "",
-            gender, nickname
-        )
-        
-        await query.edit_message_text(
-            Messages.GENDER_SET.format(nickname, gender.title()),
-            reply_markup=Keyboards.main_menu(),
-            parse_mode='Markdown'
+            gender
         )
+        nickname = user.nickname
+
+    # Commit first: the statistics rows stay locked until the transaction ends
+    await query.edit_message_text(
+        Messages.GENDER_SET.format(nickname, gender.title()),
+        reply_markup=Keyboards.main_menu(),
+        parse_mode='Markdown'
+    )
 
 # Button Callback Functions
 async def handle_find_partner_callback(query, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle find partner button callback"""
     user_id = query.from_user.id
 
-    with database.get_db() as db:
-        user = database.get_user(db, user_id)
+    async with database.get_async_db() as db:
+        user = await database.aio.get_user(db, user_id)
         if not user:
             await query.edit_message_text("❌ Please register first using /start")
             return
@@ -1473,7 +2016,7 @@ async def handle_find_partner_callback(query, context: ContextTypes.DEFAULT_TYPE
             return
         if user.is_locked:
             bot_info = await context.bot.get_me()
-            ref_code = database.ensure_referral_code(db, user_id)
+            ref_code = await database.aio.ensure_referral_code(db, user_id)
             unlock_link = f"https://t.me/{bot_info.username}?start=ref_{ref_code}"
             pts = user.unlock_points or 0.0
             await query.edit_message_text(
@@ -1488,7 +2031,7 @@ async def handle_find_partner_callback(query, context: ContextTypes.DEFAULT_TYPE
         await query.edit_message_text(Messages.ALREADY_IN_CHAT, reply_markup=Keyboards.chat_controls())
         return
     
-    if user_id in matchmaking.waiting_users:
+    if user_id in matchmaking.waiting_pool:
         await query.edit_message_text(Messages.ALREADY_WAITING)
         return
     
@@ -1513,15 +2056,17 @@ async def show_profile_callback(query, context: ContextTypes.DEFAULT_TYPE) -> No
     """Handle view profile button callback"""
     user_id = query.from_user.id
     
-    with database.get_db() as db:
-        user = database.get_user(db, user_id)
+    async with database.get_async_db() as db:
+        user = await database.aio.get_user(db, user_id)
         if not user:
             await query.edit_message_text("❌ Please register first using /start")
             return
 
-        interests = ", ".join([interest.name for interest in user.interests]) if user.interests else "None set"
+        interest_names = await database.aio.get_interest_names(db, user)
+        interests = ", ".join(interest_names) if interest_names else "None set"
         created_date = user.created_at.strftime("%B %d, %Y") if user.created_at else "Unknown"
         mood_display = f"{user.mood} {Moods.OPTIONS.get(user.mood, '')}" if user.mood else "Not set"
+        points = await database.aio.get_points(db, user_id)
 
         profile_text = Messages.PROFILE_INFO.format(
             nickname=user.nickname,
@@ -1532,7 +2077,7 @@ async def show_profile_callback(query, context: ContextTypes.DEFAULT_TYPE) -> No
             location=user.location or "Not set",
             interests=interests,
             total_chats=user.total_chats or 0,
-            points=f"{user.points or 0.0:.1f}",
+            points=f"{points:.1f}",
             since=created_date,
         )
         
@@ -1618,10 +2163,10 @@ async def handle_change_gender_callback(query, context: ContextTypes.DEFAULT_TYP
     user_id = query.from_user.id
     gender = query.data.replace('change_gender_', '')
     
-    with database.get_db() as db:
-        success = database.update_user_profile(db, user_id, 'gender', gender)
+    async with database.get_async_db() as db:
+        success = await database.aio.update_user_profile(db, user_id, 'gender', gender)
         if success:
-            db.commit()
+            await db.commit()
             await query.edit_message_text(
                 f"✅ Gender updated to **{gender.title()}**!",
                 reply_markup=Keyboards.profile_menu(),
@@ -1642,13 +2187,14 @@ async def handle_view_partner_profile_callback(query, context: ContextTypes.DEFA
         await query.edit_message_text("❌ You're not in a chat right now.", reply_markup=Keyboards.main_menu())
         return
     
-    with database.get_db() as db:
-        partner = database.get_user(db, partner_id)
+    async with database.get_async_db() as db:
+        partner = await database.aio.get_user(db, partner_id)
         if not partner:
             await query.edit_message_text("❌ Partner not found.", reply_markup=Keyboards.main_menu())
             return
         
-        interests = ", ".join([interest.name for interest in partner.interests]) if partner.interests else "None set"
+        interest_names = await database.aio.get_interest_names(db, partner)
+        interests = ", ".join(interest_names) if interest_names else "None set"
         
         profile_text = f"""👤 **Partner's Profile**
 
@@ -1715,8 +2261,8 @@ async def handle_save_chat_callback(query, context: ContextTypes.DEFAULT_TYPE) -
         )
         return
 
-    with database.get_db() as db:
-        current_count = database.count_saved_chats_for_owner(db, user_id)
+    async with database.get_async_db() as db:
+        current_count = await database.aio.count_saved_chats_for_owner(db, user_id)
         if current_count >= 3:
             await query.edit_message_text(
                 Messages.SAVE_LIMIT_REACHED,
@@ -1724,7 +2270,7 @@ async def handle_save_chat_callback(query, context: ContextTypes.DEFAULT_TYPE) -
             )
             return
 
-        if database.get_saved_chat(db, user_id, partner_id):
+        if await database.aio.get_saved_chat(db, user_id, partner_id):
             await query.edit_message_text(
                 Messages.SAVE_ALREADY_EXISTS,
                 reply_markup=Keyboards.chat_controls()
@@ -1777,9 +2323,9 @@ async def handle_save_chat_response_callback(query, context: Optional[ContextTyp
             await bot.send_message(requester_id, Messages.SAVE_DECLINED_SENDER)
         return
 
-    with database.get_db() as db:
-        requester_count = database.count_saved_chats_for_owner(db, requester_id)
-        responder_count = database.count_saved_chats_for_owner(db, responder_id)
+    async with database.get_async_db() as db:
+        requester_count = await database.aio.count_saved_chats_for_owner(db, requester_id)
+        responder_count = await database.aio.count_saved_chats_for_owner(db, responder_id)
 
         if requester_count >= 3:
             pending_save_requests.discard(request_key)
@@ -1798,8 +2344,8 @@ async def handle_save_chat_response_callback(query, context: Optional[ContextTyp
             return
 
         # Create entries for BOTH sides so either can initiate reconnect
-        database.create_saved_chat(db, requester_id, responder_id)
-        database.create_saved_chat(db, responder_id, requester_id)
+        await database.aio.create_saved_chat(db, requester_id, responder_id)
+        await database.aio.create_saved_chat(db, responder_id, requester_id)
 
     pending_save_requests.discard(request_key)
     await query.edit_message_text(Messages.SAVE_ACCEPTED_PARTNER)
@@ -1818,10 +2364,10 @@ async def handle_saved_delete_callback(query) -> None:
         await query.edit_message_text("❌ Invalid saved chat.")
         return
 
-    with database.get_db() as db:
-        database.delete_saved_chat(db, user_id, partner_id)
+    async with database.get_async_db() as db:
+        await database.aio.delete_saved_chat(db, user_id, partner_id)
 
-    text, keyboard = build_saved_chat_menu(user_id)
+    text, keyboard = await build_saved_chat_menu(user_id)
     await query.edit_message_text(text, reply_markup=keyboard, parse_mode='Markdown')
 
 
@@ -1835,13 +2381,13 @@ async def handle_saved_view_callback(query, context: ContextTypes.DEFAULT_TYPE)
         await query.edit_message_text("❌ Invalid saved chat.")
         return
 
-    with database.get_db() as db:
-        saved_chat = database.get_saved_chat(db, user_id, partner_id)
+    async with database.get_async_db() as db:
+        saved_chat = await database.aio.get_saved_chat(db, user_id, partner_id)
         if not saved_chat:
-            text, keyboard = build_saved_chat_menu(user_id)
+            text, keyboard = await build_saved_chat_menu(user_id)
             await query.edit_message_text("⚠️ This saved chat no longer exists.\n\n" + text, reply_markup=keyboard, parse_mode='Markdown')
             return
-        partner = database.get_user(db, partner_id)
+        partner = await database.aio.get_user(db, partner_id)
         # Extract all values inside the session to avoid DetachedInstanceError
         partner_name = partner.nickname if partner else f"User {partner_id}"
         gender_icon = "👨" if partner and partner.gender == "male" else "👩"
@@ -1850,7 +2396,7 @@ async def handle_saved_view_callback(query, context: ContextTypes.DEFAULT_TYPE)
         saved_date = saved_chat.created_at.strftime('%Y-%m-%d') if saved_chat.created_at else "Unknown"
 
     in_chat = matchmaking.get_partner(partner_id)
-    in_queue = partner_id in matchmaking.waiting_users
+    in_queue = partner_id in matchmaking.waiting_pool
     if in_chat:
         status = "🔴 Busy in chat"
         status_note = "This partner is currently in a chat. Try again later."
@@ -1888,7 +2434,7 @@ async def handle_saved_reconnect_callback(query, context: ContextTypes.DEFAULT_T
         await query.edit_message_text("❌ Invalid saved chat.", reply_markup=Keyboards.reconnect_detail_panel(0))
         return
 
-    if matchmaking.get_partner(user_id) or user_id in matchmaking.waiting_users:
+    if matchmaking.get_partner(user_id) or user_id in matchmaking.waiting_pool:
         await query.edit_message_text(
             "⚠️ **You're currently busy.**\n\nFinish your current chat or stop searching before reconnecting.",
             reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data=f'saved_view_{partner_id}')]]),
@@ -1896,21 +2442,21 @@ async def handle_saved_reconnect_callback(query, context: ContextTypes.DEFAULT_T
         )
         return
 
-    with database.get_db() as db:
-        saved_chat = database.get_saved_chat(db, user_id, partner_id)
+    async with database.get_async_db() as db:
+        saved_chat = await database.aio.get_saved_chat(db, user_id, partner_id)
         if not saved_chat:
             await query.edit_message_text(
                 "⚠️ This saved chat no longer exists.",
                 reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Saved Chats", callback_data='view_saved_chats')]]),
             )
             return
-        requester_user = database.get_user(db, user_id)
-        partner_user = database.get_user(db, partner_id)
+        requester_user = await database.aio.get_user(db, user_id)
+        partner_user = await database.aio.get_user(db, partner_id)
         # Extract all values inside the session to avoid DetachedInstanceError
         requester_name = requester_user.nickname if requester_user else "Someone"
         partner_name = partner_user.nickname if partner_user else "Your saved partner"
 
-    if matchmaking.get_partner(partner_id) or partner_id in matchmaking.waiting_users:
+    if matchmaking.get_partner(partner_id) or partner_id in matchmaking.waiting_pool:
         await query.edit_message_text(
             f"🔴 **{partner_name} is busy right now.**\n\nTry again when they are available.",
             reply_markup=InlineKeyboardMarkup([
@@ -1954,19 +2500,19 @@ async def handle_reconnect_response_callback(query, context: ContextTypes.DEFAUL
             await bot.send_message(requester_id, Messages.RECONNECT_DECLINED_SENDER)
         return
 
-    if matchmaking.get_partner(responder_id) or responder_id in matchmaking.waiting_users:
+    if matchmaking.get_partner(responder_id) or responder_id in matchmaking.waiting_pool:
         await query.edit_message_text("⚠️ You are currently busy. Finish your current session before accepting a reconnect.")
         return
 
-    if matchmaking.get_partner(requester_id) or requester_id in matchmaking.waiting_users:
+    if matchmaking.get_partner(requester_id) or requester_id in matchmaking.waiting_pool:
         await query.edit_message_text("⚠️ Requester is no longer available.")
         bot = get_bot_from_callback(query, context)
         if bot:
             await bot.send_message(requester_id, "⚠️ Reconnect failed because you are busy now.")
         return
 
-    with database.get_db() as db:
-        requester_saved = database.get_saved_chat(db, requester_id, responder_id)
+    async with database.get_async_db() as db:
+        requester_saved = await database.aio.get_saved_chat(db, requester_id, responder_id)
         if not requester_saved:
             await query.edit_message_text("⚠️ Saved chat link no longer exists.")
             bot = get_bot_from_callback(query, context)
@@ -1999,9 +2545,11 @@ async def handle_skip_chat_callback(query, context: ContextTypes.DEFAULT_TYPE) -
         
         # Start new search for current user - Add them back to queue
         if await matchmaking.add_to_queue(user_id):
-            await context.bot.send_message(user_id, Messages.MATCHING_STARTED)
-            task = asyncio.create_task(matchmaking.start_matching_with_retry(user_id, context))
-            matchmaking.retry_tasks[user_id] = task
+            partner_id = await matchmaking.find_partner(user_id, context)
+            if partner_id:
+                await matchmaking.notify_match(context, user_id, partner_id)
+            else:
+                await context.bot.send_message(user_id, Messages.MATCHING_STARTED)
     else:
         await query.edit_message_text(Messages.NOT_IN_CHAT, reply_markup=Keyboards.main_menu())
 
@@ -2026,11 +2574,10 @@ async def handle_report_user_callback(query, context: ContextTypes.DEFAULT_TYPE)
         await query.edit_message_text(Messages.REPORT_ONLY_IN_CHAT)
         return
     
-    with database.get_db() as db:
-        session = database.get_active_chat_session(db, user_id)
-        database.create_user_report(
+    async with database.get_async_db() as db:
+        await database.aio.create_user_report(
             db, user_id, partner_id, 
-            session.id if session else None,
+            await matchmaking.get_session_id(db, user_id),
             "Reported via bot command"
         )
     
@@ -2080,18 +2627,24 @@ async def handle_admin_callback(query, context: ContextTypes.DEFAULT_TYPE) -> No
         )
     
     elif data == 'admin_stats':
-        with database.get_db() as db:
-            total_users = db.query(database.User).count()
-            active_users = database.get_active_users_count(db)
-            active_chats = len(matchmaking.active_sessions) // 2
-            waiting_users = len(matchmaking.waiting_users)
+        async with database.get_async_db() as db:
+            stats = await database.aio.get_stats(db)
+            active_chats = len(matchmaking.sessions)
+            waiting_users = len(matchmaking.waiting_pool)
+            cache = database.user_cache.stats()
+            pool = database.pool_stats()['async']
             
             stats_text = f"""📊 **Bot Statistics**
             
-👥 **Total Users:** {total_users}
-🟢 **Active Today:** {active_users}
+👥 **Total Users:** {stats['users']} (+{stats['today_users']} today)
+🟢 **Active Today:** {stats['today_active_users']}
 💬 **Active Chats:** {active_chats}
+🤝 **Chats Started:** {stats['chats']} ({stats['today_chats']} today)
+🚩 **Reports:** {stats['reports']} ({stats['today_reports']} today)
+📢 **Broadcasts:** {stats['broadcasts']}
 ⏳ **Waiting Queue:** {waiting_users}
+🗃️ **User Cache:** {cache['hit_rate']:.0%} hits ({cache['hits']}/{cache['hits'] + cache['misses']}), {cache['size']} cached
+🔌 **DB Pool:** {pool['checked_out']}/{pool['size']} in use (+{pool['overflow']} overflow, peak {pool['overflow_peak']}), wait avg {pool['wait_avg_ms']:.1f} ms / max {pool['wait_max_ms']:.0f} ms, {pool['recycles']} recycled, {pool['invalidations']} invalidated
 📅 **Date:** {datetime.now().strftime('%Y-%m-%d %H:%M')}"""
             
             await query.edit_message_text(stats_text, parse_mode='Markdown')
@@ -2119,8 +2672,8 @@ async def handle_admin_callback(query, context: ContextTypes.DEFAULT_TYPE) -> No
         )
     
     elif data == 'admin_reports':
-        with database.get_db() as db:
-            reports = database.get_pending_reports(db)
+        async with database.get_async_db() as db:
+            reports = await database.aio.get_pending_reports(db)
             if not reports:
                 await query.edit_message_text(
                     "📝 **Reports**\n\n✅ No pending reports.",
@@ -2130,8 +2683,8 @@ async def handle_admin_callback(query, context: ContextTypes.DEFAULT_TYPE) -> No
             
             reports_text = "📝 **Pending Reports**\n\n"
             for report in reports[:10]:  # Show max 10 reports
-                reporter = database.get_user(db, report.reporter_id)
-                reported = database.get_user(db, report.reported_id)
+                reporter = await database.aio.get_user(db, report.reporter_id)
+                reported = await database.aio.get_user(db, report.reported_id)
                 reports_text += f"**Report #{report.id}**\n"
                 reports_text += f"👤 Reporter: {reporter.nickname if reporter else 'Unknown'} (ID: {report.reporter_id})\n"
                 reports_text += f"🎯 Reported: {reported.nickname if reported else 'Unknown'} (ID: {report.reported_id})\n"
@@ -2173,8 +2726,8 @@ async def handle_admin_callback(query, context: ContextTypes.DEFAULT_TYPE) -> No
         context.user_data['admin_state'] = 'awaiting_unmute_user'
 
     elif data == 'admin_list_muted':
-        with database.get_db() as db:
-            muted_users = database.get_muted_users(db)
+        async with database.get_async_db() as db:
+            muted_users = await database.aio.get_muted_users(db)
             if not muted_users:
                 await query.edit_message_text(
                     "📋 **Muted Users**\n\n✅ No muted users.",
@@ -2217,8 +2770,8 @@ async def handle_admin_callback(query, context: ContextTypes.DEFAULT_TYPE) -> No
         context.user_data['admin_state'] = 'awaiting_unlock_user'
 
     elif data == 'admin_list_locked':
-        with database.get_db() as db:
-            locked_users = database.get_locked_users(db)
+        async with database.get_async_db() as db:
+            locked_users = await database.aio.get_locked_users(db)
             if not locked_users:
                 await query.edit_message_text("📋 **Locked Users**\n\n✅ No locked users.", parse_mode='Markdown')
                 return
@@ -2231,8 +2784,8 @@ async def handle_admin_callback(query, context: ContextTypes.DEFAULT_TYPE) -> No
             await query.edit_message_text(text, parse_mode='Markdown')
 
     elif data == 'admin_list_silent_banned':
-        with database.get_db() as db:
-            sb_users = database.get_silent_banned_users(db)
+        async with database.get_async_db() as db:
+            sb_users = await database.aio.get_silent_banned_users(db)
             if not sb_users:
                 await query.edit_message_text(
                     "📋 **Silent Banned Users**\n\n✅ None.",
@@ -2247,8 +2800,8 @@ async def handle_admin_callback(query, context: ContextTypes.DEFAULT_TYPE) -> No
             await query.edit_message_text(sb_text, parse_mode='Markdown')
     
     elif data == 'admin_list_banned':
-        with database.get_db() as db:
-            banned_users = database.get_banned_users(db)
+        async with database.get_async_db() as db:
+            banned_users = await database.aio.get_banned_users(db)
             if not banned_users:
                 await query.edit_message_text(
                     "📋 **Banned Users**\n\n✅ No banned users.",
@@ -2337,14 +2890,12 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     partner_id = matchmaking.get_partner(user_id)
 
     if partner_id:
-        if user_id in matchmaking.waiting_users:
-            matchmaking.waiting_users.discard(user_id)
+        if user_id in matchmaking.waiting_pool:
+            matchmaking.discard_waiter(user_id)
 
         # Silently drop messages from muted users — no indication given
-        with database.get_db() as db:
-            sender = database.get_user(db, user_id)
-            if sender and sender.is_muted:
-                return
+        if user_id in database.moderation_flags.muted:
+            return
 
         # Forward message to partner with content warning if needed
         if contains_inappropriate_content(message_text):
@@ -2358,39 +2909,36 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             )
             
             # Update activity
-            with database.get_db() as db:
-                database.update_user_activity(db, user_id)
+            database.activity_buffer.touch(user_id)
                 
         except TelegramError as e:
             logger.error(f"Failed to forward message: {e}")
             await update.message.reply_text("❌ Failed to send message. Your partner may have left.")
     else:
-        if user_id in matchmaking.waiting_users:
+        if user_id in matchmaking.waiting_pool:
             await update.message.reply_text(
                 "🔍 You're currently searching for a partner. Please use the search control buttons or stop your search to use commands."
             )
             return
 
         # User not in chat - show main menu
-        with database.get_db() as db:
-            user = database.get_user(db, user_id)
-            if user:
-                await update.message.reply_text(
-                    "💬 You're not in a chat right now. Use the menu to find a partner:",
-                    reply_markup=Keyboards.main_menu()
-                )
-            else:
-                await update.message.reply_text("❌ Please register first using /start")
+        if await database.get_user_snapshot(user_id):
+            await update.message.reply_text(
+                "💬 You're not in a chat right now. Use the menu to find a partner:",
+                reply_markup=Keyboards.main_menu()
+            )
+        else:
+            await update.message.reply_text("❌ Please register first using /start")
 
 async def handle_admin_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle admin broadcast message"""
     message = update.message.text
     admin_id = update.effective_user.id
     
-    with database.get_db() as db:
+    async with database.get_async_db() as db:
         # Create broadcast record
-        broadcast = database.create_broadcast_message(db, admin_id, message)
-        user_ids = database.get_all_user_ids(db)
+        broadcast = await database.aio.create_broadcast_message(db, admin_id, message)
+        user_ids = await database.aio.get_all_user_ids(db)
     
     await update.message.reply_text(f"📢 Broadcasting to {len(user_ids)} users...")
     
@@ -2409,8 +2957,8 @@ async def handle_admin_broadcast(update: Update, context: ContextTypes.DEFAULT_T
             failed_count += 1
     
     # Update broadcast statistics
-    with database.get_db() as db:
-        database.update_broadcast_stats(db, broadcast.id, sent_count, failed_count)
+    async with database.get_async_db() as db:
+        await database.aio.update_broadcast_stats(db, broadcast.id, sent_count, failed_count)
     
     await update.message.reply_text(
         f"✅ **Broadcast Complete**\n\n📤 Sent: {sent_count}\n❌ Failed: {failed_count}",
@@ -2427,8 +2975,8 @@ async def handle_admin_ban_user(update: Update, context: ContextTypes.DEFAULT_TY
         user_id_to_ban = int(update.message.text.strip())
         admin_id = update.effective_user.id
         
-        with database.get_db() as db:
-            user = database.get_user(db, user_id_to_ban)
+        async with database.get_async_db() as db:
+            user = await database.aio.get_user(db, user_id_to_ban)
             if not user:
                 await update.message.reply_text("❌ User not found.")
                 return
@@ -2456,8 +3004,8 @@ async def handle_admin_unban_user(update: Update, context: ContextTypes.DEFAULT_
         user_id_to_unban = int(update.message.text.strip())
         admin_id = update.effective_user.id
         
-        with database.get_db() as db:
-            user = database.get_user(db, user_id_to_unban)
+        async with database.get_async_db() as db:
+            user = await database.aio.get_user(db, user_id_to_unban)
             if not user:
                 await update.message.reply_text("❌ User not found.")
                 return
@@ -2466,8 +3014,8 @@ async def handle_admin_unban_user(update: Update, context: ContextTypes.DEFAULT_
                 await update.message.reply_text(f"⚠️ User {user.nickname} (ID: {user_id_to_unban}) is not banned.")
                 return
             
-            database.unban_user(db, user_id_to_unban, admin_id)
-            db.commit()
+            await database.aio.unban_user(db, user_id_to_unban, admin_id)
+            await db.commit()
             
             await update.message.reply_text(
                 f"✅ **User Unbanned**\n\n👤 {user.nickname} (ID: {user_id_to_unban}) has been unbanned.",
@@ -2485,16 +3033,16 @@ async def handle_admin_mute_user(update: Update, context: ContextTypes.DEFAULT_T
         user_id_to_mute = int(update.message.text.strip())
         admin_id = update.effective_user.id
 
-        with database.get_db() as db:
-            user = database.get_user(db, user_id_to_mute)
+        async with database.get_async_db() as db:
+            user = await database.aio.get_user(db, user_id_to_mute)
             if not user:
                 await update.message.reply_text("❌ User not found.")
                 return
             if user.is_muted:
                 await update.message.reply_text(f"⚠️ {user.nickname} (ID: {user_id_to_mute}) is already muted.")
                 return
-            database.mute_user(db, user_id_to_mute, admin_id)
-            db.commit()
+            await database.aio.mute_user(db, user_id_to_mute, admin_id)
+            await db.commit()
             await update.message.reply_text(
                 f"🔇 **User Muted**\n\n👤 {user.nickname} (ID: {user_id_to_mute}) has been silently muted.\nThey will not be notified.",
                 parse_mode='Markdown'
@@ -2511,16 +3059,16 @@ async def handle_admin_unmute_user(update: Update, context: ContextTypes.DEFAULT
         user_id_to_unmute = int(update.message.text.strip())
         admin_id = update.effective_user.id
 
-        with database.get_db() as db:
-            user = database.get_user(db, user_id_to_unmute)
+        async with database.get_async_db() as db:
+            user = await database.aio.get_user(db, user_id_to_unmute)
             if not user:
                 await update.message.reply_text("❌ User not found.")
                 return
             if not user.is_muted:
                 await update.message.reply_text(f"⚠️ {user.nickname} (ID: {user_id_to_unmute}) is not muted.")
                 return
-            database.unmute_user(db, user_id_to_unmute, admin_id)
-            db.commit()
+            await database.aio.unmute_user(db, user_id_to_unmute, admin_id)
+            await db.commit()
             await update.message.reply_text(
                 f"🔊 **User Unmuted**\n\n👤 {user.nickname} (ID: {user_id_to_unmute}) can now send messages again.",
                 parse_mode='Markdown'
@@ -2537,8 +3085,8 @@ async def handle_admin_silent_ban(update: Update, context: ContextTypes.DEFAULT_
         user_id_to_ban = int(update.message.text.strip())
         admin_id = update.effective_user.id
 
-        with database.get_db() as db:
-            user = database.get_user(db, user_id_to_ban)
+        async with database.get_async_db() as db:
+            user = await database.aio.get_user(db, user_id_to_ban)
             if not user:
                 await update.message.reply_text("❌ User not found.")
                 return
@@ -2548,10 +3096,10 @@ async def handle_admin_silent_ban(update: Update, context: ContextTypes.DEFAULT_
             # Disconnect from any active chat silently — partner gets no notification either
             partner_id = matchmaking.get_partner(user_id_to_ban)
             if partner_id:
-                matchmaking.end_session(user_id_to_ban, partner_id)
-            matchmaking.waiting_users.discard(user_id_to_ban)
-            database.silent_ban_user(db, user_id_to_ban, admin_id)
-            db.commit()
+                await matchmaking.end_session(user_id_to_ban, partner_id)
+            matchmaking.discard_waiter(user_id_to_ban)
+            await database.aio.silent_ban_user(db, user_id_to_ban, admin_id)
+            await db.commit()
             await update.message.reply_text(
                 f"👻 **User Silently Banned**\n\n👤 {user.nickname} (ID: {user_id_to_ban})\n\nThey have no idea. Their partner received no disconnect notice.",
                 parse_mode='Markdown'
@@ -2568,16 +3116,16 @@ async def handle_admin_silent_unban(update: Update, context: ContextTypes.DEFAUL
         user_id_to_unban = int(update.message.text.strip())
         admin_id = update.effective_user.id
 
-        with database.get_db() as db:
-            user = database.get_user(db, user_id_to_unban)
+        async with database.get_async_db() as db:
+            user = await database.aio.get_user(db, user_id_to_unban)
             if not user:
                 await update.message.reply_text("❌ User not found.")
                 return
             if not user.is_silent_banned:
                 await update.message.reply_text(f"⚠️ {user.nickname} (ID: {user_id_to_unban}) is not silently banned.")
                 return
-            database.silent_unban_user(db, user_id_to_unban, admin_id)
-            db.commit()
+            await database.aio.silent_unban_user(db, user_id_to_unban, admin_id)
+            await db.commit()
             await update.message.reply_text(
                 f"👻 **Silent Ban Lifted**\n\n👤 {user.nickname} (ID: {user_id_to_unban}) can use the bot normally again.",
                 parse_mode='Markdown'
@@ -2593,25 +3141,25 @@ async def handle_profile_editing(update: Update, context: ContextTypes.DEFAULT_T
     user_id = update.effective_user.id
     message_text = update.message.text
     
-    with database.get_db() as db:
+    async with database.get_async_db() as db:
         success = False
         
         if editing_state == 'bio':
             if len(message_text) <= 200:
-                success = database.update_user_profile(db, user_id, 'bio', message_text)
+                success = await database.aio.update_user_profile(db, user_id, 'bio', message_text)
             else:
                 await update.message.reply_text("❌ Bio must be 200 characters or less. Try again:")
                 return
                 
         elif editing_state == 'age':
-            success = database.update_user_profile(db, user_id, 'age', message_text)
+            success = await database.aio.update_user_profile(db, user_id, 'age', message_text)
             if not success:
                 await update.message.reply_text("❌ Please enter a valid age between 18 and 80:")
                 return
                 
         elif editing_state == 'location':
             if len(message_text) <= 100:
-                success = database.update_user_profile(db, user_id, 'location', message_text)
+                success = await database.aio.update_user_profile(db, user_id, 'location', message_text)
             else:
                 await update.message.reply_text("❌ Location must be 100 characters or less. Try again:")
                 return
@@ -2621,19 +3169,21 @@ async def handle_profile_editing(update: Update, context: ContextTypes.DEFAULT_T
             if len(interests) > 10:
                 await update.message.reply_text("❌ Maximum 10 interests allowed. Try again:")
                 return
-            success = database.set_user_interests(db, user_id, interests)
+            success = await database.aio.set_user_interests(db, user_id, interests)
         
         elif editing_state == 'nickname':
             if len(message_text) < 2 or len(message_text) > 20:
                 await update.message.reply_text("❌ Nickname must be 2-20 characters. Try again:")
                 return
-            success = database.update_user_profile(db, user_id, 'nickname', message_text)
+            success = await database.aio.update_user_profile(db, user_id, 'nickname', message_text)
             if not success:
                 await update.message.reply_text("❌ This nickname is already taken or invalid. Try a different one:")
                 return
         
         if success:
-            db.commit()
+            await db.commit()
+            if editing_state == 'interests':
+                await matchmaking.update_interests(user_id, database.normalize_interests(interests))
             await update.message.reply_text(
                 "✅ Profile updated successfully!",
                 reply_markup=Keyboards.profile_menu()
@@ -2842,19 +3392,19 @@ async def handle_admin_ban_reason(update: Update, context: ContextTypes.DEFAULT_
     ban_reason = None if reason.lower() == 'skip' else reason
     
     try:
-        with database.get_db() as db:
-            user = database.get_user(db, user_id_to_ban)
+        async with database.get_async_db() as db:
+            user = await database.aio.get_user(db, user_id_to_ban)
             if not user:
                 await update.message.reply_text("❌ User not found.")
                 return
             
-            database.ban_user(db, user_id_to_ban, admin_id, ban_reason)
-            db.commit()
+            await database.aio.ban_user(db, user_id_to_ban, admin_id, ban_reason)
+            await db.commit()
             
             # Remove user from any active chat
             partner_id = matchmaking.get_partner(user_id_to_ban)
             if partner_id:
-                matchmaking.end_session(user_id_to_ban, partner_id)
+                await matchmaking.end_session(user_id_to_ban, partner_id)
             
             await update.message.reply_text(
                 f"⛔ **User Banned**\n\n👤 {user.nickname} (ID: {user_id_to_ban})\n📝 Reason: {ban_reason or 'No reason provided'}",
@@ -2873,13 +3423,13 @@ async def referral_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         return
     user_id = update.effective_user.id
     bot_info = await context.bot.get_me()
-    with database.get_db() as db:
-        user = database.get_user(db, user_id)
+    async with database.get_async_db() as db:
+        user = await database.aio.get_user(db, user_id)
         if not user:
             await update.message.reply_text("❌ Please register first using /start")
             return
-        ref_code = database.ensure_referral_code(db, user_id)
-        points = user.points or 0.0
+        ref_code = await database.aio.ensure_referral_code(db, user_id)
+        points = await database.aio.get_points(db, user_id)
     ref_link = f"https://t.me/{bot_info.username}?start=ref_{ref_code}"
     await update.message.reply_text(
         f"🔗 **Your Referral Link**\n\n"
@@ -2897,13 +3447,13 @@ async def handle_referral_menu_callback(query, context: ContextTypes.DEFAULT_TYP
     """Show referral info as callback"""
     user_id = query.from_user.id
     bot_info = await context.bot.get_me()
-    with database.get_db() as db:
-        user = database.get_user(db, user_id)
+    async with database.get_async_db() as db:
+        user = await database.aio.get_user(db, user_id)
         if not user:
             await query.edit_message_text("❌ Please register first using /start")
             return
-        ref_code = database.ensure_referral_code(db, user_id)
-        points = user.points or 0.0
+        ref_code = await database.aio.ensure_referral_code(db, user_id)
+        points = await database.aio.get_points(db, user_id)
     ref_link = f"https://t.me/{bot_info.username}?start=ref_{ref_code}"
     await query.edit_message_text(
         f"🔗 **Your Referral Link**\n\n"
@@ -2921,8 +3471,8 @@ async def handle_admin_lock_user(update: Update, context: ContextTypes.DEFAULT_T
     """Handle admin lock user — get user ID then ask for reason"""
     try:
         user_id_to_lock = int(update.message.text.strip())
-        with database.get_db() as db:
-            user = database.get_user(db, user_id_to_lock)
+        async with database.get_async_db() as db:
+            user = await database.aio.get_user(db, user_id_to_lock)
             if not user:
                 await update.message.reply_text("❌ User not found.")
                 context.user_data.pop('admin_state', None)
@@ -2952,18 +3502,18 @@ async def handle_admin_lock_reason(update: Update, context: ContextTypes.DEFAULT
         context.user_data.pop('admin_state', None)
         return
     lock_reason = None if reason_text.lower() == 'skip' else reason_text
-    with database.get_db() as db:
-        user = database.get_user(db, user_id_to_lock)
+    async with database.get_async_db() as db:
+        user = await database.aio.get_user(db, user_id_to_lock)
         if not user:
             await update.message.reply_text("❌ User not found.")
             context.user_data.pop('admin_state', None)
             return
-        database.lock_user(db, user_id_to_lock, admin_id, lock_reason)
+        await database.aio.lock_user(db, user_id_to_lock, admin_id, lock_reason)
         partner_id = matchmaking.get_partner(user_id_to_lock)
         if partner_id:
-            matchmaking.end_session(user_id_to_lock, partner_id)
+            await matchmaking.end_session(user_id_to_lock, partner_id)
         bot_info = await context.bot.get_me()
-        ref_code = database.ensure_referral_code(db, user_id_to_lock)
+        ref_code = await database.aio.ensure_referral_code(db, user_id_to_lock)
         unlock_link = f"https://t.me/{bot_info.username}?start=ref_{ref_code}"
     try:
         await context.bot.send_message(
@@ -2990,8 +3540,8 @@ async def handle_admin_unlock_user(update: Update, context: ContextTypes.DEFAULT
     try:
         user_id_to_unlock = int(update.message.text.strip())
         admin_id = update.effective_user.id
-        with database.get_db() as db:
-            user = database.get_user(db, user_id_to_unlock)
+        async with database.get_async_db() as db:
+            user = await database.aio.get_user(db, user_id_to_unlock)
             if not user:
                 await update.message.reply_text("❌ User not found.")
                 context.user_data.pop('admin_state', None)
@@ -3000,7 +3550,7 @@ async def handle_admin_unlock_user(update: Update, context: ContextTypes.DEFAULT
                 await update.message.reply_text(f"⚠️ User **{user.nickname}** is not locked.", parse_mode='Markdown')
                 context.user_data.pop('admin_state', None)
                 return
-            database.unlock_user(db, user_id_to_unlock, admin_id)
+            await database.aio.unlock_user(db, user_id_to_unlock, admin_id)
         try:
             await context.bot.send_message(
                 user_id_to_unlock,
@@ -3044,16 +3594,9 @@ async def handle_stop_search_callback(query, context: ContextTypes.DEFAULT_TYPE)
     """Handle stop search button callback"""
     user_id = query.from_user.id
     
-    # Remove user from waiting queue
+    # Remove user from waiting queue and cancel their search timeout
     await matchmaking.remove_from_queue(user_id)
     
-    # Cancel any retry task
-    if user_id in matchmaking.retry_tasks:
-        task = matchmaking.retry_tasks[user_id]
-        if not task.done():
-            task.cancel()
-        del matchmaking.retry_tasks[user_id]
-    
     await query.edit_message_text(
         Messages.SEARCH_STOPPED,
         reply_markup=Keyboards.main_menu(),
@@ -3065,7 +3608,7 @@ async def handle_refresh_search_callback(query, context: ContextTypes.DEFAULT_TY
     user_id = query.from_user.id
     
     # Check if user is still in waiting queue
-    if user_id not in matchmaking.waiting_users:
+    if user_id not in matchmaking.waiting_pool:
         await query.edit_message_text(
             "❌ You're not currently searching. Use the menu to start a new search:",
             reply_markup=Keyboards.main_menu()
@@ -3076,6 +3619,15 @@ async def handle_refresh_search_callback(query, context: ContextTypes.DEFAULT_TY
     partner_id = await matchmaking.find_partner(user_id, context)
     if partner_id:
         await matchmaking.notify_match(context, user_id, partner_id)
+    elif BATCH_MATCHING_INTERVAL_MS and user_id in matchmaking.waiting_pool:
+        # Pairing happens on the next batch tick; the user is still queued
+        try:
+            await query.edit_message_text(
+                Messages.MATCHING_STARTED,
+                reply_markup=Keyboards.searching_controls()
+            )
+        except TelegramError as e:
+            logger.debug(f"Search panel for user {user_id} already current: {e}")
     else:
         await query.edit_message_text(
             Messages.NO_PARTNER_FOUND,
@@ -3134,6 +3686,49 @@ def main() -> None:
     async def startup():
         await set_commands()
     
+    async def batch_matching_tick(context: ContextTypes.DEFAULT_TYPE):
+        await matchmaking.run_batch_tick()
+
+    if BATCH_MATCHING_INTERVAL_MS and application.job_queue:
+        application.job_queue.run_repeating(batch_matching_tick, interval=BATCH_MATCHING_INTERVAL_MS / 1000)
+
+    async def flush_activity(context: ContextTypes.DEFAULT_TYPE):
+        try:
+            await asyncio.to_thread(database.activity_buffer.flush)
+        except Exception as e:
+            logger.error(f"Failed to flush user activity: {e}")
+
+    if application.job_queue:
+        application.job_queue.run_repeating(flush_activity, interval=database.ACTIVITY_FLUSH_INTERVAL)
+
+    async def validate_pools(context: ContextTypes.DEFAULT_TYPE):
+        try:
+            await asyncio.to_thread(database.validate_idle_connections)
+            await database.validate_idle_async_connections()
+        except Exception as e:
+            logger.error(f"Failed to validate pooled connections: {e}")
+
+    if application.job_queue and not database.DB_POOL_PRE_PING:
+        application.job_queue.run_repeating(validate_pools, interval=database.DB_POOL_VALIDATE_INTERVAL)
+
+    async def archive_chats(context: ContextTypes.DEFAULT_TYPE):
+        try:
+            await asyncio.to_thread(database.archive_chat_sessions)
+        except Exception as e:
+            logger.error(f"Failed to archive chat sessions: {e}")
+
+    if application.job_queue:
+        application.job_queue.run_repeating(archive_chats, interval=database.CHAT_ARCHIVE_INTERVAL, first=60)
+
+    async def compact_points(context: ContextTypes.DEFAULT_TYPE):
+        try:
+            await asyncio.to_thread(database.compact_points_ledger)
+        except Exception as e:
+            logger.error(f"Failed to compact points ledger: {e}")
+
+    if application.job_queue:
+        application.job_queue.run_repeating(compact_points, interval=database.POINTS_COMPACT_INTERVAL)
+    
     if application.job_queue:
         application.job_queue.run_once(lambda context: asyncio.create_task(startup()), 0)
     else:
@@ -3155,8 +3750,21 @@ def main() -> None:
     # so this replica will automatically take over once the old one shuts down
     acquire_polling_lock()
 
+    # Only snapshot state once the old replica has stopped starting and ending chats
+    with database.get_db() as db:
+        database.moderation_flags.load(db)
+        recovered = matchmaking.recover_sessions(db)
+    logger.info(f"Restored {recovered} live chats from chat_sessions")
+    database.moderation_flags.listen()
+
     logger.info("Bot started successfully")
     application.run_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=True)
 
+    # Write whatever activity is still buffered before the process exits
+    try:
+        database.activity_buffer.flush()
+    except Exception as e:
+        logger.error(f"Failed to flush user activity on shutdown: {e}")
+
 if __name__ == '__main__':
     main()
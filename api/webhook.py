@@ -50,6 +50,12 @@ except Exception as e:
     logger.error(f"Database initialization failed: {e}")
 
 
+def load_moderation_flags():
+    """Reload ban, mute and lock flags; a warm instance hears no NOTIFY while frozen"""
+    with database.get_db() as db:
+        database.moderation_flags.load(db)
+
+
 def get_application():
     """Get or create the application instance"""
     if not TELEGRAM_BOT_TOKEN:
@@ -86,10 +92,21 @@ class handler(BaseHTTPRequestHandler):
 
             # Initialize and process update asynchronously
             async def process():
-                async with app:
-                    await app.initialize()
-                    await app.process_update(update)
-                    await app.shutdown()
+                try:
+                    await asyncio.to_thread(load_moderation_flags)
+                    async with app:
+                        await app.initialize()
+                        await app.process_update(update)
+                        await app.shutdown()
+                finally:
+                    # No flush job runs between invocations; write this update's activity now
+                    try:
+                        await asyncio.to_thread(database.activity_buffer.flush)
+                    except Exception as e:
+                        logger.error(f"Failed to flush user activity: {e}")
+                    # Pooled asyncpg connections belong to this event loop,
+                    # which asyncio.run() closes; the next request gets a new one
+                    await database.async_engine.dispose()
 
             asyncio.run(process())
 
@@ -0,0 +1,850 @@
+#!/usr/bin/env python3
+"""
+Matchmaking Benchmarks
+Run locally to measure the matching hot path: python3 benchmark.py
+Load simulation only, saved for comparison: python3 benchmark.py --simulate --json results.json
+"""
+
+import argparse
+import asyncio
+import heapq
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import time
+import tracemalloc
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime
+from types import SimpleNamespace
+
+# The bot modules read these at import time; benchmarks never talk to Telegram
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "0:benchmark")
+os.environ.setdefault("DATABASE_URL", "postgresql://benchmark@localhost/benchmark")
+
+import anonymous_chat_bot  # noqa: E402
+import database  # noqa: E402
+from anonymous_chat_bot import InterestIndex, RecentPartners, WaitingPool  # noqa: E402
+
+POOL_SIZES = [10, 100, 1_000, 10_000, 100_000]
+DB_LATENCY = 0.002  # seconds per simulated Postgres round-trip
+
+
+class FakeAsyncSession:
+    """AsyncSession stand-in: run_sync calls go to a worker thread like asyncpg I/O would"""
+
+    async def run_sync(self, function, *args, **kwargs):
+        return await asyncio.to_thread(function, None, *args, **kwargs)
+
+    async def commit(self):
+        pass
+
+
+class FakeDatabase:
+    """Stands in for the database module with a fixed blocking latency per call"""
+
+    def __init__(self, latency=DB_LATENCY):
+        self.latency = latency
+        self.next_session_id = 0
+        self.profiles = {}
+
+    def _round_trip(self):
+        time.sleep(self.latency)
+
+    @contextmanager
+    def get_db(self):
+        yield None
+
+    @asynccontextmanager
+    async def get_async_db(self):
+        yield FakeAsyncSession()
+
+    def get_user(self, db, user_id):
+        self._round_trip()
+        return self.profiles.get(user_id) or SimpleNamespace(
+            user_id=user_id, nickname=f"user{user_id}", gender="male", language="en",
+            preferred_gender=None, interests=[], is_banned=False, is_silent_banned=False, is_locked=False,
+        )
+
+    def _load_user_snapshot(self, db, user_id):
+        return self.get_user(db, user_id)
+
+    def get_waiter_profile(self, db, user_id):
+        user = self.get_user(db, user_id)
+        return user, [interest.name for interest in user.interests]
+
+    def update_user_activity(self, db, user_id):
+        self._round_trip()
+
+    def create_chat_session(self, db, user_a_id, user_b_id):
+        self._round_trip()
+        self.next_session_id += 1
+        return self.next_session_id
+
+    def end_chat_session(self, db, session_id, ended_by):
+        self._round_trip()
+
+    def install(self):
+        for name in ("get_db", "get_async_db", "get_user", "_load_user_snapshot", "get_waiter_profile",
+                     "update_user_activity", "create_chat_session", "end_chat_session"):
+            setattr(database, name, getattr(self, name))
+        database.user_cache.clear()
+
+
+class FakeBot:
+    """Counts Telegram calls instead of making them"""
+
+    def __init__(self):
+        self.sent = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent += 1
+
+    async def delete_message(self, chat_id, message_id):
+        pass
+
+
+class FakeContext:
+    def __init__(self, bot):
+        self.bot = bot
+        self.user_data = {}
+
+
+class TimedLock(asyncio.Lock):
+    """asyncio.Lock that records how long each acquisition was held"""
+
+    def __init__(self):
+        super().__init__()
+        self.holds = []
+        self._acquired_at = 0.0
+
+    async def acquire(self):
+        result = await super().acquire()
+        self._acquired_at = time.perf_counter()
+        return result
+
+    def release(self):
+        self.holds.append(time.perf_counter() - self._acquired_at)
+        super().release()
+
+
+def percentile(samples, q):
+    """q-th percentile of an already sorted list (0.0 if empty)"""
+    if not samples:
+        return 0.0
+    return samples[min(int(len(samples) * q), len(samples) - 1)]
+
+
+def bench_waiting_pool(sizes=POOL_SIZES, rounds=2000):
+    """Time one match attempt (pick + remove pair + re-add pair) per pool size"""
+
+    print("⏱️  Waiting pool — match latency per attempt")
+    print(f"   {'waiting':>8}  {'legacy set (µs)':>16}  {'WaitingPool (µs)':>17}")
+
+    results = []
+    for size in sizes:
+        users = list(range(1, size + 1))
+
+        legacy = set(users)
+        started = time.perf_counter()
+        for _ in range(rounds):
+            user_id = random.choice(users)
+            available = [uid for uid in legacy if uid != user_id]
+            partner_id = random.choice(available)
+            legacy.discard(user_id)
+            legacy.discard(partner_id)
+            legacy.add(user_id)
+            legacy.add(partner_id)
+        legacy_us = (time.perf_counter() - started) / rounds * 1e6
+
+        pool = WaitingPool()
+        for uid in users:
+            pool.add(uid)
+        started = time.perf_counter()
+        for _ in range(rounds):
+            user_id = random.choice(users)
+            partner_id = pool.random_member(exclude=user_id)
+            pool.discard(user_id)
+            pool.discard(partner_id)
+            pool.add(user_id)
+            pool.add(partner_id)
+        pool_us = (time.perf_counter() - started) / rounds * 1e6
+
+        print(f"   {size:>8}  {legacy_us:>16.2f}  {pool_us:>17.2f}")
+        results.append({"waiting": size, "legacy_us": legacy_us, "pool_us": pool_us})
+
+    return results
+
+
+def bench_match_throughput(users=400, latency=DB_LATENCY):
+    """Matches per second when every user queues and searches concurrently.
+
+    The legacy run is the matching path from before database work moved out
+    of the lock: each step holds the lock across blocking round-trips.
+    """
+
+    fake = FakeDatabase(latency)
+    fake.install()
+    service = anonymous_chat_bot.MatchmakingService()
+
+    legacy_lock = asyncio.Lock()
+    legacy_pool = WaitingPool()
+
+    async def legacy_arrive(user_id):
+        async with legacy_lock:
+            fake.get_user(None, user_id)
+            if user_id in legacy_pool:
+                return None
+            legacy_pool.add(user_id)
+            fake.update_user_activity(None, user_id)
+        async with legacy_lock:
+            fake.get_user(None, user_id)
+            # Same "already matched" check as today, so match counts compare
+            if user_id not in legacy_pool:
+                return None
+            partner_id = legacy_pool.random_member(exclude=user_id)
+            if partner_id is None:
+                return None
+            legacy_pool.discard(user_id)
+            legacy_pool.discard(partner_id)
+            fake.create_chat_session(None, user_id, partner_id)
+            return partner_id
+
+    async def arrive(user_id):
+        if await service.add_to_queue(user_id):
+            return await service.find_partner(user_id, None)
+        return None
+
+    async def run(arrive_fn):
+        started = time.perf_counter()
+        results = await asyncio.gather(*(arrive_fn(uid) for uid in range(1, users + 1)))
+        return sum(1 for partner in results if partner), time.perf_counter() - started
+
+    print(f"⏱️  Match throughput — {users} users, {latency * 1000:.1f} ms per DB call")
+    results = {"users": users}
+    for label, arrive_fn in (("legacy", legacy_arrive), ("current", arrive)):
+        matches, elapsed = asyncio.run(run(arrive_fn))
+        rate = matches / elapsed if elapsed else 0.0
+        print(f"   {label:<8} matches: {matches}  elapsed: {elapsed:.2f}s  matches/s: {rate:.1f}")
+        results[label] = {"matches": matches, "elapsed_s": elapsed, "matches_per_s": rate}
+    return results
+
+
+def bench_time_to_match(pairs=200, latency=DB_LATENCY):
+    """Latency from a second user's arrival to both users being paired"""
+
+    FakeDatabase(latency).install()
+    service = anonymous_chat_bot.MatchmakingService()
+
+    async def run():
+        samples = []
+        for waiter in range(1, pairs * 2, 2):
+            await service.add_to_queue(waiter)
+            await service.find_partner(waiter, None)
+            arrived = time.perf_counter()
+            await service.add_to_queue(waiter + 1)
+            partner = await service.find_partner(waiter + 1, None)
+            if partner == waiter:
+                samples.append((time.perf_counter() - arrived) * 1000)
+        return sorted(samples)
+
+    samples = asyncio.run(run())
+    p50 = samples[len(samples) // 2] if samples else 0.0
+    p99 = samples[int(len(samples) * 0.99)] if samples else 0.0
+
+    print(f"⏱️  Time to match — {pairs} arrivals with a partner already waiting")
+    print(f"   p50: {p50:.2f} ms  p99: {p99:.2f} ms")
+    return {"pairs": len(samples), "p50_ms": p50, "p99_ms": p99}
+
+
+def bench_preference_buckets(arrivals=5000, arrival_rate=2.0, seed=7):
+    """Simulate preference matching on a virtual clock; time to match per bucket.
+
+    Arrivals are Poisson at `arrival_rate` users/s. 30% of users opt in to a
+    partner gender; widening follows the PREFERENCE_WIDEN_* thresholds.
+    """
+
+    rng = random.Random(seed)
+    fake = FakeDatabase(latency=0)
+    fake.install()
+    service = anonymous_chat_bot.MatchmakingService()
+    now = [0.0]
+    service.clock = lambda: now[0]
+
+    joined = {}
+    labels = {}
+    waits = {}
+
+    for user_id in range(1, arrivals + 1):
+        gender = "male" if rng.random() < 0.6 else "female"
+        language = "en" if rng.random() < 0.7 else "si"
+        wanted = None
+        if rng.random() < 0.3:
+            wanted = "female" if gender == "male" else rng.choice(["male", "female"])
+        fake.profiles[user_id] = SimpleNamespace(
+            user_id=user_id, nickname=f"user{user_id}", gender=gender, language=language,
+            preferred_gender=wanted, interests=[], is_banned=False, is_silent_banned=False, is_locked=False,
+        )
+        labels[user_id] = f"{gender}/{language if wanted else 'any'}→{wanted or 'any'}"
+
+    async def run():
+        for user_id in range(1, arrivals + 1):
+            now[0] += rng.expovariate(arrival_rate)
+            await service.add_to_queue(user_id)
+            joined[user_id] = now[0]
+            partner_id = await service.find_partner(user_id, None)
+            if partner_id:
+                for uid in (user_id, partner_id):
+                    waits.setdefault(labels[uid], []).append(now[0] - joined[uid])
+                await service.end_chat(user_id)
+        if service.deadline_task:
+            service.deadline_task.cancel()
+
+    asyncio.run(run())
+
+    print(f"⏱️  Preference buckets — {arrivals} arrivals at {arrival_rate}/s (virtual time)")
+    print(f"   {'bucket':<22} {'matched':>8} {'p50 (s)':>8} {'p95 (s)':>8}")
+    unmatched = {}
+    for user_id in service.waiting_pool:
+        unmatched[labels[user_id]] = unmatched.get(labels[user_id], 0) + 1
+
+    results = []
+    for label in sorted(set(labels.values())):
+        samples = sorted(waits.get(label, []))
+        p50 = samples[len(samples) // 2] if samples else 0.0
+        p95 = samples[int(len(samples) * 0.95)] if samples else 0.0
+        print(f"   {label:<22} {len(samples):>8} {p50:>8.2f} {p95:>8.2f}")
+        results.append({"bucket": label, "matched": len(samples), "p50_s": p50, "p95_s": p95,
+                        "still_waiting": unmatched.get(label, 0)})
+    return results
+
+
+def bench_interest_matching(sizes=POOL_SIZES, rounds=2000, catalog=200, per_user=3, seed=11):
+    """Cost of one interest-aware pick and the overlap it finds versus a random pick"""
+
+    rng = random.Random(seed)
+    names = [f"interest{i}" for i in range(catalog)]
+
+    print(f"⏱️  Interest matching — {per_user} interests per user from {catalog}, "
+          f"budget {anonymous_chat_bot.INTEREST_SEARCH_BUDGET}")
+    print(f"   {'waiting':>8}  {'pick (µs)':>10}  {'shared (index)':>15}  {'shared (random)':>16}")
+
+    results = []
+    for size in sizes:
+        index = InterestIndex()
+        pool = WaitingPool()
+        for uid in range(1, size + 1):
+            index.add(uid, rng.sample(names, per_user))
+            pool.add(uid)
+        users = list(range(1, size + 1))
+        picks = [rng.choice(users) for _ in range(rounds)]
+
+        started = time.perf_counter()
+        matched = [(uid, index.best_match(uid, lambda candidate: True)) for uid in picks]
+        pick_us = (time.perf_counter() - started) / rounds * 1e6
+
+        shared = sum(len(index.interests[uid] & index.interests[partner])
+                     for uid, partner in matched if partner) / rounds
+        baseline = sum(len(index.interests[uid] & index.interests[pool.random_member(exclude=uid)])
+                       for uid in picks if size > 1) / rounds
+
+        print(f"   {size:>8}  {pick_us:>10.2f}  {shared:>15.2f}  {baseline:>16.2f}")
+        results.append({"waiting": size, "pick_us": pick_us, "shared_index": shared, "shared_random": baseline})
+
+    return results
+
+
+def bench_recent_partners(users=100_000, rounds=100_000, seed=13):
+    """Memory per user and cost per check of the recent-partner filter"""
+
+    rng = random.Random(seed)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    recent = RecentPartners(max_users=users)
+    for _ in range(users * anonymous_chat_bot.RECENT_PARTNER_MEMORY):
+        recent.remember(rng.randint(1, users), rng.randint(1, users))
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    pairs = [(rng.randint(1, users), rng.randint(1, users)) for _ in range(rounds)]
+    started = time.perf_counter()
+    for user_a_id, user_b_id in pairs:
+        recent.is_recent(user_a_id, user_b_id)
+    check_ns = (time.perf_counter() - started) / rounds * 1e9
+
+    started = time.perf_counter()
+    for user_a_id, user_b_id in pairs:
+        recent.remember(user_a_id, user_b_id)
+    remember_ns = (time.perf_counter() - started) / rounds * 1e9
+
+    per_user = used / max(len(recent), 1)
+    print(f"⏱️  Recent partners — {len(recent)} users, ring size {recent.size}")
+    print(f"   memory: {used / 1e6:.1f} MB ({per_user:.0f} B/user)  "
+          f"check: {check_ns:.0f} ns  remember: {remember_ns:.0f} ns")
+    return {"users": len(recent), "bytes_per_user": per_user, "check_ns": check_ns, "remember_ns": remember_ns}
+
+
+def simulate_load(users=5000, duration=3600.0, mean_idle=600.0, mean_chat=90.0, mean_patience=60.0,
+                  skip_rate=0.4, reconnect_rate=0.05, latency=0.0, seed=17, trace_memory=False):
+    """Discrete-event load simulation of the matchmaking service.
+
+    Each user starts idle, arrives after an exponential idle time, searches
+    and either matches or gives up after an exponential patience. A chat ends
+    after an exponential duration: by /skip (the skipper searches again at
+    once), by a reconnect to a saved partner, or by both users going idle.
+    Event times are virtual; service calls run for real against FakeDatabase
+    and FakeBot, so lock hold times and call latencies are wall clock.
+    """
+
+    rng = random.Random(seed)
+    fake = FakeDatabase(latency)
+    fake.install()
+    service = anonymous_chat_bot.MatchmakingService()
+    service.lock = TimedLock()
+    now = [0.0]
+    service.clock = lambda: now[0]
+    bot = FakeBot()
+
+    names = [f"interest{i}" for i in range(100)]
+    for user_id in range(1, users + 1):
+        gender = "male" if rng.random() < 0.6 else "female"
+        wanted = rng.choice(["male", "female"]) if rng.random() < 0.2 else None
+        fake.profiles[user_id] = SimpleNamespace(
+            user_id=user_id, nickname=f"user{user_id}", gender=gender,
+            language="en" if rng.random() < 0.7 else "si", preferred_gender=wanted,
+            interests=[SimpleNamespace(name=name) for name in rng.sample(names, rng.randint(0, 4))],
+            is_banned=False, is_silent_banned=False, is_locked=False,
+        )
+
+    events = []
+    sequence = [0]
+    joined = {}       # user_id -> virtual time they started searching
+    searches = {}     # user_id -> search number, so stale give-up events are ignored
+    stats = {"searches": 0, "matches": 0, "gave_up": 0, "skips": 0, "reconnects": 0}
+    waits, call_ms = [], []
+
+    def schedule(delay, kind, *payload):
+        sequence[0] += 1
+        heapq.heappush(events, (now[0] + delay, sequence[0], kind, payload))
+
+    async def search(user_id):
+        stats["searches"] += 1
+        started = time.perf_counter()
+        partner_id = None
+        if await service.add_to_queue(user_id):
+            joined[user_id] = now[0]
+            searches[user_id] = searches.get(user_id, 0) + 1
+            partner_id = await service.find_partner(user_id, None)
+        call_ms.append((time.perf_counter() - started) * 1000)
+        if partner_id:
+            await matched(user_id, partner_id)
+        elif user_id in service.waiting_pool:
+            schedule(rng.expovariate(1 / mean_patience), "give_up", user_id, searches[user_id])
+
+    async def matched(user_id, partner_id):
+        stats["matches"] += 1
+        for uid in (user_id, partner_id):
+            waits.append(now[0] - joined.pop(uid, now[0]))
+        await service.notify_match(FakeContext(bot), user_id, partner_id)
+        schedule(rng.expovariate(1 / mean_chat), "chat_end", user_id)
+
+    async def handle(kind, payload):
+        if kind == "arrive":
+            await search(payload[0])
+        elif kind == "give_up":
+            user_id, search_number = payload
+            if searches.get(user_id) == search_number and user_id in service.waiting_pool:
+                await service.remove_from_queue(user_id)
+                joined.pop(user_id, None)
+                stats["gave_up"] += 1
+                schedule(rng.expovariate(1 / mean_idle), "arrive", user_id)
+        elif kind == "chat_end":
+            user_id = payload[0]
+            partner_id = await service.end_chat(user_id)
+            if partner_id is None:
+                return
+            roll = rng.random()
+            if roll < skip_rate:
+                stats["skips"] += 1
+                schedule(rng.expovariate(1 / mean_idle), "arrive", partner_id)
+                await search(user_id)
+            elif roll < skip_rate + reconnect_rate:
+                schedule(rng.expovariate(1 / mean_idle), "reconnect", user_id, partner_id)
+            else:
+                schedule(rng.expovariate(1 / mean_idle), "arrive", user_id)
+                schedule(rng.expovariate(1 / mean_idle), "arrive", partner_id)
+        elif kind == "reconnect":
+            user_id, partner_id = payload
+            if await service.connect_saved_partners(user_id, partner_id):
+                stats["reconnects"] += 1
+                schedule(rng.expovariate(1 / mean_chat), "chat_end", user_id)
+            else:
+                schedule(0.0, "arrive", user_id)
+                if partner_id not in service.sessions and partner_id not in service.waiting_pool:
+                    schedule(rng.expovariate(1 / mean_idle), "arrive", partner_id)
+
+    async def run():
+        for user_id in range(1, users + 1):
+            schedule(rng.expovariate(1 / mean_idle), "arrive", user_id)
+        started = time.perf_counter()
+        processed = 0
+        while events and events[0][0] <= duration:
+            now[0], _, kind, payload = heapq.heappop(events)
+            await handle(kind, payload)
+            processed += 1
+        elapsed = time.perf_counter() - started
+        if service.deadline_task:
+            service.deadline_task.cancel()
+        return processed, elapsed
+
+    if trace_memory:
+        tracemalloc.start()
+    processed, elapsed = asyncio.run(run())
+    peak_mb = tracemalloc.get_traced_memory()[1] / 1e6 if trace_memory else None
+    if trace_memory:
+        tracemalloc.stop()
+
+    waits.sort()
+    call_ms.sort()
+    holds_us = sorted(hold * 1e6 for hold in service.lock.holds)
+    return {
+        "users": users,
+        "virtual_duration_s": duration,
+        "events": processed,
+        "wall_s": elapsed,
+        **stats,
+        "telegram_sends": bot.sent,
+        "matches_per_virtual_s": stats["matches"] / duration,
+        "matches_per_wall_s": stats["matches"] / elapsed if elapsed else 0.0,
+        "time_to_match_s": {q: percentile(waits, p) for q, p in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))},
+        "search_call_ms": {q: percentile(call_ms, p) for q, p in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))},
+        "lock_hold_us": {q: percentile(holds_us, p) for q, p in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))},
+        "lock_acquisitions": len(holds_us),
+        "peak_memory_mb": peak_mb,
+    }
+
+
+def bench_load_simulation(users=5000, duration=3600.0, seed=17):
+    """Run the load simulation, then again under tracemalloc for peak memory"""
+
+    result = simulate_load(users=users, duration=duration, seed=seed)
+    result["peak_memory_mb"] = simulate_load(users=users, duration=duration, seed=seed,
+                                             trace_memory=True)["peak_memory_mb"]
+
+    waits = result["time_to_match_s"]
+    holds = result["lock_hold_us"]
+    calls = result["search_call_ms"]
+    print(f"⏱️  Load simulation — {users} users, {duration:.0f}s virtual, {result['events']} events "
+          f"in {result['wall_s']:.2f}s")
+    print(f"   searches: {result['searches']}  matches: {result['matches']}  gave up: {result['gave_up']}  "
+          f"skips: {result['skips']}  reconnects: {result['reconnects']}")
+    print(f"   time to match (virtual s)  p50: {waits['p50']:.2f}  p95: {waits['p95']:.2f}  p99: {waits['p99']:.2f}")
+    print(f"   search call (ms)           p50: {calls['p50']:.3f}  p95: {calls['p95']:.3f}  p99: {calls['p99']:.3f}")
+    print(f"   lock hold (µs)             p50: {holds['p50']:.1f}  p95: {holds['p95']:.1f}  p99: {holds['p99']:.1f}")
+    print(f"   matches/s: {result['matches_per_virtual_s']:.2f} virtual, {result['matches_per_wall_s']:.0f} wall  "
+          f"peak memory: {result['peak_memory_mb']:.1f} MB")
+    return result
+
+
+def bench_relay_latency(messages=400, interval=0.005, latency=DB_LATENCY, slow_query=0.2, slow_pause=0.3):
+    """Relay latency while a slow admin query (`slow_query` s, every `slow_pause` s) runs.
+
+    Each relayed message looks up its sender, as handle_message does. The
+    blocking path runs the lookups and the slow query on the event loop, so
+    every relay queues behind the slow query. The async path awaits them
+    through get_async_db / aio.
+    """
+
+    FakeDatabase(latency).install()
+
+    def slow_report(db):
+        time.sleep(slow_query)
+
+    async def relay_blocking(user_id):
+        with database.get_db() as db:
+            database.get_user(db, user_id)
+
+    async def slow_blocking():
+        with database.get_db() as db:
+            slow_report(db)
+
+    async def relay_async(user_id):
+        async with database.get_async_db() as db:
+            await database.aio.get_user(db, user_id)
+
+    async def slow_async():
+        async with database.get_async_db() as db:
+            await db.run_sync(slow_report)
+
+    async def run(relay, slow):
+        samples = []
+        done = asyncio.Event()
+
+        async def admin():
+            while not done.is_set():
+                await slow()
+                await asyncio.sleep(slow_pause)
+
+        async def send(user_id, due):
+            await relay(user_id)
+            samples.append((time.perf_counter() - due) * 1000)
+
+        admin_task = asyncio.create_task(admin())
+        started = time.perf_counter()
+        tasks = []
+        for index in range(messages):
+            due = started + index * interval
+            await asyncio.sleep(max(0.0, due - time.perf_counter()))
+            tasks.append(asyncio.create_task(send(index + 1, due)))
+        await asyncio.gather(*tasks)
+        done.set()
+        await admin_task
+        return sorted(samples)
+
+    print(f"⏱️  Relay latency — {messages} messages every {interval * 1000:.0f} ms, "
+          f"{slow_query * 1000:.0f} ms admin query every {(slow_query + slow_pause) * 1000:.0f} ms")
+    print(f"   {'database path':<14} {'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9}")
+    results = {}
+    for label, relay, slow in (("blocking", relay_blocking, slow_blocking), ("async", relay_async, slow_async)):
+        samples = asyncio.run(run(relay, slow))
+        row = {q: percentile(samples, p) for q, p in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))}
+        print(f"   {label:<14} {row['p50']:>9.2f} {row['p95']:>9.2f} {row['p99']:>9.2f}")
+        results[label] = row
+    return results
+
+
+def bench_activity_writes(pairs=200, message_rate=0.5, duration=300.0, seed=19):
+    """users.last_active writes per relayed message, per-message UPDATE vs the write-behind buffer.
+
+    Each pair exchanges messages at `message_rate` per user per second
+    (virtual time); the buffer flushes every ACTIVITY_FLUSH_INTERVAL seconds.
+    """
+
+    rng = random.Random(seed)
+
+    class CountingSession:
+        statements = 0
+
+        def execute(self, statement, params=None):
+            CountingSession.statements += 1
+
+    buffer = database.ActivityBuffer()
+    session = CountingSession()
+    interval = database.ACTIVITY_FLUSH_INTERVAL
+    users = pairs * 2
+    messages = 0
+    now, next_flush = 0.0, interval
+    while now < duration:
+        now += rng.expovariate(users * message_rate)
+        while next_flush <= now:
+            buffer.flush(session)
+            next_flush += interval
+        buffer.touch(rng.randint(1, users), datetime.utcnow())
+        messages += 1
+    buffer.flush(session)
+
+    print(f"⏱️  Activity writes — {users} chatting users, {messages} messages over {duration:.0f}s, "
+          f"flush every {interval:.0f}s")
+    print(f"   per-message UPDATE: {messages} statements, {messages} row writes "
+          f"(plus {messages} SELECTs)")
+    print(f"   write-behind:       {session.statements} statements, {buffer.rows_written} row writes "
+          f"({buffer.rows_written / messages:.3f} rows/message, {messages / max(buffer.rows_written, 1):.0f}x fewer)")
+    return {"messages": messages, "legacy_statements": messages * 2, "legacy_row_writes": messages,
+            "buffered_statements": session.statements, "buffered_row_writes": buffer.rows_written}
+
+
+class LatencyConnection:
+    """sqlite3 connection that sleeps `latency` per statement, like a Postgres round-trip"""
+
+    def __init__(self, latency):
+        self.raw = sqlite3.connect(":memory:", check_same_thread=False)
+        self.latency = latency
+        self.statements = 0
+
+    def cursor(self):
+        return LatencyCursor(self, self.raw.cursor())
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+
+class LatencyCursor:
+    def __init__(self, connection, cursor):
+        self.connection = connection
+        self.cursor = cursor
+
+    def execute(self, *args):
+        self.connection.statements += 1
+        time.sleep(self.connection.latency)
+        return self.cursor.execute(*args)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+def bench_pool_overhead(updates=200, checkouts_per_update=3, latency=DB_LATENCY):
+    """DB round-trips and time per update with pre-ping on every checkout vs background validation.
+
+    Each update checks out `checkouts_per_update` sessions and runs one
+    query in each, as the handlers do.
+    """
+
+    from sqlalchemy import create_engine, text
+
+    results = {}
+    for label, pre_ping in (("pre-ping", True), ("background", False)):
+        connections = []
+
+        def connect():
+            connection = LatencyConnection(latency)
+            connections.append(connection)
+            return connection
+
+        class BenchPool(database.MonitoredQueuePool):
+            metrics = database.PoolMetrics(label)
+
+        bench_engine = create_engine("sqlite://", creator=connect, poolclass=BenchPool,
+                                     pool_size=database.DB_POOL_SIZE, max_overflow=database.DB_MAX_OVERFLOW,
+                                     pool_pre_ping=pre_ping)
+        BenchPool.metrics.attach(bench_engine)
+        start = time.perf_counter()
+        for _ in range(updates):
+            for _ in range(checkouts_per_update):
+                with bench_engine.connect() as conn:
+                    conn.execute(text("SELECT 1"))
+        elapsed = time.perf_counter() - start
+        statements = sum(connection.statements for connection in connections)
+        stats = BenchPool.metrics.stats()
+        results[label] = {"statements_per_update": statements / updates, "ms_per_update": elapsed / updates * 1000,
+                          "checkouts": stats["checkouts"], "wait_avg_ms": stats["wait_avg_ms"]}
+
+    print(f"⏱️  Pool overhead — {updates} updates x {checkouts_per_update} checkouts, "
+          f"{latency * 1000:.0f} ms per round-trip")
+    for label, row in results.items():
+        print(f"   {label:<11} {row['statements_per_update']:.1f} round-trips/update, "
+              f"{row['ms_per_update']:.1f} ms/update, checkout wait avg {row['wait_avg_ms']:.3f} ms")
+    return results
+
+
+def bench_hot_queries(calls=2000):
+    """CPU per call of the hot reads, ORM query construction vs the prebuilt Core fast path.
+
+    Runs against in-memory sqlite so the numbers are almost entirely
+    Python-side work: building, compiling and materializing each query.
+    Every call gets a fresh session, as the handlers do.
+    """
+
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+
+    bench_engine = create_engine("sqlite://")
+    database.Base.metadata.create_all(bench_engine)
+    with Session(bench_engine) as db:
+        user = database.User(user_id=1, gender="male", nickname="bench", language="en")
+        user.interests = [database.Interest(name=f"interest{i}") for i in range(3)]
+        db.add_all([user, database.User(user_id=2, gender="female", nickname="other")])
+        db.add(database.ChatSession(user_a_id=1, user_b_id=2, is_active=True))
+        db.commit()
+
+    def legacy_get_user(db, user_id):
+        return db.query(database.User).filter(database.User.user_id == user_id).first()
+
+    def legacy_snapshot(db, user_id):
+        user = legacy_get_user(db, user_id)
+        return SimpleNamespace(**{column.key: getattr(user, column.key)
+                                  for column in database.User.__table__.columns if column.key != "last_active"})
+
+    def legacy_session_id(db, user_id):
+        session = db.query(database.ChatSession).filter(
+            (database.ChatSession.user_a_id == user_id) | (database.ChatSession.user_b_id == user_id),
+            database.ChatSession.is_active == True
+        ).first()
+        return session.id if session else None
+
+    def legacy_waiter(db, user_id):
+        user = legacy_get_user(db, user_id)
+        return user, [interest.name for interest in user.interests]
+
+    pairs = [
+        ("get_user", legacy_get_user, database.get_user),
+        ("user snapshot", legacy_snapshot, database._load_user_snapshot),
+        ("active session id", legacy_session_id, database.get_active_session_id),
+        ("waiter profile", legacy_waiter, database.get_waiter_profile),
+    ]
+
+    def cpu_per_call(function):
+        for _ in range(50):  # warm SQLAlchemy's compiled cache
+            with Session(bench_engine) as db:
+                function(db, 1)
+        start = time.process_time()
+        for _ in range(calls):
+            with Session(bench_engine) as db:
+                function(db, 1)
+        return (time.process_time() - start) / calls * 1e6
+
+    print(f"⏱️  Hot reads — CPU µs per call over {calls} calls (sqlite, fresh session each)")
+    results = {}
+    for name, legacy, fast in pairs:
+        before, after = cpu_per_call(legacy), cpu_per_call(fast)
+        results[name] = {"orm_us": before, "fast_us": after}
+        print(f"   {name:<18} ORM {before:7.1f} µs   fast path {after:7.1f} µs   ({before / after:.1f}x)")
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    """Main function"""
+
+    parser = argparse.ArgumentParser(description="Matchmaking benchmarks")
+    parser.add_argument("rounds", nargs="?", type=int, default=2000, help="rounds per micro-benchmark")
+    parser.add_argument("--simulate", action="store_true", help="only run the load simulation")
+    parser.add_argument("--users", type=int, default=5000, help="simulated user population")
+    parser.add_argument("--duration", type=float, default=3600.0, help="simulated seconds")
+    parser.add_argument("--seed", type=int, default=17)
+    parser.add_argument("--json", metavar="PATH", help="write results as JSON to PATH")
+    args = parser.parse_args()
+
+    print("🤖 Matchmaking Benchmarks")
+    print("=" * 50)
+
+    results = {"commit": git_commit(), "python": sys.version.split()[0]}
+    if not args.simulate:
+        results["waiting_pool"] = bench_waiting_pool(rounds=args.rounds)
+        print()
+        results["match_throughput"] = bench_match_throughput()
+        print()
+        results["time_to_match"] = bench_time_to_match()
+        print()
+        results["preference_buckets"] = bench_preference_buckets()
+        print()
+        results["interest_matching"] = bench_interest_matching(rounds=args.rounds)
+        print()
+        results["recent_partners"] = bench_recent_partners()
+        print()
+        results["relay_latency"] = bench_relay_latency()
+        print()
+        results["activity_writes"] = bench_activity_writes()
+        print()
+        results["pool_overhead"] = bench_pool_overhead()
+        print()
+        results["hot_queries"] = bench_hot_queries()
+        print()
+    results["load_simulation"] = bench_load_simulation(users=args.users, duration=args.duration, seed=args.seed)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n📄 Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
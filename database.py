@@ -1,13 +1,24 @@
 import os
+import time
+import random
+import select
+import re
 import hashlib
+import threading
 import logging
-from datetime import datetime, timedelta
-from typing import List, Optional, Set
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, Text, ForeignKey, Table, BigInteger, Float, text
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Set, Tuple
+from sqlalchemy import inspect, create_engine, Column, Integer, String, Boolean, DateTime, Text, ForeignKey, Table, BigInteger, Float, text, event, or_, select as sa_select, bindparam
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship, scoped_session
+from sqlalchemy.orm import Session, sessionmaker, relationship, scoped_session
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.dialects.postgresql import ARRAY
-from contextlib import contextmanager
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from contextlib import asynccontextmanager, contextmanager
 
 logger = logging.getLogger(__name__)
 
@@ -16,17 +27,154 @@ DATABASE_URL = os.getenv('DATABASE_URL')
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL environment variable not set")
 
+# Read-through user cache: seconds an entry stays fresh, and max entries kept
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '60'))
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '50000'))
+# Write-behind last_active: seconds between bulk flushes of the activity buffer
+ACTIVITY_FLUSH_INTERVAL = float(os.getenv('ACTIVITY_FLUSH_INTERVAL', '5'))
+# Nickname allocator: seconds a handed-out name stays reserved in this process, and max names kept
+NICKNAME_RESERVATION_TTL = float(os.getenv('NICKNAME_RESERVATION_TTL', '600'))
+NICKNAME_RESERVATION_SIZE = int(os.getenv('NICKNAME_RESERVATION_SIZE', '10000'))
+# Days of per-user "active on day X" rows kept for the daily active counter
+DAILY_ACTIVE_RETENTION_DAYS = int(os.getenv('DAILY_ACTIVE_RETENTION_DAYS', '2'))
+# Closed chat_sessions partitions older than this many months are summarized and dropped
+CHAT_ARCHIVE_AFTER_MONTHS = int(os.getenv('CHAT_ARCHIVE_AFTER_MONTHS', '6'))
+# Seconds between runs of the partition maintenance / archival job
+CHAT_ARCHIVE_INTERVAL = float(os.getenv('CHAT_ARCHIVE_INTERVAL', '21600'))
+# Seconds between folds of points_ledger into users.points
+POINTS_COMPACT_INTERVAL = float(os.getenv('POINTS_COMPACT_INTERVAL', '60'))
+# Connection pools (each engine gets its own): persistent connections, extra ones under load,
+# seconds to wait for a free one, max connection age (-1 = never recycle)
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '3600'))
+# Seconds between background pings of idle pooled connections; the job is skipped
+# when DB_POOL_PRE_PING=1, which pings on every checkout instead
+DB_POOL_VALIDATE_INTERVAL = float(os.getenv('DB_POOL_VALIDATE_INTERVAL', '60'))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', '0') == '1'
+
 # Fix common URL issues for Vercel deployment
 if DATABASE_URL.startswith('postgres://'):
     DATABASE_URL = DATABASE_URL.replace('postgres://', 'postgresql://', 1)
 
 # Remove unsupported parameters for serverless
 if 'channel_binding=' in DATABASE_URL:
-    import re
     DATABASE_URL = re.sub(r'[&?]channel_binding=[^&]*', '', DATABASE_URL)
 
-engine = create_engine(DATABASE_URL, pool_pre_ping=True, pool_recycle=300)
+
+class PoolMetrics:
+    """Counters for one engine's connection pool, fed by pool events.
+
+    Checkout waits are timed around the pool's own get, so they include
+    queueing for a free connection and opening overflow ones.
+    """
+
+    SLOW_WAIT = 0.1  # seconds
+
+    def __init__(self, name: str):
+        self.name = name
+        self.engine = None
+        self.checkouts = 0
+        self.connects = 0
+        self.recycles = 0
+        self.invalidations = 0
+        self.validations = 0
+        self.validation_failures = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.slow_waits = 0
+        self.overflow_peak = 0
+
+    def attach(self, sync_engine):
+        self.engine = sync_engine
+        event.listen(sync_engine, 'connect', self._on_connect)
+        event.listen(sync_engine, 'checkout', self._on_checkout)
+        event.listen(sync_engine, 'invalidate', self._on_invalidate)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        self.connects += 1
+        # record_info outlives the DBAPI connection; a reconnect that no invalidation explains is a recycle
+        if connection_record.record_info.pop('invalidated', False):
+            return
+        if connection_record.record_info.get('connected'):
+            self.recycles += 1
+        connection_record.record_info['connected'] = True
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        self.checkouts += 1
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        self.invalidations += 1
+        connection_record.record_info['invalidated'] = True
+
+    def record_wait(self, seconds: float, overflow: int):
+        self.wait_total += seconds
+        self.wait_max = max(self.wait_max, seconds)
+        if seconds >= self.SLOW_WAIT:
+            self.slow_waits += 1
+        self.overflow_peak = max(self.overflow_peak, overflow)
+
+    def stats(self) -> Dict[str, float]:
+        pool = self.engine.pool if self.engine is not None else None
+        return {
+            'size': pool.size() if pool else 0,
+            'checked_out': pool.checkedout() if pool else 0,
+            'idle': pool.checkedin() if pool else 0,
+            'overflow': max(pool.overflow(), 0) if pool else 0,
+            'overflow_peak': self.overflow_peak,
+            'checkouts': self.checkouts,
+            'wait_avg_ms': self.wait_total / self.checkouts * 1000 if self.checkouts else 0.0,
+            'wait_max_ms': self.wait_max * 1000,
+            'slow_waits': self.slow_waits,
+            'connects': self.connects,
+            'recycles': self.recycles,
+            'invalidations': self.invalidations,
+            'validations': self.validations,
+            'validation_failures': self.validation_failures,
+        }
+
+
+class _TimedCheckout:
+    """Pool mixin that reports how long each checkout waited to `metrics`"""
+
+    metrics: PoolMetrics
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self.metrics.record_wait(time.perf_counter() - started, self.overflow())
+
+
+class MonitoredQueuePool(_TimedCheckout, QueuePool):
+    metrics = PoolMetrics('sync')
+
+
+class MonitoredAsyncPool(_TimedCheckout, AsyncAdaptedQueuePool):
+    metrics = PoolMetrics('async')
+
+
+POOL_OPTIONS = {
+    'pool_size': DB_POOL_SIZE,
+    'max_overflow': DB_MAX_OVERFLOW,
+    'pool_timeout': DB_POOL_TIMEOUT,
+    'pool_recycle': DB_POOL_RECYCLE,
+    'pool_pre_ping': DB_POOL_PRE_PING,
+}
+# Let the OS notice dead peers on idle connections
+KEEPALIVE_ARGS = {'keepalives': 1, 'keepalives_idle': 30, 'keepalives_interval': 10, 'keepalives_count': 3}
+
+engine = create_engine(DATABASE_URL, poolclass=MonitoredQueuePool, connect_args=KEEPALIVE_ARGS, **POOL_OPTIONS)
+MonitoredQueuePool.metrics.attach(engine)
 SessionLocal = scoped_session(sessionmaker(autocommit=False, autoflush=False, bind=engine))
+
+# Async engine for handlers on the event loop (asyncpg spells sslmode as ssl)
+ASYNC_DATABASE_URL = DATABASE_URL.replace('postgresql://', 'postgresql+asyncpg://', 1).replace('sslmode=', 'ssl=')
+async_engine = create_async_engine(ASYNC_DATABASE_URL, poolclass=MonitoredAsyncPool, **POOL_OPTIONS)
+MonitoredAsyncPool.metrics.attach(async_engine.sync_engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
 # Many-to-many relationship table for user interests
@@ -47,6 +195,7 @@ class User(Base):
     gender = Column(String(10), nullable=False)  # 'male' or 'female'
     nickname = Column(String(100), nullable=False)
     language = Column(String(10), default='en')  # 'en' or 'si' (Sinhala)
+    preferred_gender = Column(String(10), nullable=True)  # partner gender wanted, None = anyone
     bio = Column(Text, nullable=True)
     age = Column(Integer, nullable=True)
     location = Column(String(100), nullable=True)
@@ -112,7 +261,7 @@ class UserReport(Base):
     id = Column(Integer, primary_key=True, autoincrement=True)
     reporter_id = Column(BigInteger, ForeignKey('users.user_id'), nullable=False)
     reported_id = Column(BigInteger, ForeignKey('users.user_id'), nullable=False)
-    chat_session_id = Column(Integer, ForeignKey('chat_sessions.id'), nullable=True)
+    chat_session_id = Column(Integer, nullable=True)  # no FK: old sessions are archived away
     reason = Column(Text, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     reviewed = Column(Boolean, default=False)
@@ -121,7 +270,6 @@ class UserReport(Base):
     
     reporter = relationship("User", foreign_keys=[reporter_id])
     reported_user = relationship("User", foreign_keys=[reported_id])
-    chat_session = relationship("ChatSession")
 
 class BroadcastMessage(Base):
     __tablename__ = 'broadcast_messages'
@@ -148,6 +296,229 @@ class SavedChat(Base):
 
 
 
+class ModerationFlags:
+    """Process-local copy of the users' moderation flags.
+
+    Loaded once at startup; the mutators below stage their changes on the
+    session and they are applied here only after that session commits. The
+    same changes are sent with NOTIFY in that transaction, and listen()
+    applies the ones committed by other replicas.
+    """
+
+    FLAGS = ('banned', 'silent_banned', 'muted', 'locked')
+    CHANNEL = 'moderation_flags'
+
+    def __init__(self):
+        self.banned: Set[int] = set()
+        self.silent_banned: Set[int] = set()
+        self.muted: Set[int] = set()
+        self.locked: Set[int] = set()
+        self.listener: Optional[threading.Thread] = None
+
+    def load(self, db):
+        """Rebuild all flag sets from the users table"""
+        rows = db.query(User.user_id, User.is_banned, User.is_silent_banned, User.is_muted, User.is_locked).filter(
+            or_(User.is_banned == True, User.is_silent_banned == True, User.is_muted == True, User.is_locked == True)
+        ).all()
+        self.banned = {row[0] for row in rows if row[1]}
+        self.silent_banned = {row[0] for row in rows if row[2]}
+        self.muted = {row[0] for row in rows if row[3]}
+        self.locked = {row[0] for row in rows if row[4]}
+        logger.info(f"Loaded moderation flags for {len(rows)} users")
+
+    @staticmethod
+    def payload(flag: str, user_id: int, value: bool) -> str:
+        return f"{flag}:{user_id}:{int(value)}"
+
+    def apply_payload(self, payload: str):
+        """Apply one NOTIFY payload built by payload()"""
+        try:
+            flag, user_id, value = payload.split(':')
+            if flag in self.FLAGS:
+                self.set_flag(flag, int(user_id), value == '1')
+        except ValueError:
+            logger.warning(f"Ignoring malformed moderation notification: {payload!r}")
+
+    def listen(self):
+        """Start the background thread that applies other replicas' changes"""
+        if self.listener is None or not self.listener.is_alive():
+            self.listener = threading.Thread(target=self._listen_forever, name='moderation-flags', daemon=True)
+            self.listener.start()
+
+    def _listen_forever(self):
+        delay = 1
+        while True:
+            connection = None
+            try:
+                connection = engine.raw_connection()
+                driver_connection = connection.driver_connection
+                driver_connection.autocommit = True
+                with driver_connection.cursor() as cursor:
+                    cursor.execute(f"LISTEN {self.CHANNEL}")
+                # Anything committed while we were not listening is only in the table
+                with get_db() as db:
+                    self.load(db)
+                delay = 1
+                while True:
+                    if not select.select([driver_connection], [], [], 60)[0]:
+                        continue
+                    driver_connection.poll()
+                    while driver_connection.notifies:
+                        self.apply_payload(driver_connection.notifies.pop(0).payload)
+            except Exception as e:
+                logger.warning(f"Moderation flag listener failed, retrying in {delay}s: {e}")
+            finally:
+                if connection is not None:
+                    try:
+                        connection.invalidate()
+                    except Exception:
+                        pass
+            time.sleep(delay)
+            delay = min(delay * 2, 60)
+
+    def set_flag(self, flag: str, user_id: int, value: bool):
+        flag_set = getattr(self, flag)
+        if value:
+            flag_set.add(user_id)
+        else:
+            flag_set.discard(user_id)
+
+    def can_match(self, user_id: int) -> bool:
+        """True unless the user is banned, silently banned or locked"""
+        return (user_id not in self.banned
+                and user_id not in self.silent_banned
+                and user_id not in self.locked)
+
+
+moderation_flags = ModerationFlags()
+
+
+def _stage_flag(db, flag: str, user_id: int, value: bool):
+    """Queue a moderation flag change to apply once `db` commits.
+
+    The NOTIFY is transactional too, so other replicas only see it on commit.
+    """
+    db.info.setdefault('moderation_flags', []).append((flag, user_id, value))
+    db.execute(text("SELECT pg_notify(:channel, :payload)"), {
+        'channel': ModerationFlags.CHANNEL,
+        'payload': ModerationFlags.payload(flag, user_id, value),
+    })
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_staged_flags(session):
+    for flag, user_id, value in session.info.pop('moderation_flags', []):
+        moderation_flags.set_flag(flag, user_id, value)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_staged_flags(session):
+    session.info.pop('moderation_flags', None)
+
+
+class UserCache:
+    """Per-process read-through cache of read-only user snapshots.
+
+    Entries expire after `ttl` seconds and the least recently used one is
+    evicted past `max_size`. Committed changes to a user invalidate its
+    entry; a read that overlapped an invalidation is not stored, so a stale
+    row can never be cached after the change that replaced it. Commits in
+    worker threads invalidate too, hence the lock.
+    """
+
+    def __init__(self, ttl: float = USER_CACHE_TTL, max_size: int = USER_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries: 'OrderedDict[int, Tuple[float, Optional[SimpleNamespace]]]' = OrderedDict()
+        self.generation = 0  # bumped by every invalidation
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.lock = threading.Lock()
+
+    def get(self, user_id: int) -> Tuple[bool, Optional[SimpleNamespace]]:
+        """(found, snapshot); a cached None means the user does not exist"""
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None or entry[0] < time.monotonic():
+                self.misses += 1
+                return False, None
+            self.entries.move_to_end(user_id)
+            self.hits += 1
+            return True, entry[1]
+
+    def put(self, user_id: int, snapshot: Optional[SimpleNamespace], generation: int):
+        """Store a snapshot read while the cache was at `generation`"""
+        with self.lock:
+            if generation != self.generation or self.max_size <= 0:
+                return
+            self.entries[user_id] = (time.monotonic() + self.ttl, snapshot)
+            self.entries.move_to_end(user_id)
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_id: int):
+        with self.lock:
+            self.generation += 1
+            self.invalidations += 1
+            self.entries.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
+
+
+user_cache = UserCache()
+
+# Touching last_active alone does not invalidate; snapshots leave it out.
+# points is only part of a balance (see get_points), so it is left out too.
+_SNAPSHOT_IGNORED = {'last_active', 'points'}
+
+
+def _stage_user_invalidation(db, user_id: int):
+    """Queue a user cache invalidation to apply once `db` commits"""
+    db.info.setdefault('user_cache', set()).add(user_id)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_user_invalidations(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if not isinstance(obj, User):
+            continue
+        state = inspect(obj)
+        if obj in session.dirty and not any(
+            state.attrs[attr.key].history.has_changes()
+            for attr in state.mapper.column_attrs if attr.key not in _SNAPSHOT_IGNORED
+        ):
+            continue
+        _stage_user_invalidation(session, obj.user_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_user_invalidations(session):
+    for user_id in session.info.pop('user_cache', ()):
+        user_cache.invalidate(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_user_invalidations(session):
+    session.info.pop('user_cache', None)
+
+
 @contextmanager
 def get_db():
     """Database session context manager"""
@@ -162,186 +533,815 @@ def get_db():
     finally:
         db.close()
 
-def init_database():
-    """Initialize database tables and add missing columns"""
+@asynccontextmanager
+async def get_async_db():
+    """Async database session context manager"""
+    db = AsyncSessionLocal()
     try:
-        Base.metadata.create_all(bind=engine)
-        logger.info("Database tables created successfully")
-        
-        # Add missing columns to existing tables (for migrations)
-        with engine.connect() as conn:
-            # Check and add missing columns to users table
-            missing_columns = [
-                ("language", "VARCHAR(10) DEFAULT 'en'"),
-                ("bio", "TEXT"),
-                ("age", "INTEGER"),
-                ("location", "VARCHAR(100)"),
-                ("mood", "VARCHAR(50)"),
-                ("total_chats", "INTEGER DEFAULT 0"),
-                ("reported_count", "INTEGER DEFAULT 0"),
-                ("is_banned", "BOOLEAN DEFAULT FALSE"),
-                ("is_muted", "BOOLEAN DEFAULT FALSE"),
-                ("ban_reason", "TEXT"),
-                ("ban_date", "TIMESTAMP"),
-                ("banned_by", "BIGINT"),
-                ("muted_by", "BIGINT"),
-                ("is_silent_banned", "BOOLEAN DEFAULT FALSE"),
-                ("silent_banned_by", "BIGINT"),
-                ("is_locked", "BOOLEAN DEFAULT FALSE"),
-                ("lock_reason", "TEXT"),
-                ("lock_date", "TIMESTAMP"),
-                ("locked_by", "BIGINT"),
-                ("unlock_points", "FLOAT DEFAULT 0.0"),
-                ("points", "FLOAT DEFAULT 0.0"),
-                ("referral_code", "VARCHAR(16)"),
-                ("referred_by", "BIGINT"),
-            ]
-            
-            for col_name, col_type in missing_columns:
-                try:
-                    conn.execute(text(f"ALTER TABLE users ADD COLUMN IF NOT EXISTS {col_name} {col_type}"))
-                    conn.commit()
-                except Exception:
-                    pass  # Column might already exist or other issue
-            
-            logger.info("Database migration completed successfully")
-
-            # Create or migrate saved chats table
+        yield db
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        logger.error(f"Database error: {e}")
+        raise
+    finally:
+        await db.close()
+
+
+class AsyncDatabase:
+    """Awaitable versions of the data-access functions below.
+
+    `await aio.get_user(db, user_id)` with `db` from get_async_db() runs
+    get_user on the AsyncSession without blocking the event loop, so every
+    function keeps one implementation and the same signature. Relationships
+    are not lazy-loaded on the loop; use helpers such as get_interest_names.
+    """
+
+    def __getattr__(self, name: str):
+        function = globals().get(name)
+        if name.startswith('_') or not callable(function):
+            raise AttributeError(name)
+
+        async def call(db, *args, **kwargs):
+            return await db.run_sync(function, *args, **kwargs)
+
+        call.__name__ = name
+        return call
+
+
+aio = AsyncDatabase()
+
+
+def pool_stats() -> Dict[str, Dict[str, float]]:
+    """Live metrics of the sync and async connection pools"""
+    return {
+        'sync': MonitoredQueuePool.metrics.stats(),
+        'async': MonitoredAsyncPool.metrics.stats(),
+    }
+
+
+def validate_idle_connections() -> int:
+    """Ping every idle connection of the sync pool once; returns how many failed.
+
+    This replaces pre-ping on every checkout: dead connections are found
+    here, off the request path, and SQLAlchemy invalidates the pool as soon
+    as any query hits a disconnect.
+    """
+    metrics = MonitoredQueuePool.metrics
+    held, failed = [], 0
+    try:
+        for _ in range(engine.pool.checkedin()):
+            conn = engine.connect()
+            held.append(conn)
             try:
-                conn.execute(text(
-                    """
-                    CREATE TABLE IF NOT EXISTS saved_chats (
-                        id SERIAL PRIMARY KEY,
-                        owner_id BIGINT,
-                        partner_id BIGINT,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                    """
-                ))
+                conn.exec_driver_sql("SELECT 1")
+                conn.rollback()
+            except Exception as e:
+                failed += 1
+                logger.warning(f"Dropped a dead pooled connection: {e}")
+    finally:
+        for conn in held:
+            conn.close()
+    metrics.validations += len(held)
+    metrics.validation_failures += failed
+    return failed
+
+
+async def validate_idle_async_connections() -> int:
+    """validate_idle_connections() for the async pool"""
+    metrics = MonitoredAsyncPool.metrics
+    held, failed = [], 0
+    try:
+        for _ in range(async_engine.sync_engine.pool.checkedin()):
+            conn = await async_engine.connect()
+            held.append(conn)
+            try:
+                await conn.exec_driver_sql("SELECT 1")
+                await conn.rollback()
+            except Exception as e:
+                failed += 1
+                logger.warning(f"Dropped a dead pooled async connection: {e}")
+    finally:
+        for conn in held:
+            await conn.close()
+    metrics.validations += len(held)
+    metrics.validation_failures += failed
+    return failed
+
+
+def _migrate_baseline(conn):
+    """Tables, added columns and saved_chats layout as of the first versioned release.
+
+    Every step is idempotent, so databases created by the old boot-time
+    DDL are brought to version 1 without changes.
+    """
+    Base.metadata.create_all(bind=conn)
+    conn.commit()
+    logger.info("Database tables created successfully")
+
+    # Add missing columns to existing tables (for migrations)
+    # Check and add missing columns to users table
+    missing_columns = [
+        ("language", "VARCHAR(10) DEFAULT 'en'"),
+        ("bio", "TEXT"),
+        ("age", "INTEGER"),
+        ("location", "VARCHAR(100)"),
+        ("mood", "VARCHAR(50)"),
+        ("total_chats", "INTEGER DEFAULT 0"),
+        ("reported_count", "INTEGER DEFAULT 0"),
+        ("is_banned", "BOOLEAN DEFAULT FALSE"),
+        ("is_muted", "BOOLEAN DEFAULT FALSE"),
+        ("ban_reason", "TEXT"),
+        ("ban_date", "TIMESTAMP"),
+        ("banned_by", "BIGINT"),
+        ("muted_by", "BIGINT"),
+        ("is_silent_banned", "BOOLEAN DEFAULT FALSE"),
+        ("silent_banned_by", "BIGINT"),
+        ("is_locked", "BOOLEAN DEFAULT FALSE"),
+        ("lock_reason", "TEXT"),
+        ("lock_date", "TIMESTAMP"),
+        ("locked_by", "BIGINT"),
+        ("unlock_points", "FLOAT DEFAULT 0.0"),
+        ("points", "FLOAT DEFAULT 0.0"),
+        ("referral_code", "VARCHAR(16)"),
+        ("referred_by", "BIGINT"),
+        ("preferred_gender", "VARCHAR(10)"),
+    ]
+    
+    for col_name, col_type in missing_columns:
+        try:
+            conn.execute(text(f"ALTER TABLE users ADD COLUMN IF NOT EXISTS {col_name} {col_type}"))
+            conn.commit()
+        except Exception:
+            pass  # Column might already exist or other issue
+    
+    logger.info("Database migration completed successfully")
+
+    # Startup recovery only reads open sessions; keep that off the full history
+    try:
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS idx_chat_sessions_active ON chat_sessions (started_at) WHERE is_active"
+        ))
+        conn.commit()
+    except Exception as index_error:
+        logger.warning(f"Active chat sessions index warning: {index_error}")
+        conn.rollback()
+
+    # Create or migrate saved chats table
+    try:
+        conn.execute(text(
+            """
+            CREATE TABLE IF NOT EXISTS saved_chats (
+                id SERIAL PRIMARY KEY,
+                owner_id BIGINT,
+                partner_id BIGINT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        ))
+        conn.commit()
+
+        saved_chat_columns = {
+            row[0]
+            for row in conn.execute(text(
+                "SELECT column_name FROM information_schema.columns WHERE table_schema = 'public' AND table_name = 'saved_chats'"
+            ))
+        }
+
+        if 'owner_id' not in saved_chat_columns:
+            conn.execute(text("ALTER TABLE saved_chats ADD COLUMN owner_id BIGINT"))
+            conn.commit()
+            if 'user_id' in saved_chat_columns:
+                conn.execute(text("UPDATE saved_chats SET owner_id = user_id WHERE owner_id IS NULL"))
                 conn.commit()
 
-                saved_chat_columns = {
-                    row[0]
-                    for row in conn.execute(text(
-                        "SELECT column_name FROM information_schema.columns WHERE table_schema = 'public' AND table_name = 'saved_chats'"
-                    ))
-                }
-
-                if 'owner_id' not in saved_chat_columns:
-                    conn.execute(text("ALTER TABLE saved_chats ADD COLUMN owner_id BIGINT"))
-                    conn.commit()
-                    if 'user_id' in saved_chat_columns:
-                        conn.execute(text("UPDATE saved_chats SET owner_id = user_id WHERE owner_id IS NULL"))
-                        conn.commit()
-
-                if 'partner_id' not in saved_chat_columns:
-                    conn.execute(text("ALTER TABLE saved_chats ADD COLUMN partner_id BIGINT"))
-                    conn.commit()
-                    if 'partner_user_id' in saved_chat_columns:
-                        conn.execute(text("UPDATE saved_chats SET partner_id = partner_user_id WHERE partner_id IS NULL"))
-                        conn.commit()
-
-                if 'user_id' in saved_chat_columns and 'owner_id' in saved_chat_columns:
-                    conn.execute(text("UPDATE saved_chats SET user_id = owner_id WHERE user_id IS NULL AND owner_id IS NOT NULL"))
-                    conn.commit()
-
-                if 'partner_user_id' in saved_chat_columns and 'partner_id' in saved_chat_columns:
-                    conn.execute(text("UPDATE saved_chats SET partner_user_id = partner_id WHERE partner_user_id IS NULL AND partner_id IS NOT NULL"))
-                    conn.commit()
-
-                conn.execute(text("ALTER TABLE saved_chats ADD COLUMN IF NOT EXISTS created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP"))
-                conn.execute(text("DELETE FROM saved_chats WHERE owner_id IS NULL OR partner_id IS NULL"))
+        if 'partner_id' not in saved_chat_columns:
+            conn.execute(text("ALTER TABLE saved_chats ADD COLUMN partner_id BIGINT"))
+            conn.commit()
+            if 'partner_user_id' in saved_chat_columns:
+                conn.execute(text("UPDATE saved_chats SET partner_id = partner_user_id WHERE partner_id IS NULL"))
                 conn.commit()
 
-                try:
-                    conn.execute(text("ALTER TABLE saved_chats ALTER COLUMN owner_id SET NOT NULL"))
-                    conn.execute(text("ALTER TABLE saved_chats ALTER COLUMN partner_id SET NOT NULL"))
-                    conn.commit()
-                except Exception as not_null_error:
-                    logger.warning(f"Saved chats NOT NULL migration warning: {not_null_error}")
-                    conn.rollback()
+        if 'user_id' in saved_chat_columns and 'owner_id' in saved_chat_columns:
+            conn.execute(text("UPDATE saved_chats SET user_id = owner_id WHERE user_id IS NULL AND owner_id IS NOT NULL"))
+            conn.commit()
+
+        if 'partner_user_id' in saved_chat_columns and 'partner_id' in saved_chat_columns:
+            conn.execute(text("UPDATE saved_chats SET partner_user_id = partner_id WHERE partner_user_id IS NULL AND partner_id IS NOT NULL"))
+            conn.commit()
+
+        conn.execute(text("ALTER TABLE saved_chats ADD COLUMN IF NOT EXISTS created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP"))
+        conn.execute(text("DELETE FROM saved_chats WHERE owner_id IS NULL OR partner_id IS NULL"))
+        conn.commit()
+
+        try:
+            conn.execute(text("ALTER TABLE saved_chats ALTER COLUMN owner_id SET NOT NULL"))
+            conn.execute(text("ALTER TABLE saved_chats ALTER COLUMN partner_id SET NOT NULL"))
+            conn.commit()
+        except Exception as not_null_error:
+            logger.warning(f"Saved chats NOT NULL migration warning: {not_null_error}")
+            conn.rollback()
+
+        conn.execute(text("CREATE INDEX IF NOT EXISTS idx_saved_chats_owner_id ON saved_chats(owner_id)"))
+        conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS uq_saved_chats_owner_partner ON saved_chats(owner_id, partner_id)"))
+        conn.commit()
+
+        try:
+            conn.execute(text(
+                """
+                DO $$
+                BEGIN
+                    IF NOT EXISTS (
+                        SELECT 1
+                        FROM pg_constraint
+                        WHERE conname = 'fk_saved_chats_owner_id'
+                    ) THEN
+                        ALTER TABLE saved_chats
+                        ADD CONSTRAINT fk_saved_chats_owner_id
+                        FOREIGN KEY (owner_id) REFERENCES users(user_id) ON DELETE CASCADE;
+                    END IF;
+                END
+                $$;
+                """
+            ))
+            conn.commit()
+        except Exception as owner_fk_error:
+            logger.warning(f"Saved chats owner FK migration warning: {owner_fk_error}")
+            conn.rollback()
+
+        try:
+            conn.execute(text(
+                """
+                DO $$
+                BEGIN
+                    IF NOT EXISTS (
+                        SELECT 1
+                        FROM pg_constraint
+                        WHERE conname = 'fk_saved_chats_partner_id'
+                    ) THEN
+                        ALTER TABLE saved_chats
+                        ADD CONSTRAINT fk_saved_chats_partner_id
+                        FOREIGN KEY (partner_id) REFERENCES users(user_id) ON DELETE CASCADE;
+                    END IF;
+                END
+                $$;
+                """
+            ))
+            conn.commit()
+        except Exception as partner_fk_error:
+            logger.warning(f"Saved chats partner FK migration warning: {partner_fk_error}")
+            conn.rollback()
+    except Exception as migration_error:
+        logger.error(f"Saved chats migration failed: {migration_error}")
+        conn.rollback()
+    reset_saved_chat_layout()
+
+
+# Indexes behind the hot queries; query_plans.py checks that they are used
+HOT_PATH_INDEXES = [
+    # get_active_chat_session: (user_a_id = ? OR user_b_id = ?) AND is_active
+    ("idx_chat_sessions_active_user_a", "chat_sessions (user_a_id) WHERE is_active"),
+    ("idx_chat_sessions_active_user_b", "chat_sessions (user_b_id) WHERE is_active"),
+    # get_active_users_count
+    ("idx_users_last_active", "users (last_active)"),
+    # nickname uniqueness checks
+    ("idx_users_nickname", "users (nickname)"),
+    # get_pending_reports
+    ("idx_user_reports_pending", "user_reports (created_at DESC) WHERE NOT reviewed"),
+    # moderation lists and ModerationFlags.load
+    ("idx_users_banned", "users (ban_date DESC) WHERE is_banned"),
+    ("idx_users_locked", "users (lock_date DESC) WHERE is_locked"),
+    ("idx_users_muted", "users (user_id) WHERE is_muted"),
+    ("idx_users_silent_banned", "users (user_id) WHERE is_silent_banned"),
+]
+
+
+def _migrate_hot_path_indexes(conn):
+    for name, definition in HOT_PATH_INDEXES:
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {definition}"))
+    conn.commit()
+
+
+NICKNAME_INDEX = 'uq_users_nickname'
+
+
+def _migrate_unique_nicknames(conn):
+    """Rename duplicate nicknames (the old picker reused its 50 names), then index them as unique"""
+    renamed = conn.execute(text(
+        """
+        UPDATE users SET nickname = LEFT(users.nickname, 79) || '-' || users.user_id
+        FROM (
+            SELECT user_id, ROW_NUMBER() OVER (PARTITION BY nickname ORDER BY created_at, user_id) AS position
+            FROM users
+        ) AS ranked
+        WHERE users.user_id = ranked.user_id AND ranked.position > 1
+        """
+    )).rowcount
+    if renamed:
+        logger.info(f"Renamed {renamed} duplicate nicknames")
+    conn.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS {NICKNAME_INDEX} ON users (nickname)"))
+    conn.execute(text("DROP INDEX IF EXISTS idx_users_nickname"))
+    conn.commit()
+
+
+def _migrate_stat_counters(conn):
+    """Counter tables for admin statistics, backfilled from the existing rows"""
+    conn.execute(text(
+        """
+        CREATE TABLE IF NOT EXISTS stat_counters (
+            name VARCHAR(50) PRIMARY KEY,
+            value BIGINT NOT NULL DEFAULT 0
+        )
+        """
+    ))
+    conn.execute(text(
+        """
+        CREATE TABLE IF NOT EXISTS daily_stats (
+            day DATE NOT NULL,
+            name VARCHAR(50) NOT NULL,
+            value BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, name)
+        )
+        """
+    ))
+    conn.execute(text(
+        """
+        CREATE TABLE IF NOT EXISTS daily_active_users (
+            day DATE NOT NULL,
+            user_id BIGINT NOT NULL,
+            PRIMARY KEY (day, user_id)
+        )
+        """
+    ))
+    for name, table, column in STAT_SOURCES:
+        conn.execute(text(
+            f"""
+            INSERT INTO stat_counters (name, value) SELECT :name, COUNT(*) FROM {table}
+            ON CONFLICT (name) DO UPDATE SET value = EXCLUDED.value
+            """
+        ), {'name': name})
+        conn.execute(text(
+            f"""
+            INSERT INTO daily_stats (day, name, value)
+            SELECT CAST({column} AS DATE), :name, COUNT(*) FROM {table} WHERE {column} IS NOT NULL
+            GROUP BY CAST({column} AS DATE)
+            ON CONFLICT (day, name) DO UPDATE SET value = EXCLUDED.value
+            """
+        ), {'name': name})
+    today = datetime.utcnow().date()
+    conn.execute(text(
+        """
+        INSERT INTO daily_active_users (day, user_id)
+        SELECT :today, user_id FROM users WHERE last_active >= :today
+        ON CONFLICT DO NOTHING
+        """
+    ), {'today': today})
+    conn.execute(text(
+        """
+        INSERT INTO daily_stats (day, name, value)
+        SELECT :today, 'active_users', COUNT(*) FROM daily_active_users WHERE day = :today
+        ON CONFLICT (day, name) DO UPDATE SET value = EXCLUDED.value
+        """
+    ), {'today': today})
+    conn.commit()
+
+
+def _migrate_partition_chat_sessions(conn):
+    """Rebuild chat_sessions as a partitioned table, in one transaction.
+
+    Open sessions live in the small chat_sessions_active partition; closed
+    ones move on UPDATE into chat_sessions_closed, which is partitioned by
+    started_at month so archive_chat_sessions() can drop whole months. The
+    copy rewrites the table once: on big deployments run
+    `python3 migrate.py upgrade` in a maintenance window.
+    """
+    # A partitioned chat_sessions cannot be an FK target on id alone
+    conn.execute(text(
+        """
+        DO $$
+        DECLARE fk_name TEXT;
+        BEGIN
+            FOR fk_name IN
+                SELECT conname FROM pg_constraint
+                WHERE conrelid = CAST('user_reports' AS regclass) AND confrelid = CAST('chat_sessions' AS regclass)
+            LOOP
+                EXECUTE format('ALTER TABLE user_reports DROP CONSTRAINT %I', fk_name);
+            END LOOP;
+        END
+        $$;
+        """
+    ))
+
+    sequence = conn.execute(text("SELECT pg_get_serial_sequence('chat_sessions', 'id')")).scalar()
+    if sequence:
+        conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY NONE"))
+    else:
+        sequence = 'chat_sessions_id_seq'
+        conn.execute(text(f"CREATE SEQUENCE IF NOT EXISTS {sequence}"))
+        conn.execute(text(f"SELECT setval('{sequence}', COALESCE((SELECT MAX(id) FROM chat_sessions), 0) + 1, false)"))
+    conn.execute(text("ALTER TABLE chat_sessions RENAME TO chat_sessions_unpartitioned"))
+
+    conn.execute(text(
+        f"""
+        CREATE TABLE chat_sessions (
+            id INTEGER NOT NULL DEFAULT nextval('{sequence}'),
+            user_a_id BIGINT NOT NULL REFERENCES users(user_id),
+            user_b_id BIGINT NOT NULL REFERENCES users(user_id),
+            started_at TIMESTAMP,
+            ended_at TIMESTAMP,
+            ended_by BIGINT,
+            is_active BOOLEAN NOT NULL DEFAULT TRUE,
+            report_count INTEGER DEFAULT 0
+        ) PARTITION BY LIST (is_active)
+        """
+    ))
+    conn.execute(text("CREATE TABLE chat_sessions_active PARTITION OF chat_sessions FOR VALUES IN (TRUE)"))
+    conn.execute(text(
+        "CREATE TABLE chat_sessions_closed PARTITION OF chat_sessions FOR VALUES IN (FALSE) PARTITION BY RANGE (started_at)"
+    ))
+    # Catches NULL started_at and months without a partition
+    conn.execute(text("CREATE TABLE chat_sessions_closed_default PARTITION OF chat_sessions_closed DEFAULT"))
+
+    oldest = conn.execute(text("SELECT MIN(started_at) FROM chat_sessions_unpartitioned")).scalar()
+    ensure_chat_session_partitions(conn, since=oldest.date() if oldest else None)
+    conn.execute(text(
+        """
+        INSERT INTO chat_sessions (id, user_a_id, user_b_id, started_at, ended_at, ended_by, is_active, report_count)
+        SELECT id, user_a_id, user_b_id, started_at, ended_at, ended_by, COALESCE(is_active, FALSE), report_count
+        FROM chat_sessions_unpartitioned
+        """
+    ))
+    conn.execute(text("DROP TABLE chat_sessions_unpartitioned"))
+    conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY chat_sessions.id"))
+
+    conn.execute(text("CREATE INDEX idx_chat_sessions_id ON chat_sessions (id)"))
+    conn.execute(text("CREATE INDEX idx_chat_sessions_active ON chat_sessions_active (started_at)"))
+    conn.execute(text("CREATE INDEX idx_chat_sessions_active_user_a ON chat_sessions_active (user_a_id)"))
+    conn.execute(text("CREATE INDEX idx_chat_sessions_active_user_b ON chat_sessions_active (user_b_id)"))
+    conn.execute(text(
+        """
+        CREATE TABLE IF NOT EXISTS chat_session_archive (
+            month DATE PRIMARY KEY,
+            sessions BIGINT NOT NULL DEFAULT 0,
+            reported_sessions BIGINT NOT NULL DEFAULT 0,
+            total_seconds BIGINT NOT NULL DEFAULT 0,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    ))
+    conn.commit()
+
+
+def _migrate_points_ledger(conn):
+    conn.execute(text(
+        """
+        CREATE TABLE IF NOT EXISTS points_ledger (
+            id BIGSERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            amount FLOAT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    ))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_points_ledger_user_id ON points_ledger (user_id)"))
+    conn.commit()
+
+
+def _migrate_shard_stat_counters(conn):
+    """Split each counter over STAT_COUNTER_SHARDS rows; existing totals stay in shard 0"""
+    for table, key in (('stat_counters', 'name'), ('daily_stats', 'day, name')):
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS shard SMALLINT NOT NULL DEFAULT 0"))
+        conn.execute(text(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {table}_pkey"))
+        conn.execute(text(f"ALTER TABLE {table} ADD PRIMARY KEY ({key}, shard)"))
+    conn.commit()
+
+
+# Ordered schema migrations: (version, description, function taking a Connection).
+# Append new entries; never edit or reorder applied ones.
+MIGRATIONS = [
+    (1, 'baseline schema', _migrate_baseline),
+    (2, 'hot-path indexes', _migrate_hot_path_indexes),
+    (3, 'unique nicknames', _migrate_unique_nicknames),
+    (4, 'statistics counters', _migrate_stat_counters),
+    (5, 'partitioned chat_sessions', _migrate_partition_chat_sessions),
+    (6, 'points ledger', _migrate_points_ledger),
+    (7, 'sharded statistics counters', _migrate_shard_stat_counters),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+SCHEMA_MIGRATION_LOCK = 0x616e6f6e6d6967  # pg advisory lock key shared by all replicas
+
+
+def get_schema_version(conn) -> int:
+    """Highest applied migration, 0 for a database that predates versioning"""
+    try:
+        return conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_version")).scalar()
+    except Exception:
+        conn.rollback()
+        return 0
 
-                conn.execute(text("CREATE INDEX IF NOT EXISTS idx_saved_chats_owner_id ON saved_chats(owner_id)"))
-                conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS uq_saved_chats_owner_partner ON saved_chats(owner_id, partner_id)"))
-                conn.commit()
 
-                try:
-                    conn.execute(text(
-                        """
-                        DO $$
-                        BEGIN
-                            IF NOT EXISTS (
-                                SELECT 1
-                                FROM pg_constraint
-                                WHERE conname = 'fk_saved_chats_owner_id'
-                            ) THEN
-                                ALTER TABLE saved_chats
-                                ADD CONSTRAINT fk_saved_chats_owner_id
-                                FOREIGN KEY (owner_id) REFERENCES users(user_id) ON DELETE CASCADE;
-                            END IF;
-                        END
-                        $$;
-                        """
-                    ))
-                    conn.commit()
-                except Exception as owner_fk_error:
-                    logger.warning(f"Saved chats owner FK migration warning: {owner_fk_error}")
-                    conn.rollback()
-
-                try:
-                    conn.execute(text(
-                        """
-                        DO $$
-                        BEGIN
-                            IF NOT EXISTS (
-                                SELECT 1
-                                FROM pg_constraint
-                                WHERE conname = 'fk_saved_chats_partner_id'
-                            ) THEN
-                                ALTER TABLE saved_chats
-                                ADD CONSTRAINT fk_saved_chats_partner_id
-                                FOREIGN KEY (partner_id) REFERENCES users(user_id) ON DELETE CASCADE;
-                            END IF;
-                        END
-                        $$;
-                        """
-                    ))
-                    conn.commit()
-                except Exception as partner_fk_error:
-                    logger.warning(f"Saved chats partner FK migration warning: {partner_fk_error}")
-                    conn.rollback()
-            except Exception as migration_error:
-                logger.error(f"Saved chats migration failed: {migration_error}")
-                conn.rollback()
+def run_migrations(conn) -> List[int]:
+    """Apply pending migrations in order under an advisory lock; returns the versions applied"""
+    conn.execute(text(
+        """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    ))
+    conn.commit()
+
+    conn.execute(text("SELECT pg_advisory_lock(:key)"), {'key': SCHEMA_MIGRATION_LOCK})
+    conn.commit()
+    try:
+        # Another replica may have migrated while we waited for the lock
+        current = get_schema_version(conn)
+        applied = []
+        for version, description, migrate in MIGRATIONS:
+            if version <= current:
+                continue
+            logger.info(f"Applying schema migration {version}: {description}")
+            migrate(conn)
+            conn.execute(text(
+                "INSERT INTO schema_version (version, description) VALUES (:version, :description)"
+            ), {'version': version, 'description': description})
+            conn.commit()
+            applied.append(version)
+        return applied
+    finally:
+        # A failed migration leaves the transaction aborted; end it so the unlock can run
+        conn.rollback()
+        conn.execute(text("SELECT pg_advisory_unlock(:key)"), {'key': SCHEMA_MIGRATION_LOCK})
+        conn.commit()
+
+
+def init_database():
+    """Bring the schema up to date; a current schema costs one query"""
+    started = time.perf_counter()
+    try:
+        with engine.connect() as conn:
+            current = get_schema_version(conn)
+            if current < SCHEMA_VERSION:
+                applied = run_migrations(conn)
+                logger.info(f"Schema migrated from version {current} to {SCHEMA_VERSION} (applied {applied})")
     except Exception as e:
-        logger.error(f"Failed to create database tables: {e}")
+        logger.error(f"Failed to migrate database schema: {e}")
         raise
+    logger.info(f"Database schema check took {(time.perf_counter() - started) * 1000:.1f} ms")
 
 def get_user(db, user_id: int) -> Optional[User]:
-    """Get user by ID"""
-    return db.query(User).filter(User.user_id == user_id).first()
+    """Get user by ID; no query if the session already holds it"""
+    return db.get(User, user_id)
+
+# Generated nicknames are adjective + noun + 0-999: 40 * 50 * 1000 = 2,000,000 names, at most 20 characters
+NICKNAME_ADJECTIVES = [
+    'Brave', 'Calm', 'Clever', 'Swift', 'Silent', 'Wild', 'Lucky', 'Happy', 'Bright', 'Quiet',
+    'Gentle', 'Bold', 'Noble', 'Lone', 'Little', 'Hidden', 'Roaming', 'Sleepy', 'Curious', 'Fuzzy',
+    'Jolly', 'Lazy', 'Misty', 'Rapid', 'Shy', 'Sunny', 'Witty', 'Zesty', 'Cozy', 'Daring',
+    'Eager', 'Fancy', 'Glowing', 'Humble', 'Icy', 'Kind', 'Lively', 'Merry', 'Nimble', 'Proud'
+]
+NICKNAME_NOUNS = [
+    'Phoenix', 'Shadow', 'Storm', 'Raven', 'Wolf', 'Tiger', 'Lion', 'Eagle', 'Bear', 'Fox',
+    'Cosmic', 'Nova', 'Star', 'Moon', 'Sun', 'Ocean', 'River', 'Mountain', 'Forest', 'Sky',
+    'Crimson', 'Azure', 'Golden', 'Silver', 'Emerald', 'Ruby', 'Sapphire', 'Diamond', 'Pearl', 'Jade',
+    'Thunder', 'Lightning', 'Blaze', 'Frost', 'Wind', 'Rain', 'Snow', 'Cloud', 'Mist', 'Dawn',
+    'Mystic', 'Sage', 'Dream', 'Vision', 'Spirit', 'Soul', 'Heart', 'Mind', 'Zen', 'Peace'
+]
+NICKNAME_SUFFIXES = 1000
+NICKNAME_ATTEMPTS = 8
+
+
+class NicknameAllocator:
+    """Hands out unique nicknames without reading the users table.
+
+    A name is drawn at random from the generated namespace and written in a
+    savepoint; the unique index on users.nickname is what guarantees
+    uniqueness, so a conflict only costs another draw. Names handed out or
+    claimed recently are reserved in memory, so concurrent registrations in
+    this process never wait on each other's uncommitted rows.
+    """
+
+    def __init__(self, ttl: float = NICKNAME_RESERVATION_TTL, max_size: int = NICKNAME_RESERVATION_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.reserved: 'OrderedDict[str, Tuple[float, int]]' = OrderedDict()  # oldest first
+        self.lock = threading.Lock()
+        self.allocations = 0
+        self.conflicts = 0
+
+    @property
+    def namespace(self) -> int:
+        return len(NICKNAME_ADJECTIVES) * len(NICKNAME_NOUNS) * NICKNAME_SUFFIXES
+
+    @staticmethod
+    def candidate() -> str:
+        return f"{random.choice(NICKNAME_ADJECTIVES)}{random.choice(NICKNAME_NOUNS)}{random.randrange(NICKNAME_SUFFIXES)}"
+
+    def reserve(self, nickname: str, user_id: int) -> bool:
+        """Reserve `nickname` for `user_id`; False if another user in this process holds it"""
+        now = time.monotonic()
+        with self.lock:
+            while self.reserved:
+                oldest = next(iter(self.reserved.values()))
+                if oldest[0] >= now and len(self.reserved) < self.max_size:
+                    break
+                self.reserved.popitem(last=False)
+            entry = self.reserved.get(nickname)
+            if entry is not None and entry[1] != user_id:
+                return False
+            self.reserved[nickname] = (now + self.ttl, user_id)
+            self.reserved.move_to_end(nickname)
+            return True
+
+    def _write(self, db, user: User, nickname: str) -> bool:
+        """Set the nickname in a savepoint; False if the unique index rejects it"""
+        try:
+            with db.begin_nested():
+                user.nickname = nickname
+                db.add(user)
+                db.flush()
+            return True
+        except IntegrityError as e:
+            if NICKNAME_INDEX not in str(e.orig):
+                raise
+            self.conflicts += 1
+            return False
+
+    def allocate(self, db, user: User) -> str:
+        """Give `user` a fresh generated nickname and flush it"""
+        for _ in range(NICKNAME_ATTEMPTS):
+            nickname = self.candidate()
+            if self.reserve(nickname, user.user_id) and self._write(db, user, nickname):
+                self.allocations += 1
+                return nickname
+        # Only reachable with the namespace nearly full; user ids are unique
+        nickname = f"{random.choice(NICKNAME_NOUNS)}{user.user_id}"
+        if not self._write(db, user, nickname):
+            raise ValueError(f"Could not allocate a nickname for user {user.user_id}")
+        self.allocations += 1
+        return nickname
+
+    def claim(self, db, user: User, nickname: str) -> bool:
+        """Give `user` a chosen nickname; False if someone else has it"""
+        return self.reserve(nickname, user.user_id) and self._write(db, user, nickname)
+
+
+nickname_allocator = NicknameAllocator()
+
 
 def create_user(db, user_id: int, username: str, first_name: str, last_name: str, 
-               gender: str, nickname: str) -> User:
-    """Create a new user"""
+               gender: str, nickname: Optional[str] = None) -> User:
+    """Create a new user; without a nickname a unique one is allocated"""
     user = User(
         user_id=user_id,
         username=username,
         first_name=first_name,
         last_name=last_name,
-        gender=gender,
-        nickname=nickname
+        gender=gender
     )
-    db.add(user)
-    db.flush()
+    if nickname is None:
+        nickname_allocator.allocate(db, user)
+    else:
+        user.nickname = nickname
+        db.add(user)
+        db.flush()
+    bump_counter(db, 'users')
     return user
 
+# Hot-path reads: Core statements built once at import, so SQLAlchemy compiles each
+# once per engine and returns plain rows without ORM identity tracking
+_users_table = User.__table__
+_chat_sessions_table = ChatSession.__table__
+_SELECT_USER_SNAPSHOT = sa_select(
+    *[column for column in _users_table.columns if column.key not in _SNAPSHOT_IGNORED]
+).where(_users_table.c.user_id == bindparam('user_id'))
+_SELECT_INTEREST_NAMES = sa_select(user_interests.c.interest_name).where(
+    user_interests.c.user_id == bindparam('user_id')
+)
+_SELECT_ACTIVE_SESSION_ID = sa_select(_chat_sessions_table.c.id).where(
+    or_(_chat_sessions_table.c.user_a_id == bindparam('user_id'), _chat_sessions_table.c.user_b_id == bindparam('user_id')),
+    _chat_sessions_table.c.is_active == True
+).limit(1)
+
+
+def _load_user_snapshot(db, user_id: int) -> Optional[SimpleNamespace]:
+    row = db.connection().execute(_SELECT_USER_SNAPSHOT, {'user_id': user_id}).first()
+    return SimpleNamespace(**row._mapping) if row is not None else None
+
+def get_interest_names_by_id(db, user_id: int) -> List[str]:
+    """Interest names of a user without loading the user"""
+    return list(db.connection().execute(_SELECT_INTEREST_NAMES, {'user_id': user_id}).scalars())
+
+def get_active_session_id(db, user_id: int) -> Optional[int]:
+    """Id of the user's open chat_sessions row, without building an ORM object"""
+    return db.connection().execute(_SELECT_ACTIVE_SESSION_ID, {'user_id': user_id}).scalar()
+
+def get_waiter_profile(db, user_id: int) -> Optional[Tuple[SimpleNamespace, List[str]]]:
+    """(user snapshot, interest names) for matchmaking, or None if the user does not exist"""
+    snapshot = _load_user_snapshot(db, user_id)
+    if snapshot is None:
+        return None
+    return snapshot, get_interest_names_by_id(db, user_id)
+
+async def get_user_snapshot(user_id: int) -> Optional[SimpleNamespace]:
+    """Read-only copy of a user's columns, served from user_cache when fresh"""
+    found, snapshot = user_cache.get(user_id)
+    if found:
+        return snapshot
+    generation = user_cache.generation
+    async with get_async_db() as db:
+        snapshot = await db.run_sync(_load_user_snapshot, user_id)
+    user_cache.put(user_id, snapshot, generation)
+    return snapshot
+
+def get_total_users_count(db) -> int:
+    """Get count of all registered users"""
+    return db.query(User).count()
+
+def get_interest_names(db, user: User) -> List[str]:
+    """Get the interest names of a user loaded in `db`"""
+    return [interest.name for interest in user.interests]
+
+class ActivityBuffer:
+    """Write-behind buffer for users.last_active.
+
+    touch() only records the latest timestamp per user in memory; flush()
+    writes everything pending with one multi-row UPDATE. The bot flushes
+    every ACTIVITY_FLUSH_INTERVAL seconds and on shutdown.
+    """
+
+    def __init__(self):
+        self.pending: Dict[int, datetime] = {}
+        self.lock = threading.Lock()
+        self.pruned_on = None  # UTC day old daily_active_users rows were last deleted
+        self.touches = 0
+        self.flushes = 0
+        self.rows_written = 0
+
+    def touch(self, user_id: int, when: Optional[datetime] = None):
+        with self.lock:
+            self.pending[user_id] = when or datetime.utcnow()
+            self.touches += 1
+
+    def flush(self, db=None) -> int:
+        """Write pending timestamps; returns the number of users written"""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return 0
+        try:
+            if db is None:
+                with get_db() as db:
+                    self._write(db, pending)
+            else:
+                self._write(db, pending)
+        except Exception:
+            # Put them back unless a newer touch already replaced them
+            with self.lock:
+                for user_id, when in pending.items():
+                    if user_id not in self.pending or self.pending[user_id] < when:
+                        self.pending[user_id] = when
+            raise
+        self.flushes += 1
+        self.rows_written += len(pending)
+        return len(pending)
+
+    def _write(self, db, pending: Dict[int, datetime]):
+        """Update last_active and count each user's first activity of the day, in one statement"""
+        db.execute(text(
+            """
+            WITH touched AS (
+                UPDATE users SET last_active = GREATEST(users.last_active, batch.last_active)
+                FROM unnest(CAST(:user_ids AS BIGINT[]), CAST(:last_active AS TIMESTAMP[])) AS batch(user_id, last_active)
+                WHERE users.user_id = batch.user_id
+                RETURNING users.user_id, CAST(batch.last_active AS DATE) AS day
+            ), first_today AS (
+                INSERT INTO daily_active_users (day, user_id)
+                SELECT day, user_id FROM touched
+                ON CONFLICT DO NOTHING
+                RETURNING day
+            )
+            INSERT INTO daily_stats (day, name, shard, value)
+            SELECT day, 'active_users', :shard, COUNT(*) FROM first_today GROUP BY day
+            ON CONFLICT (day, name, shard) DO UPDATE SET value = daily_stats.value + EXCLUDED.value
+            """
+        ), {'user_ids': list(pending), 'last_active': list(pending.values()), 'shard': stat_shard()})
+
+        today = datetime.utcnow().date()
+        if self.pruned_on != today:
+            db.execute(text("DELETE FROM daily_active_users WHERE day < :cutoff"),
+                       {'cutoff': today - timedelta(days=DAILY_ACTIVE_RETENTION_DAYS - 1)})
+            self.pruned_on = today
+
+
+activity_buffer = ActivityBuffer()
+
+
 def update_user_activity(db, user_id: int):
-    """Update user's last activity"""
-    user = get_user(db, user_id)
-    if user:
-        user.last_active = datetime.utcnow()
-        db.flush()
+    """Update user's last activity (buffered; written by activity_buffer.flush)"""
+    activity_buffer.touch(user_id)
 
 def get_active_users_count(db) -> int:
     """Get count of users active in last 24 hours"""
@@ -357,6 +1357,8 @@ def ban_user(db, user_id: int, admin_id: int, reason: Optional[str] = None):
         user.ban_date = datetime.utcnow()
         user.banned_by = admin_id
         
+        _stage_flag(db, 'banned', user_id, True)
+        
         # Log admin action
         admin_action = AdminAction(
             admin_id=admin_id,
@@ -376,6 +1378,8 @@ def unban_user(db, user_id: int, admin_id: int):
         user.ban_date = None
         user.banned_by = None
         
+        _stage_flag(db, 'banned', user_id, False)
+        
         # Log admin action
         admin_action = AdminAction(
             admin_id=admin_id,
@@ -403,6 +1407,7 @@ def mute_user(db, user_id: int, admin_id: int):
     if user:
         user.is_muted = True
         user.muted_by = admin_id
+        _stage_flag(db, 'muted', user_id, True)
         admin_action = AdminAction(
             admin_id=admin_id,
             action_type='mute',
@@ -417,6 +1422,7 @@ def unmute_user(db, user_id: int, admin_id: int):
     if user:
         user.is_muted = False
         user.muted_by = None
+        _stage_flag(db, 'muted', user_id, False)
         admin_action = AdminAction(
             admin_id=admin_id,
             action_type='unmute',
@@ -437,6 +1443,7 @@ def silent_ban_user(db, user_id: int, admin_id: int):
     if user:
         user.is_silent_banned = True
         user.silent_banned_by = admin_id
+        _stage_flag(db, 'silent_banned', user_id, True)
         admin_action = AdminAction(
             admin_id=admin_id,
             action_type='silent_ban',
@@ -451,6 +1458,7 @@ def silent_unban_user(db, user_id: int, admin_id: int):
     if user:
         user.is_silent_banned = False
         user.silent_banned_by = None
+        _stage_flag(db, 'silent_banned', user_id, False)
         admin_action = AdminAction(
             admin_id=admin_id,
             action_type='silent_unban',
@@ -489,13 +1497,8 @@ def update_user_profile(db, user_id: int, field: str, value):
                 return False
         elif field == 'nickname':
             if len(value) >= 2 and len(value) <= 20:
-                existing = db.query(User).filter(
-                    User.nickname == value,
-                    User.user_id != user_id
-                ).first()
-                if existing:
+                if not nickname_allocator.claim(db, user, value):
                     return False
-                user.nickname = value
             else:
                 return False
         elif field == 'language':
@@ -503,68 +1506,187 @@ def update_user_profile(db, user_id: int, field: str, value):
                 user.language = value
             else:
                 return False
+        elif field == 'preferred_gender':
+            if value in ['male', 'female']:
+                user.preferred_gender = value
+            elif value == 'any':
+                user.preferred_gender = None
+            else:
+                return False
         
         user.last_active = datetime.utcnow()
         db.flush()
         return True
     return False
 
-def set_user_interests(db, user_id: int, interests_list: List[str]):
-    """Set user interests"""
-    user = get_user(db, user_id)
-    if not user:
-        return False
-    
-    # Clear existing interests
-    user.interests.clear()
-    
-    # Add new interests
+def normalize_interests(interests_list: List[str]) -> List[str]:
+    """Lowercase, trim and de-duplicate interest names, dropping invalid ones"""
+    names = []
     for interest_name in interests_list:
         interest_name = interest_name.strip().lower()
-        if interest_name and len(interest_name) <= 50:
-            # Get or create interest
-            interest = db.query(Interest).filter(
-                Interest.name == interest_name
-            ).first()
-            
-            if not interest:
-                interest = Interest(name=interest_name)
-                db.add(interest)
-                db.flush()
-            
-            user.interests.append(interest)
-    
-    user.last_active = datetime.utcnow()
-    db.flush()
+        if interest_name and len(interest_name) <= 50 and interest_name not in names:
+            names.append(interest_name)
+    return names
+
+# Interest names known to exist in the interests table; rows are never deleted
+known_interest_names: Set[str] = set()
+INTEREST_NAME_CACHE_SIZE = 10000
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_interest_names(session):
+    names = session.info.pop('interest_names', ())
+    if names and len(known_interest_names) + len(names) > INTEREST_NAME_CACHE_SIZE:
+        known_interest_names.clear()
+    known_interest_names.update(names)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_interest_names(session):
+    session.info.pop('interest_names', None)
+
+
+def set_user_interests(db, user_id: int, interests_list: List[str]):
+    """Replace a user's interests with set-based writes.
+
+    One upsert for interest names not already cached, then one statement
+    that deletes the dropped links and inserts the new ones.
+    """
+    names = normalize_interests(interests_list)
+    unknown = [name for name in names if name not in known_interest_names]
+    if unknown:
+        db.execute(text(
+            """
+            INSERT INTO interests (name, created_at)
+            SELECT name, :now FROM unnest(CAST(:names AS VARCHAR[])) AS name
+            ON CONFLICT (name) DO NOTHING
+            """
+        ), {'names': unknown, 'now': datetime.utcnow()})
+        # Cached only once this transaction commits the rows
+        db.info.setdefault('interest_names', set()).update(unknown)
+
+    found = db.execute(text(
+        """
+        WITH target AS (
+            SELECT user_id FROM users WHERE user_id = :user_id
+        ), removed AS (
+            DELETE FROM user_interests USING target
+            WHERE user_interests.user_id = target.user_id
+              AND NOT (user_interests.interest_name = ANY(CAST(:names AS VARCHAR[])))
+        ), added AS (
+            INSERT INTO user_interests (user_id, interest_name)
+            SELECT target.user_id, name FROM target CROSS JOIN unnest(CAST(:names AS VARCHAR[])) AS name
+            ON CONFLICT DO NOTHING
+        )
+        SELECT COUNT(*) FROM target
+        """
+    ), {'user_id': user_id, 'names': names}).scalar()
+    if not found:
+        return False
+
+    # A user already loaded in this session must not keep the old collection
+    user = db.identity_map.get(db.identity_key(User, user_id))
+    if user is not None:
+        db.expire(user, ['interests'])
+    activity_buffer.touch(user_id)
     return True
 
-def create_chat_session(db, user_a_id: int, user_b_id: int) -> ChatSession:
-    """Create a new chat session"""
-    session = ChatSession(
-        user_a_id=user_a_id,
-        user_b_id=user_b_id
-    )
-    db.add(session)
-    db.flush()
-    
-    # Update chat counts
-    user_a = get_user(db, user_a_id)
-    user_b = get_user(db, user_b_id)
-    if user_a:
-        user_a.total_chats += 1
-    if user_b:
-        user_b.total_chats += 1
-    
-    return session
+def create_chat_session(db, user_a_id: int, user_b_id: int) -> int:
+    """Create a chat session in one round-trip; returns its id"""
+    return create_chat_sessions(db, [(user_a_id, user_b_id)])[(user_a_id, user_b_id)]
+
+def create_chat_sessions(db, pairs: List[Tuple[int, int]]) -> Dict[Tuple[int, int], int]:
+    """Create many chat sessions, bump both users' chat counts and the chat statistics in one statement.
+
+    Returns the new session id for each (user_a_id, user_b_id) pair. The
+    increments are done by UPDATE in SQL, so concurrent matches of the same
+    user never lose one. Pairs must not share users, otherwise a user's
+    count is only bumped once.
+    """
+    if not pairs:
+        return {}
+    user_a_ids = [pair[0] for pair in pairs]
+    user_b_ids = [pair[1] for pair in pairs]
+    now = datetime.utcnow()
+    rows = db.execute(text(
+        """
+        WITH new_sessions AS (
+            INSERT INTO chat_sessions (user_a_id, user_b_id, started_at, is_active, report_count)
+            SELECT pair.user_a_id, pair.user_b_id, :started_at, TRUE, 0
+            FROM unnest(CAST(:user_a_ids AS BIGINT[]), CAST(:user_b_ids AS BIGINT[])) AS pair(user_a_id, user_b_id)
+            RETURNING id, user_a_id, user_b_id
+        ), counted AS (
+            UPDATE users SET total_chats = COALESCE(total_chats, 0) + 1
+            WHERE user_id = ANY(CAST(:user_a_ids AS BIGINT[]) || CAST(:user_b_ids AS BIGINT[]))
+        ), total AS (
+            INSERT INTO stat_counters (name, shard, value) SELECT 'chats', :shard, COUNT(*) FROM new_sessions
+            ON CONFLICT (name, shard) DO UPDATE SET value = stat_counters.value + EXCLUDED.value
+        ), today AS (
+            INSERT INTO daily_stats (day, name, shard, value) SELECT :day, 'chats', :shard, COUNT(*) FROM new_sessions
+            ON CONFLICT (day, name, shard) DO UPDATE SET value = daily_stats.value + EXCLUDED.value
+        )
+        SELECT id, user_a_id, user_b_id FROM new_sessions
+        """
+    ), {'started_at': now, 'day': now.date(), 'user_a_ids': user_a_ids, 'user_b_ids': user_b_ids,
+        'shard': stat_shard()}).fetchall()
+    for user_id in user_a_ids + user_b_ids:
+        _stage_user_invalidation(db, user_id)
+    return {(row[1], row[2]): row[0] for row in rows}
 
 def end_chat_session(db, session_id: int, ended_by: int):
-    """End a chat session"""
-    session = db.query(ChatSession).filter(ChatSession.id == session_id).first()
-    if session:
-        session.is_active = False
-        session.ended_at = datetime.utcnow()
-        session.ended_by = ended_by
-        db.flush()
+    """End a chat session; the row moves from the active partition into its month's"""
+    db.execute(text(
+        "UPDATE chat_sessions SET is_active = FALSE, ended_at = :now, ended_by = :ended_by WHERE id = :id AND is_active"
+    ), {'now': datetime.utcnow(), 'ended_by': ended_by, 'id': session_id})
+    session = db.identity_map.get(db.identity_key(ChatSession, session_id))
+    if session is not None:
+        db.expire(session)
+
+def recover_chat_sessions(db, max_age: timedelta) -> List[Tuple[int, int, int, datetime]]:
+    """Close orphaned chat sessions and return (id, user_a_id, user_b_id, started_at) of the rest.
+
+    Open sessions started before now - max_age, or with a banned, silently
+    banned or locked participant, are closed in bulk. Of the remaining ones
+    only the newest per user is kept, since a user can only be in one chat;
+    older duplicates are closed as well.
+    """
+    now = datetime.utcnow()
+    orphaned = db.execute(text(
+        """
+        WITH flagged AS (
+            SELECT user_id FROM users WHERE is_banned OR is_silent_banned OR is_locked
+        )
+        UPDATE chat_sessions SET is_active = FALSE, ended_at = :now
+        WHERE is_active AND (started_at < :cutoff OR started_at IS NULL
+                             OR user_a_id IN (SELECT user_id FROM flagged)
+                             OR user_b_id IN (SELECT user_id FROM flagged))
+        """
+    ), {'now': now, 'cutoff': now - max_age}).rowcount
+
+    rows = db.execute(text(
+        """
+        SELECT id, user_a_id, user_b_id, started_at FROM chat_sessions
+        WHERE is_active
+        ORDER BY started_at DESC, id DESC
+        """
+    )).fetchall()
+
+    live, superseded, seen = [], [], set()
+    for session_id, user_a_id, user_b_id, started_at in rows:
+        if user_a_id == user_b_id or user_a_id in seen or user_b_id in seen:
+            superseded.append(session_id)
+            continue
+        seen.update((user_a_id, user_b_id))
+        live.append((session_id, user_a_id, user_b_id, started_at))
+
+    if superseded:
+        db.execute(text(
+            "UPDATE chat_sessions SET is_active = FALSE, ended_at = :now WHERE id = ANY(CAST(:ids AS INTEGER[])) AND is_active"
+        ), {'now': now, 'ids': superseded})
+
+    db.flush()
+    logger.info(f"Closed {orphaned + len(superseded)} orphaned chat sessions")
+    return live
 
 def get_active_chat_session(db, user_id: int) -> Optional[ChatSession]:
     """Get user's active chat session"""
@@ -589,6 +1711,7 @@ def create_user_report(db, reporter_id: int, reported_id: int, chat_session_id:
         reported_user.reported_count += 1
     
     db.flush()
+    bump_counter(db, 'reports')
     return report
 
 def get_all_user_ids(db) -> List[int]:
@@ -611,6 +1734,7 @@ def create_broadcast_message(db, admin_id: int, message: str) -> BroadcastMessag
         broadcast_message=message
     )
     db.add(admin_action)
+    bump_counter(db, 'broadcasts')
     
     return broadcast
 
@@ -624,40 +1748,74 @@ def update_broadcast_stats(db, broadcast_id: int, sent_count: int, failed_count:
         db.flush()
 
 
-def _get_saved_chat_columns(db):
-    """Detect saved_chats owner/partner column names for legacy compatibility"""
-    rows = db.execute(text(
-        "SELECT column_name FROM information_schema.columns WHERE table_schema = 'public' AND table_name = 'saved_chats'"
-    )).fetchall()
-    columns = {row[0] for row in rows}
+class SavedChatLayout:
+    """Resolved saved_chats column names plus the statements built from them.
 
-    owner_col = 'owner_id' if 'owner_id' in columns else 'user_id' if 'user_id' in columns else None
-    partner_col = 'partner_id' if 'partner_id' in columns else 'partner_user_id' if 'partner_user_id' in columns else None
-    return owner_col, partner_col
+    Older deployments used user_id / partner_user_id; once those are
+    finalized (see migrate.py) every statement here is plain static SQL.
+    """
 
+    def __init__(self, columns: Set[str]):
+        self.columns = frozenset(columns)
+        self.owner_col = 'owner_id' if 'owner_id' in columns else 'user_id' if 'user_id' in columns else None
+        self.partner_col = 'partner_id' if 'partner_id' in columns else 'partner_user_id' if 'partner_user_id' in columns else None
+        self.legacy = bool(self.columns & {'user_id', 'partner_user_id'})
+        if not self.owner_col or not self.partner_col:
+            return
 
-def _get_saved_chat_column_set(db) -> Set[str]:
-    """Get all columns currently present in saved_chats table"""
-    rows = db.execute(text(
-        "SELECT column_name FROM information_schema.columns WHERE table_schema = 'public' AND table_name = 'saved_chats'"
-    )).fetchall()
-    return {row[0] for row in rows}
+        owner_col, partner_col = self.owner_col, self.partner_col
+        self.select_one = text(
+            f"SELECT id, {owner_col} AS owner_id, {partner_col} AS partner_id, created_at FROM saved_chats "
+            f"WHERE {owner_col} = :owner_id AND {partner_col} = :partner_id LIMIT 1"
+        )
+        self.select_owner = text(
+            f"SELECT id, {owner_col} AS owner_id, {partner_col} AS partner_id, created_at FROM saved_chats "
+            f"WHERE {owner_col} = :owner_id ORDER BY created_at DESC"
+        )
+        self.count_owner = text(f"SELECT COUNT(*) FROM saved_chats WHERE {owner_col} = :owner_id")
+        self.delete_one = text(
+            f"DELETE FROM saved_chats WHERE {owner_col} = :owner_id AND {partner_col} = :partner_id"
+        )
 
+        # Legacy columns that are still present get the same values
+        insert_fields = [owner_col, partner_col]
+        values_clause = [':owner_id', ':partner_id']
+        for legacy_col, param in (('user_id', ':owner_id'), ('partner_user_id', ':partner_id')):
+            if legacy_col in self.columns and legacy_col not in insert_fields:
+                insert_fields.append(legacy_col)
+                values_clause.append(param)
+        self.insert = text(
+            f"INSERT INTO saved_chats ({', '.join(insert_fields)}) VALUES ({', '.join(values_clause)}) RETURNING id, created_at"
+        )
 
-def get_saved_chat(db, owner_id: int, partner_id: int) -> Optional[SavedChat]:
-    """Get one saved chat for owner and partner"""
-    owner_col, partner_col = _get_saved_chat_columns(db)
-    if not owner_col or not partner_col:
-        return None
+    @property
+    def usable(self) -> bool:
+        return bool(self.owner_col and self.partner_col)
+
+
+_saved_chat_layout: Optional[SavedChatLayout] = None
 
-    query = text(
-        f"SELECT id, {owner_col} AS owner_id, {partner_col} AS partner_id, created_at FROM saved_chats "
-        f"WHERE {owner_col} = :owner_id AND {partner_col} = :partner_id LIMIT 1"
-    )
-    row = db.execute(query, {'owner_id': owner_id, 'partner_id': partner_id}).fetchone()
-    if not row:
-        return None
 
+def _get_saved_chat_layout(db) -> SavedChatLayout:
+    """Detect the saved_chats layout once per process"""
+    global _saved_chat_layout
+    if _saved_chat_layout is None:
+        rows = db.execute(text(
+            "SELECT column_name FROM information_schema.columns WHERE table_schema = 'public' AND table_name = 'saved_chats'"
+        )).fetchall()
+        _saved_chat_layout = SavedChatLayout({row[0] for row in rows})
+        if _saved_chat_layout.legacy:
+            logger.info("saved_chats still has legacy columns; run `python3 migrate.py finalize-saved-chats`")
+    return _saved_chat_layout
+
+
+def reset_saved_chat_layout():
+    """Forget the cached layout after a schema change"""
+    global _saved_chat_layout
+    _saved_chat_layout = None
+
+
+def _saved_chat_record(row) -> SavedChat:
     record = SavedChat()
     record.id = row[0]
     record.owner_id = row[1]
@@ -666,37 +1824,33 @@ def get_saved_chat(db, owner_id: int, partner_id: int) -> Optional[SavedChat]:
     return record
 
 
+def get_saved_chat(db, owner_id: int, partner_id: int) -> Optional[SavedChat]:
+    """Get one saved chat for owner and partner"""
+    layout = _get_saved_chat_layout(db)
+    if not layout.usable:
+        return None
+
+    row = db.execute(layout.select_one, {'owner_id': owner_id, 'partner_id': partner_id}).fetchone()
+    return _saved_chat_record(row) if row else None
+
+
 def get_saved_chats_for_owner(db, owner_id: int) -> List[SavedChat]:
     """Get all saved chats for one owner"""
-    owner_col, partner_col = _get_saved_chat_columns(db)
-    if not owner_col or not partner_col:
+    layout = _get_saved_chat_layout(db)
+    if not layout.usable:
         return []
 
-    query = text(
-        f"SELECT id, {owner_col} AS owner_id, {partner_col} AS partner_id, created_at FROM saved_chats "
-        f"WHERE {owner_col} = :owner_id ORDER BY created_at DESC"
-    )
-    rows = db.execute(query, {'owner_id': owner_id}).fetchall()
-
-    results = []
-    for row in rows:
-        record = SavedChat()
-        record.id = row[0]
-        record.owner_id = row[1]
-        record.partner_id = row[2]
-        record.created_at = row[3]
-        results.append(record)
-    return results
+    rows = db.execute(layout.select_owner, {'owner_id': owner_id}).fetchall()
+    return [_saved_chat_record(row) for row in rows]
 
 
 def count_saved_chats_for_owner(db, owner_id: int) -> int:
     """Count saved chats for one owner"""
-    owner_col, partner_col = _get_saved_chat_columns(db)
-    if not owner_col or not partner_col:
+    layout = _get_saved_chat_layout(db)
+    if not layout.usable:
         return 0
 
-    query = text(f"SELECT COUNT(*) FROM saved_chats WHERE {owner_col} = :owner_id")
-    return db.execute(query, {'owner_id': owner_id}).scalar() or 0
+    return db.execute(layout.count_owner, {'owner_id': owner_id}).scalar() or 0
 
 
 def create_saved_chat(db, owner_id: int, partner_id: int) -> Optional[SavedChat]:
@@ -705,38 +1859,11 @@ def create_saved_chat(db, owner_id: int, partner_id: int) -> Optional[SavedChat]
     if existing:
         return existing
 
-    owner_col, partner_col = _get_saved_chat_columns(db)
-    if not owner_col or not partner_col:
+    layout = _get_saved_chat_layout(db)
+    if not layout.usable:
         return None
 
-    columns = _get_saved_chat_column_set(db)
-    insert_fields = [owner_col, partner_col]
-    params = {
-        'owner_id': owner_id,
-        'partner_id': partner_id,
-    }
-
-    if 'user_id' in columns and 'user_id' not in insert_fields:
-        insert_fields.append('user_id')
-        params['user_id'] = owner_id
-
-    if 'partner_user_id' in columns and 'partner_user_id' not in insert_fields:
-        insert_fields.append('partner_user_id')
-        params['partner_user_id'] = partner_id
-
-    values_clause = []
-    for field in insert_fields:
-        if field == owner_col:
-            values_clause.append(':owner_id')
-        elif field == partner_col:
-            values_clause.append(':partner_id')
-        else:
-            values_clause.append(f':{field}')
-
-    insert_query = text(
-        f"INSERT INTO saved_chats ({', '.join(insert_fields)}) VALUES ({', '.join(values_clause)}) RETURNING id, created_at"
-    )
-    row = db.execute(insert_query, params).fetchone()
+    row = db.execute(layout.insert, {'owner_id': owner_id, 'partner_id': partner_id}).fetchone()
     if not row:
         return None
 
@@ -750,17 +1877,219 @@ def create_saved_chat(db, owner_id: int, partner_id: int) -> Optional[SavedChat]
 
 def delete_saved_chat(db, owner_id: int, partner_id: int) -> bool:
     """Delete one saved chat"""
-    owner_col, partner_col = _get_saved_chat_columns(db)
-    if not owner_col or not partner_col:
+    layout = _get_saved_chat_layout(db)
+    if not layout.usable:
         return False
 
-    delete_query = text(
-        f"DELETE FROM saved_chats WHERE {owner_col} = :owner_id AND {partner_col} = :partner_id"
-    )
-    result = db.execute(delete_query, {'owner_id': owner_id, 'partner_id': partner_id})
+    result = db.execute(layout.delete_one, {'owner_id': owner_id, 'partner_id': partner_id})
     return result.rowcount > 0
 
 
+def finalize_saved_chat_columns(conn) -> bool:
+    """Fold the legacy user_id / partner_user_id columns into owner_id / partner_id and drop them.
+
+    Offline migration: run it (migrate.py finalize-saved-chats) while no
+    bot process is writing saved chats. Returns False if nothing was left to do.
+    """
+    columns = {
+        row[0]
+        for row in conn.execute(text(
+            "SELECT column_name FROM information_schema.columns WHERE table_schema = 'public' AND table_name = 'saved_chats'"
+        ))
+    }
+    legacy = columns & {'user_id', 'partner_user_id'}
+    if not legacy:
+        return False
+
+    if 'user_id' in legacy:
+        conn.execute(text("UPDATE saved_chats SET owner_id = user_id WHERE owner_id IS NULL"))
+    if 'partner_user_id' in legacy:
+        conn.execute(text("UPDATE saved_chats SET partner_id = partner_user_id WHERE partner_id IS NULL"))
+    conn.execute(text("DELETE FROM saved_chats WHERE owner_id IS NULL OR partner_id IS NULL"))
+    for column in sorted(legacy):
+        conn.execute(text(f"ALTER TABLE saved_chats DROP COLUMN {column}"))
+    conn.commit()
+    reset_saved_chat_layout()
+    logger.info(f"Dropped legacy saved_chats columns: {', '.join(sorted(legacy))}")
+    return True
+
+
+# ─── Statistics ───────────────────────────────────────────────────────────────
+
+# Counted events: (counter name, source table, timestamp column) used by the backfill
+STAT_SOURCES = [
+    ('users', 'users', 'created_at'),
+    ('chats', 'chat_sessions', 'started_at'),
+    ('reports', 'user_reports', 'created_at'),
+    ('broadcasts', 'broadcast_messages', 'created_at'),
+]
+
+
+# Every counter is spread over this many rows so concurrent writers rarely
+# wait on each other's row lock; readers sum the shards.
+STAT_COUNTER_SHARDS = 16
+
+
+def stat_shard() -> int:
+    """Shard for the next counter write"""
+    return random.randrange(STAT_COUNTER_SHARDS)
+
+
+def bump_counter(db, name: str, amount: int = 1):
+    """Add `amount` to the running total and to today's rollup, in the caller's transaction"""
+    if amount <= 0:
+        return
+    db.execute(text(
+        """
+        WITH total AS (
+            INSERT INTO stat_counters (name, shard, value) VALUES (:name, :shard, :amount)
+            ON CONFLICT (name, shard) DO UPDATE SET value = stat_counters.value + EXCLUDED.value
+        )
+        INSERT INTO daily_stats (day, name, shard, value) VALUES (:day, :name, :shard, :amount)
+        ON CONFLICT (day, name, shard) DO UPDATE SET value = daily_stats.value + EXCLUDED.value
+        """
+    ), {'name': name, 'shard': stat_shard(), 'amount': amount, 'day': datetime.utcnow().date()})
+
+
+def get_stats(db) -> Dict[str, int]:
+    """Running totals plus today's rollups as 'today_<name>'; reads a handful of rows"""
+    rows = db.execute(text(
+        """
+        SELECT name, SUM(value) FROM stat_counters GROUP BY name
+        UNION ALL
+        SELECT 'today_' || name, SUM(value) FROM daily_stats WHERE day = :day GROUP BY name
+        """
+    ), {'day': datetime.utcnow().date()}).fetchall()
+    stats = {name: 0 for name, _, _ in STAT_SOURCES}
+    stats.update({f'today_{name}': 0 for name, _, _ in STAT_SOURCES})
+    stats['today_active_users'] = 0
+    stats.update({row[0]: row[1] for row in rows})
+    return stats
+
+
+# ─── Chat Session Partitions ─────────────────────────────────────────────────
+
+CHAT_PARTITION_MONTHS_AHEAD = 2
+CHAT_ARCHIVE_LOCK = 0x616e6f6e617263  # pg advisory lock key; one archiver at a time
+CHAT_ARCHIVE_DEFAULT_BATCH = 10000  # rows moved out of the default partition per transaction
+_CHAT_PARTITION_NAME = re.compile(r'^chat_sessions_(\d{4})_(\d{2})$')
+
+
+def _add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def ensure_chat_session_partitions(conn, since: Optional[date] = None):
+    """Create monthly closed-session partitions from `since` (default: this month) to a few months ahead.
+
+    Does not commit; the caller's transaction covers the DDL.
+    """
+    this_month = datetime.utcnow().date().replace(day=1)
+    month = (since or this_month).replace(day=1)
+    last = _add_months(this_month, CHAT_PARTITION_MONTHS_AHEAD)
+    while month <= last:
+        following = _add_months(month, 1)
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS chat_sessions_{month:%Y_%m} PARTITION OF chat_sessions_closed "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{following.isoformat()}')"
+        ))
+        month = following
+
+
+def archive_chat_sessions(keep_months: int = CHAT_ARCHIVE_AFTER_MONTHS) -> List[str]:
+    """Create upcoming partitions, then summarize and drop closed months older than `keep_months`.
+
+    Each month is folded into chat_session_archive and detached in its own
+    transaction. Rows in the default partition (NULL started_at, or months
+    that had no partition) match no month, so the old ones are summarized
+    and deleted in batches instead. Returns the partitions archived from.
+    """
+    cutoff = _add_months(datetime.utcnow().date().replace(day=1), -keep_months)
+    dropped = []
+    with engine.connect() as conn:
+        if not conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {'key': CHAT_ARCHIVE_LOCK}).scalar():
+            conn.rollback()
+            return dropped
+        try:
+            ensure_chat_session_partitions(conn)
+            conn.commit()
+
+            partitions = conn.execute(text(
+                """
+                SELECT child.relname FROM pg_inherits
+                JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+                WHERE pg_inherits.inhparent = CAST('chat_sessions_closed' AS regclass)
+                ORDER BY child.relname
+                """
+            )).scalars().all()
+            for name in partitions:
+                match = _CHAT_PARTITION_NAME.match(name)
+                if not match:
+                    continue
+                month = date(int(match.group(1)), int(match.group(2)), 1)
+                if month >= cutoff:
+                    continue
+                conn.execute(text(
+                    f"""
+                    INSERT INTO chat_session_archive (month, sessions, reported_sessions, total_seconds)
+                    SELECT :month, COUNT(*), COUNT(*) FILTER (WHERE report_count > 0),
+                           COALESCE(CAST(SUM(EXTRACT(EPOCH FROM ended_at - started_at)) AS BIGINT), 0)
+                    FROM {name}
+                    ON CONFLICT (month) DO UPDATE SET
+                        sessions = chat_session_archive.sessions + EXCLUDED.sessions,
+                        reported_sessions = chat_session_archive.reported_sessions + EXCLUDED.reported_sessions,
+                        total_seconds = chat_session_archive.total_seconds + EXCLUDED.total_seconds,
+                        archived_at = CURRENT_TIMESTAMP
+                    """
+                ), {'month': month})
+                conn.execute(text(f"ALTER TABLE chat_sessions_closed DETACH PARTITION {name}"))
+                conn.execute(text(f"DROP TABLE {name}"))
+                conn.commit()
+                dropped.append(name)
+                logger.info(f"Archived chat sessions of {month:%Y-%m}")
+
+            archived = 0
+            while True:
+                moved = conn.execute(text(
+                    """
+                    WITH moved AS (
+                        DELETE FROM chat_sessions_closed_default
+                        WHERE ctid IN (
+                            SELECT ctid FROM chat_sessions_closed_default
+                            WHERE started_at IS NULL OR started_at < :cutoff
+                            LIMIT :batch
+                        )
+                        RETURNING started_at, ended_at, report_count
+                    ), months AS (
+                        INSERT INTO chat_session_archive (month, sessions, reported_sessions, total_seconds)
+                        SELECT CAST(date_trunc('month', COALESCE(started_at, ended_at, CURRENT_TIMESTAMP)) AS DATE),
+                               COUNT(*), COUNT(*) FILTER (WHERE report_count > 0),
+                               COALESCE(CAST(SUM(EXTRACT(EPOCH FROM ended_at - started_at)) AS BIGINT), 0)
+                        FROM moved GROUP BY 1
+                        ON CONFLICT (month) DO UPDATE SET
+                            sessions = chat_session_archive.sessions + EXCLUDED.sessions,
+                            reported_sessions = chat_session_archive.reported_sessions + EXCLUDED.reported_sessions,
+                            total_seconds = chat_session_archive.total_seconds + EXCLUDED.total_seconds,
+                            archived_at = CURRENT_TIMESTAMP
+                    )
+                    SELECT COUNT(*) FROM moved
+                    """
+                ), {'cutoff': cutoff, 'batch': CHAT_ARCHIVE_DEFAULT_BATCH}).scalar()
+                conn.commit()
+                archived += moved
+                if moved < CHAT_ARCHIVE_DEFAULT_BATCH:
+                    break
+            if archived:
+                dropped.append('chat_sessions_closed_default')
+                logger.info(f"Archived {archived} chat sessions from the default partition")
+        finally:
+            conn.rollback()
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {'key': CHAT_ARCHIVE_LOCK})
+            conn.commit()
+    return dropped
+
+
 # ─── Referral & Points ───────────────────────────────────────────────────────
 
 def generate_referral_code(user_id: int) -> str:
@@ -779,30 +2108,100 @@ def ensure_referral_code(db, user_id: int) -> str:
 def get_user_by_referral_code(db, code: str) -> Optional['User']:
     return db.query(User).filter(User.referral_code == code.upper()).first()
 
+UNLOCK_POINTS_REQUIRED = 5.0
+POINTS_COMPACT_BATCH = 10000
+
+# A user's balance is users.points plus their not yet compacted ledger rows
+_POINTS_BALANCE = """
+    COALESCE(users.points, 0) + COALESCE((SELECT SUM(amount) FROM points_ledger WHERE points_ledger.user_id = users.user_id), 0)
+"""
+
 def add_points(db, user_id: int, amount: float) -> float:
-    user = get_user(db, user_id)
-    if user:
-        user.points = (user.points or 0.0) + amount
-        db.flush()
-        return user.points
-    return 0.0
+    """Append a points award to the ledger and return the new balance, in one statement.
+
+    Awards never update the users row, so a referrer whose link goes viral
+    is not a row-lock hotspot; compact_points_ledger() folds them in later.
+    """
+    balance = db.execute(text(
+        f"""
+        WITH entry AS (
+            INSERT INTO points_ledger (user_id, amount)
+            SELECT user_id, :amount FROM users WHERE user_id = :user_id
+            RETURNING amount
+        )
+        SELECT {_POINTS_BALANCE} + entry.amount FROM users, entry WHERE users.user_id = :user_id
+        """
+    ), {'user_id': user_id, 'amount': amount}).scalar()
+    return balance if balance is not None else 0.0
+
+def get_points(db, user_id: int) -> float:
+    """Current points balance, including awards not compacted yet"""
+    balance = db.execute(text(
+        f"SELECT {_POINTS_BALANCE} FROM users WHERE users.user_id = :user_id"
+    ), {'user_id': user_id}).scalar()
+    return balance if balance is not None else 0.0
+
+def compact_points_ledger(batch: int = POINTS_COMPACT_BATCH) -> int:
+    """Fold ledger rows into users.points, oldest first; returns how many were folded.
+
+    Each batch deletes its rows and adds their sums in one statement, so a
+    balance read never sees an award twice or not at all.
+    """
+    folded = 0
+    while True:
+        with get_db() as db:
+            moved = db.execute(text(
+                """
+                WITH moved AS (
+                    DELETE FROM points_ledger
+                    WHERE id IN (SELECT id FROM points_ledger ORDER BY id LIMIT :batch)
+                    RETURNING user_id, amount
+                ), totals AS (
+                    SELECT user_id, SUM(amount) AS amount, COUNT(*) AS entries FROM moved GROUP BY user_id
+                ), applied AS (
+                    UPDATE users SET points = COALESCE(users.points, 0) + totals.amount
+                    FROM totals WHERE users.user_id = totals.user_id
+                )
+                SELECT COALESCE(SUM(entries), 0) FROM totals
+                """
+            ), {'batch': batch}).scalar()
+        folded += moved
+        if moved < batch:
+            return folded
 
 def add_unlock_points(db, user_id: int, amount: float):
-    """Add unlock points to a locked user. Returns (new_unlock_pts, auto_unlocked)."""
-    user = get_user(db, user_id)
-    if not user or not user.is_locked:
+    """Add unlock points to a locked user. Returns (new_unlock_pts, auto_unlocked).
+
+    One UPDATE adds the points and, once they reach UNLOCK_POINTS_REQUIRED,
+    unlocks the account in the same statement, so concurrent referrals can
+    neither lose points nor unlock twice.
+    """
+    row = db.execute(text(
+        """
+        UPDATE users SET
+            unlock_points = CASE WHEN COALESCE(unlock_points, 0) + :amount >= :required THEN 0
+                                 ELSE COALESCE(unlock_points, 0) + :amount END,
+            is_locked = COALESCE(unlock_points, 0) + :amount < :required,
+            lock_reason = CASE WHEN COALESCE(unlock_points, 0) + :amount >= :required THEN NULL ELSE lock_reason END,
+            lock_date = CASE WHEN COALESCE(unlock_points, 0) + :amount >= :required THEN NULL ELSE lock_date END,
+            locked_by = CASE WHEN COALESCE(unlock_points, 0) + :amount >= :required THEN NULL ELSE locked_by END
+        WHERE user_id = :user_id AND is_locked
+        RETURNING unlock_points, is_locked, lock_reason, lock_date, locked_by
+        """
+    ), {'user_id': user_id, 'amount': amount, 'required': UNLOCK_POINTS_REQUIRED}).mappings().first()
+    if row is None:
         return (0.0, False)
-    user.unlock_points = (user.unlock_points or 0.0) + amount
-    db.flush()
-    if user.unlock_points >= 5.0:
-        user.is_locked = False
-        user.lock_reason = None
-        user.lock_date = None
-        user.locked_by = None
-        user.unlock_points = 0.0
-        db.flush()
-        return (5.0, True)
-    return (user.unlock_points, False)
+    # Refresh a loaded copy in place: expiring it would make the next attribute
+    # read lazy-load, which an AsyncSession caller cannot do outside run_sync.
+    user = db.identity_map.get(db.identity_key(User, user_id))
+    if user is not None:
+        for column, value in row.items():
+            set_committed_value(user, column, value)
+    _stage_user_invalidation(db, user_id)
+    if not row['is_locked']:
+        _stage_flag(db, 'locked', user_id, False)
+        return (UNLOCK_POINTS_REQUIRED, True)
+    return (row['unlock_points'], False)
 
 
 # ─── Lock / Unlock ────────────────────────────────────────────────────────────
@@ -815,6 +2214,7 @@ def lock_user(db, user_id: int, admin_id: int, reason: Optional[str] = None):
         user.lock_date = datetime.utcnow()
         user.locked_by = admin_id
         user.unlock_points = 0.0
+        _stage_flag(db, 'locked', user_id, True)
         admin_action = AdminAction(
             admin_id=admin_id, action_type='lock',
             target_user_id=user_id, reason=reason
@@ -830,6 +2230,7 @@ def unlock_user(db, user_id: int, admin_id: int):
         user.lock_date = None
         user.locked_by = None
         user.unlock_points = 0.0
+        _stage_flag(db, 'locked', user_id, False)
         admin_action = AdminAction(
             admin_id=admin_id, action_type='unlock',
             target_user_id=user_id
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Database Migrations
+Show or apply schema migrations: python3 migrate.py status | upgrade
+Run with the bot stopped: python3 migrate.py finalize-saved-chats
+Archive old chat sessions now (the bot also does this periodically): python3 migrate.py archive-chats
+Fold the points ledger into balances now (the bot also does this periodically): python3 migrate.py compact-points
+"""
+
+import sys
+import time
+
+import database
+
+
+def status():
+    """Print the schema version and how long the boot-time check takes"""
+
+    started = time.perf_counter()
+    with database.engine.connect() as conn:
+        connected = time.perf_counter()
+        current = database.get_schema_version(conn)
+    checked = time.perf_counter()
+
+    pending = [(version, description) for version, description, _ in database.MIGRATIONS if version > current]
+    print(f"🗄️  Schema version: {current} (latest {database.SCHEMA_VERSION})")
+    for version, description in pending:
+        print(f"   pending {version}: {description}")
+    if not pending:
+        print("✅ Schema is current")
+    print(f"⏱️  Boot check: {(checked - started) * 1000:.1f} ms "
+          f"(connect {(connected - started) * 1000:.1f} ms, version query {(checked - connected) * 1000:.1f} ms)")
+
+
+def upgrade():
+    """Apply pending migrations (the bot also does this on boot)"""
+
+    started = time.perf_counter()
+    with database.engine.connect() as conn:
+        applied = database.run_migrations(conn)
+    elapsed = (time.perf_counter() - started) * 1000
+    if applied:
+        print(f"✅ Applied migrations {', '.join(map(str, applied))} in {elapsed:.0f} ms")
+    else:
+        print(f"✅ Nothing to apply ({elapsed:.0f} ms)")
+
+
+def finalize_saved_chats():
+    """Drop the legacy saved_chats columns once their data lives in owner_id / partner_id"""
+
+    print("🗄️  Finalizing saved_chats columns...")
+    with database.engine.connect() as conn:
+        if database.finalize_saved_chat_columns(conn):
+            print("✅ Legacy user_id / partner_user_id columns dropped")
+        else:
+            print("✅ Nothing to do — saved_chats already uses owner_id / partner_id only")
+
+
+def archive_chats():
+    """Create upcoming chat_sessions partitions and archive old closed months now"""
+
+    print(f"🗄️  Archiving closed chat sessions older than {database.CHAT_ARCHIVE_AFTER_MONTHS} months...")
+    started = time.perf_counter()
+    dropped = database.archive_chat_sessions()
+    elapsed = (time.perf_counter() - started) * 1000
+    if dropped:
+        print(f"✅ Archived {', '.join(dropped)} in {elapsed:.0f} ms")
+    else:
+        print(f"✅ Nothing to archive ({elapsed:.0f} ms)")
+
+
+def compact_points():
+    """Fold every points_ledger row into users.points now"""
+
+    print("🌟 Compacting points ledger...")
+    started = time.perf_counter()
+    folded = database.compact_points_ledger()
+    elapsed = (time.perf_counter() - started) * 1000
+    print(f"✅ Folded {folded} ledger entries in {elapsed:.0f} ms")
+
+
+COMMANDS = {
+    "status": status,
+    "upgrade": upgrade,
+    "finalize-saved-chats": finalize_saved_chats,
+    "archive-chats": archive_chats,
+    "compact-points": compact_points,
+}
+
+
+def main():
+    """Main function"""
+
+    if len(sys.argv) != 2 or sys.argv[1] not in COMMANDS:
+        print("Usage: python3 migrate.py <command>")
+        print(f"Commands: {', '.join(COMMANDS)}")
+        sys.exit(1)
+
+    COMMANDS[sys.argv[1]]()
+
+
+if __name__ == "__main__":
+    main()
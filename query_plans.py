@@ -0,0 +1,456 @@
+#!/usr/bin/env python3
+"""
+Query Plan Checks
+Seeds an EMPTY scratch database with realistic volumes, runs the hot queries
+and fails if any of them sequentially scans a large table, a write sends
+more statements than its budget, concurrent matches lose a chat count or
+the moderation flag listener misses a NOTIFY:
+PLAN_CHECK_DATABASE_URL=postgresql://user@localhost/plans python3 query_plans.py
+Active-session lookup latency over a long history: python3 query_plans.py --history 10000000
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+# The database module builds its engine from DATABASE_URL at import time
+PLAN_CHECK_DATABASE_URL = os.getenv("PLAN_CHECK_DATABASE_URL")
+if not PLAN_CHECK_DATABASE_URL:
+    sys.exit("❌ Set PLAN_CHECK_DATABASE_URL to an empty scratch database")
+os.environ["DATABASE_URL"] = PLAN_CHECK_DATABASE_URL
+
+from sqlalchemy import event, text  # noqa: E402
+
+import database  # noqa: E402
+
+# Rows seeded per table; big enough that the planner prefers indexes where they exist
+VOLUMES = {
+    'users': 200_000,
+    'chat_sessions': 1_000_000,
+    'user_reports': 50_000,
+    'saved_chats': 100_000,
+    'user_interests': 600_000,
+}
+INTEREST_COUNT = 50
+ACTIVE_SESSIONS = 2_000
+HISTORY_MONTHS = 24  # --history rows are spread over this many past months
+HISTORY_CHUNK = 1_000_000
+
+# Round-trip budgets for multi-statement writes
+MAX_STATEMENTS = {
+    'set_user_interests': 2,
+    'create_chat_session': 1,
+    'add_points': 1,
+    'add_unlock_points': 1,
+}
+CONCURRENT_WORKERS = 8
+CONCURRENT_SESSIONS = 25  # per worker
+
+# Queries that read a whole table on purpose
+ALLOWED_SEQ_SCANS = {
+    'get_total_users_count',
+    'get_all_user_ids',
+}
+
+SEED_STATEMENTS = [
+    f"""
+    INSERT INTO users (user_id, first_name, gender, nickname, language, total_chats, created_at, last_active,
+                       reported_count, is_banned, ban_date, is_muted, is_silent_banned, is_locked, lock_date,
+                       unlock_points, points, referral_code)
+    SELECT i, 'User ' || i, CASE WHEN i % 2 = 0 THEN 'male' ELSE 'female' END, 'Nick' || i, 'en', i % 40,
+           now() - (i % 365) * interval '1 day', now() - (i % 129600) * interval '1 minute',
+           0, i % 200 = 0, CASE WHEN i % 200 = 0 THEN now() END, i % 211 = 0, i % 503 = 0,
+           i % 197 = 0, CASE WHEN i % 197 = 0 THEN now() END, 0, 0, 'R' || i
+    FROM generate_series(1, {VOLUMES['users']}) AS i
+    """,
+    f"""
+    INSERT INTO chat_sessions (user_a_id, user_b_id, started_at, ended_at, is_active, report_count)
+    SELECT (i * 7) % {VOLUMES['users']} + 1, (i * 13 + 1) % {VOLUMES['users']} + 1,
+           now() - ({VOLUMES['chat_sessions']} - i) * interval '10 seconds',
+           CASE WHEN i <= {VOLUMES['chat_sessions'] - ACTIVE_SESSIONS} THEN now() END,
+           i > {VOLUMES['chat_sessions'] - ACTIVE_SESSIONS}, 0
+    FROM generate_series(1, {VOLUMES['chat_sessions']}) AS i
+    """,
+    f"""
+    INSERT INTO user_reports (reporter_id, reported_id, reason, created_at, reviewed)
+    SELECT i % {VOLUMES['users']} + 1, (i * 17) % {VOLUMES['users']} + 1, 'spam',
+           now() - i * interval '1 minute', i % 100 <> 0
+    FROM generate_series(1, {VOLUMES['user_reports']}) AS i
+    """,
+    f"""
+    INSERT INTO saved_chats (owner_id, partner_id, created_at)
+    SELECT i % {VOLUMES['users']} + 1, (i * 31) % {VOLUMES['users']} + 1, now() - i * interval '1 minute'
+    FROM generate_series(1, {VOLUMES['saved_chats']}) AS i
+    """,
+    f"""
+    INSERT INTO interests (name, created_at)
+    SELECT 'interest' || i, now() FROM generate_series(1, {INTEREST_COUNT}) AS i
+    """,
+    f"""
+    INSERT INTO user_interests (user_id, interest_name)
+    SELECT DISTINCT i % {VOLUMES['users']} + 1, 'interest' || ((i * 7) % {INTEREST_COUNT} + 1)
+    FROM generate_series(1, {VOLUMES['user_interests']}) AS i
+    """,
+]
+
+
+def build_checks():
+    """(name, callable taking a session) for every query on a request path"""
+
+    user_id = 4242
+    partner_id = VOLUMES['users'] - 7
+    flags = database.ModerationFlags()
+    return [
+        ('get_user', lambda db: database.get_user(db, user_id)),
+        ('get_active_chat_session', lambda db: database.get_active_chat_session(db, user_id)),
+        ('get_active_users_count', lambda db: database.get_active_users_count(db)),
+        ('get_total_users_count', lambda db: database.get_total_users_count(db)),
+        ('get_interest_names', lambda db: database.get_interest_names(db, database.get_user(db, user_id))),
+        ('get_stats', lambda db: database.get_stats(db)),
+        ('get_pending_reports', lambda db: database.get_pending_reports(db)),
+        ('get_banned_users', lambda db: database.get_banned_users(db)),
+        ('get_muted_users', lambda db: database.get_muted_users(db)),
+        ('get_silent_banned_users', lambda db: database.get_silent_banned_users(db)),
+        ('get_locked_users', lambda db: database.get_locked_users(db)),
+        ('moderation_flags.load', lambda db: flags.load(db)),
+        ('set_user_interests', lambda db: database.set_user_interests(
+            db, user_id, [f'interest{i}' for i in range(1, 10)] + ['brand new'])),
+        ('create_user', lambda db: database.create_user(db, VOLUMES['users'] + 1, '', 'New', '', 'male')),
+        ('update_user_profile nickname', lambda db: database.update_user_profile(db, user_id, 'nickname', 'Nobody')),
+        ('get_user_by_referral_code', lambda db: database.get_user_by_referral_code(db, f'R{user_id}')),
+        ('ban_user', lambda db: database.ban_user(db, user_id, 1, 'plan check')),
+        ('create_chat_session', lambda db: database.create_chat_session(db, user_id, partner_id)),
+        ('create_chat_sessions', lambda db: database.create_chat_sessions(db, [(user_id, partner_id)])),
+        ('end_chat_session', lambda db: database.end_chat_session(db, VOLUMES['chat_sessions'], user_id)),
+        ('recover_chat_sessions', lambda db: database.recover_chat_sessions(db, timedelta(hours=12))),
+        ('activity flush', lambda db: database.activity_buffer._write(
+            db, {user_id: datetime.utcnow(), partner_id: datetime.utcnow()})),
+        ('get_saved_chat', lambda db: database.get_saved_chat(db, user_id, partner_id)),
+        ('get_saved_chats_for_owner', lambda db: database.get_saved_chats_for_owner(db, user_id)),
+        ('count_saved_chats_for_owner', lambda db: database.count_saved_chats_for_owner(db, user_id)),
+        ('delete_saved_chat', lambda db: database.delete_saved_chat(db, user_id, partner_id)),
+        ('create_user_report', lambda db: database.create_user_report(db, user_id, partner_id, None, 'plan check')),
+        ('add_points', lambda db: database.add_points(db, user_id, 1.0)),
+        ('get_points', lambda db: database.get_points(db, user_id)),
+        ('add_unlock_points', lambda db: database.add_unlock_points(db, 197, 0.5)),
+    ]
+
+
+def seed(conn):
+    """Migrate the empty database and fill it; refuses to touch one that has users"""
+
+    if database.get_schema_version(conn) == 0:
+        exists = conn.execute(text("SELECT to_regclass('users') IS NOT NULL")).scalar()
+        if exists:
+            sys.exit("❌ PLAN_CHECK_DATABASE_URL must point at an empty scratch database")
+        database.run_migrations(conn)
+    elif conn.execute(text("SELECT EXISTS (SELECT 1 FROM users)")).scalar():
+        print("♻️  Reusing seeded scratch database")
+        return
+    else:
+        database.run_migrations(conn)
+
+    oldest = datetime.utcnow() - timedelta(seconds=VOLUMES['chat_sessions'] * 10)
+    database.ensure_chat_session_partitions(conn, since=oldest.date())
+    for statement in SEED_STATEMENTS:
+        conn.execute(text(statement))
+    conn.commit()
+    conn.execute(text("ANALYZE"))
+    conn.commit()
+    print("🌱 Seeded " + ", ".join(f"{table} {rows:,}" for table, rows in VOLUMES.items()))
+
+
+def grow_history(conn, rows):
+    """Top up closed chat sessions to `rows`, spread over the last HISTORY_MONTHS months"""
+
+    existing = conn.execute(text("SELECT COUNT(*) FROM chat_sessions_closed")).scalar()
+    if existing >= rows:
+        return
+    since = database._add_months(datetime.utcnow().date().replace(day=1), -HISTORY_MONTHS)
+    database.ensure_chat_session_partitions(conn, since=since)
+    conn.commit()
+
+    span = HISTORY_MONTHS * 30 * 86400
+    users = VOLUMES['users']
+    for start in range(existing, rows, HISTORY_CHUNK):
+        end = min(start + HISTORY_CHUNK, rows)
+        conn.execute(text(
+            f"""
+            INSERT INTO chat_sessions (user_a_id, user_b_id, started_at, ended_at, is_active, report_count)
+            SELECT i % {users} + 1, (i * 13 + 1) % {users} + 1, started, started + interval '10 minutes', FALSE, 0
+            FROM (
+                SELECT i, now() - interval '1 day' - ((i * 7919) % {span}) * interval '1 second' AS started
+                FROM generate_series(CAST(:start AS BIGINT), CAST(:end AS BIGINT) - 1) AS i
+            ) AS history
+            """
+        ), {'start': start, 'end': end})
+        conn.commit()
+        print(f"   history {end:,}/{rows:,}")
+    conn.execute(text("ANALYZE chat_sessions"))
+    conn.commit()
+
+
+def time_active_lookups(iterations=200):
+    """p50 / p99 milliseconds of the active-session lookups, each in a rolled-back session"""
+
+    with database.engine.connect() as conn:
+        sessions = conn.execute(text(
+            "SELECT user_a_id, id FROM chat_sessions_active LIMIT :limit"
+        ), {'limit': iterations}).fetchall()
+    lookups = [
+        ('get_active_chat_session', lambda db, user_id, session_id: database.get_active_chat_session(db, user_id)),
+        ('end_chat_session', lambda db, user_id, session_id: database.end_chat_session(db, session_id, user_id)),
+    ]
+    results = {}
+    for name, lookup in lookups:
+        samples = []
+        for user_id, session_id in sessions:
+            db = database.SessionLocal()
+            try:
+                started = time.perf_counter()
+                lookup(db, user_id, session_id)
+                samples.append((time.perf_counter() - started) * 1000)
+            finally:
+                db.rollback()
+                database.SessionLocal.remove()
+        samples.sort()
+        results[name] = (samples[len(samples) // 2], samples[min(len(samples) - 1, int(len(samples) * 0.99))])
+    return results
+
+
+def check_concurrent_chat_counts():
+    """Match one user with several partners from many threads at once; returns True if no increment was lost"""
+
+    user_id = 777
+    partners = [1000 + worker for worker in range(CONCURRENT_WORKERS)]
+
+    def chat_counts():
+        with database.engine.connect() as conn:
+            rows = conn.execute(text(
+                "SELECT user_id, total_chats FROM users WHERE user_id = ANY(CAST(:ids AS BIGINT[]))"
+            ), {'ids': [user_id] + partners}).fetchall()
+        return dict(rows)
+
+    before = chat_counts()
+    barrier = threading.Barrier(CONCURRENT_WORKERS)
+    session_ids, errors = [], []
+
+    def worker(partner_id):
+        barrier.wait()
+        try:
+            for _ in range(CONCURRENT_SESSIONS):
+                with database.get_db() as db:
+                    session_ids.append(database.create_chat_session(db, user_id, partner_id))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            database.SessionLocal.remove()
+
+    threads = [threading.Thread(target=worker, args=(partner_id,)) for partner_id in partners]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    after = chat_counts()
+
+    # Close them again so reruns see the same hot partition
+    with database.engine.begin() as conn:
+        conn.execute(text(
+            "UPDATE chat_sessions SET is_active = FALSE, ended_at = now() WHERE id = ANY(CAST(:ids AS INTEGER[])) AND is_active"
+        ), {'ids': session_ids})
+
+    expected = CONCURRENT_WORKERS * CONCURRENT_SESSIONS
+    gained = after[user_id] - before[user_id]
+    partners_ok = all(after[partner] - before[partner] == CONCURRENT_SESSIONS for partner in partners)
+    ok = not errors and gained == expected and partners_ok and len(session_ids) == expected
+    status = "✅" if ok else "❌"
+    print(f"{status} concurrent create_chat_session  {CONCURRENT_WORKERS} threads x {CONCURRENT_SESSIONS}: "
+          f"total_chats +{gained} (expected +{expected}){'' if partners_ok else ', partner counts off'}")
+    for error in errors:
+        print(f"     {error}")
+    return ok
+
+
+def check_concurrent_points():
+    """Award one referrer points from many threads, then compact; returns True if no award was lost"""
+
+    user_id = 778
+    with database.get_db() as db:
+        before = database.get_points(db, user_id)
+    barrier = threading.Barrier(CONCURRENT_WORKERS)
+    errors = []
+
+    def worker():
+        barrier.wait()
+        try:
+            for _ in range(CONCURRENT_SESSIONS):
+                with database.get_db() as db:
+                    database.add_points(db, user_id, 1.0)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            database.SessionLocal.remove()
+
+    threads = [threading.Thread(target=worker) for _ in range(CONCURRENT_WORKERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    with database.get_db() as db:
+        awarded = database.get_points(db, user_id)
+    database.compact_points_ledger()
+    with database.get_db() as db:
+        compacted = database.get_points(db, user_id)
+
+    expected = CONCURRENT_WORKERS * CONCURRENT_SESSIONS
+    ok = not errors and awarded - before == expected and compacted == awarded
+    status = "✅" if ok else "❌"
+    print(f"{status} concurrent add_points              {CONCURRENT_WORKERS} threads x {CONCURRENT_SESSIONS}: "
+          f"points +{awarded - before:g} (expected +{expected}), {compacted:g} after compaction")
+    for error in errors:
+        print(f"     {error}")
+    return ok
+
+
+def check_flag_listener(timeout=10):
+    """Send a moderation NOTIFY from another connection; returns True once the listener applies it"""
+
+    flags = database.moderation_flags
+    user_id = VOLUMES['users'] + 2
+    flags.listen()
+    deadline = time.monotonic() + timeout
+    received = False
+    # The listener may still be connecting, so keep notifying until it picks one up
+    while not received and time.monotonic() < deadline:
+        with database.engine.begin() as conn:
+            conn.execute(text("SELECT pg_notify(:channel, :payload)"), {
+                'channel': flags.CHANNEL, 'payload': flags.payload('muted', user_id, True)})
+        for _ in range(10):
+            time.sleep(0.05)
+            if user_id in flags.muted:
+                received = True
+                break
+    flags.set_flag('muted', user_id, False)
+    status = "✅" if received else "❌"
+    print(f"{status} moderation flag listener          NOTIFY {'applied' if received else f'not applied within {timeout}s'}")
+    return received
+
+
+def capture(check):
+    """Run one check in a rolled-back session; returns the (statement, parameters) it sent"""
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')):
+            statements.append((statement, parameters))
+
+    db = database.SessionLocal()
+    event.listen(database.engine, 'before_cursor_execute', record)
+    try:
+        check(db)
+        db.flush()
+    finally:
+        event.remove(database.engine, 'before_cursor_execute', record)
+        db.rollback()
+        database.SessionLocal.remove()
+    # The saved_chats layout probe only runs once per process
+    return [(statement, parameters) for statement, parameters in statements
+            if 'information_schema' not in statement]
+
+
+def seq_scans(plan):
+    """Relations read by a Seq Scan anywhere in an EXPLAIN (FORMAT JSON) plan tree"""
+
+    found = []
+    if plan.get('Node Type') == 'Seq Scan':
+        relation = plan.get('Relation Name')
+        # Report partitions under their parent table
+        found.append('chat_sessions' if relation.startswith('chat_sessions_') else relation)
+    for child in plan.get('Plans', []):
+        found.extend(seq_scans(child))
+    return found
+
+
+def explain(statement, parameters):
+    raw = database.engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        cursor.execute("EXPLAIN (FORMAT JSON) " + statement, parameters)
+        plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]['Plan']
+    finally:
+        raw.rollback()
+        raw.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--verbose", action="store_true", help="print every statement and its top plan node")
+    parser.add_argument("--history", type=int, metavar="ROWS", help="grow closed chat sessions to ROWS and time active lookups")
+    args = parser.parse_args()
+
+    with database.engine.connect() as conn:
+        seed(conn)
+        if args.history:
+            grow_history(conn, args.history)
+
+    if args.history:
+        print(f"\n⏱️  Active-session lookups with {args.history:,} closed sessions")
+        for name, (p50, p99) in time_active_lookups().items():
+            print(f"   {name:<28} p50 {p50:.2f} ms   p99 {p99:.2f} ms")
+
+    failures, over_budgets = [], []
+    print(f"\n🔍 Query plans (no Seq Scan on {', '.join(VOLUMES)})")
+    print("-" * 72)
+    for name, check in build_checks():
+        statements = capture(check)
+        bad = []
+        for statement, parameters in statements:
+            plan = explain(statement, parameters)
+            scanned = [relation for relation in seq_scans(plan) if relation in VOLUMES]
+            if args.verbose:
+                print(f"   {plan['Node Type']:<20} {' '.join(statement.split())[:80]}")
+            if scanned and name not in ALLOWED_SEQ_SCANS:
+                bad.append((statement, scanned))
+        budget = MAX_STATEMENTS.get(name)
+        over_budget = budget is not None and len(statements) > budget
+        status = "❌" if bad or over_budget else "✅"
+        note = " (full read allowed)" if name in ALLOWED_SEQ_SCANS else ""
+        if budget is not None:
+            note += f" (budget {budget})"
+        print(f"{status} {name:<32} {len(statements)} statements{note}")
+        for statement, scanned in bad:
+            print(f"     Seq Scan on {', '.join(scanned)}: {' '.join(statement.split())[:100]}")
+        failures.extend(bad)
+        if over_budget:
+            over_budgets.append(name)
+
+    counts_ok = check_concurrent_chat_counts()
+    points_ok = check_concurrent_points()
+    listener_ok = check_flag_listener()
+
+    print("-" * 72)
+    if failures or over_budgets or not counts_ok or not points_ok or not listener_ok:
+        if failures:
+            print(f"❌ {len(failures)} statements scan large tables")
+        if over_budgets:
+            print(f"❌ Over their round-trip budget: {', '.join(over_budgets)}")
+        if not counts_ok:
+            print("❌ Concurrent matches lost chat count increments")
+        if not points_ok:
+            print("❌ Concurrent referrals lost points")
+        if not listener_ok:
+            print("❌ The moderation flag listener did not receive a NOTIFY")
+        sys.exit(1)
+    print("✅ Every hot query uses an index, stays within its round-trip budget, keeps counts exact and NOTIFYs arrive")
+
+
+if __name__ == "__main__":
+    main()